@@ -0,0 +1,115 @@
+"""
+.. module:: bitmaps
+   :synopsis: Vlan bitmap decoding and encoding, the string round trip against the byte level code
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Times decoding the vlan bitmaps of a whole switch (48 trunk ports, four 128 byte blocks each),
+and setting bits in a block, the way it used to be done (through hex and binary strings)
+and the way it is done now. The old code is kept here, only for comparison.
+
+    python benchmarks/bitmaps.py --repeat 20
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pysnmp.proto.rfc1902 import OctetString
+from cisco_switch import trunks
+from cisco_switch.trunks import TrunkState, bitmap_vlans, set_bits, table_vlans, BLOCK_SIZE
+
+__author__ = 'CVi'
+
+PORTS = 48
+# Vlans set in each bitmap; a trunk carrying every vlan, and one pruned to a few
+DENSITIES = {'all': 4094, 'pruned': 20}
+
+
+def _old_decode(val, first):
+    vlans = []
+    l = val.asOctets().hex().ljust(256, '0')
+    b = bin(int(l, 16))[2:].zfill(len(l)*4)
+    for i in range(len(b)):
+        if b[i] == "1":
+            vlans.append(first+i)
+    return vlans
+
+
+def _old_encode(vlans, status, offsets):
+    val_str = vlans.prettyPrint()
+    if val_str == "b''":
+        val_str = "0000"
+    l = val_str[2:].ljust(256, '0')
+    b = list(bin(int(l, 16))[2:].zfill(len(l)*4))
+    for i in offsets:
+        b[i] = status
+    return OctetString(binValue="".join(b))
+
+
+def _bitmap(count, rand):
+    data = bytearray(BLOCK_SIZE * 4)
+    for vlan in rand.sample(range(1, 4095), count):
+        data[vlan >> 3] |= 0x80 >> (vlan & 7)
+    return bytes(data)
+
+
+def _time(func, repeat):
+    """
+    :return: Best seconds per call of func
+    """
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def run(repeat):
+    rand = random.Random(1)
+    results = {}
+    for density, count in DENSITIES.items():
+        bitmaps = [_bitmap(count, rand) for port in range(PORTS)]
+        blocks = [[OctetString(bitmap[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE]) for block in range(4)]
+                  for bitmap in bitmaps]
+        table = {10101 + n: TrunkState(1, 1, 4, bitmap) for n, bitmap in enumerate(bitmaps)}
+
+        def old():
+            return [[vlan for block, val in enumerate(port) for vlan in _old_decode(val, block * 1024)]
+                    for port in blocks]
+
+        def new():
+            return [[vlan for block, val in enumerate(port) for vlan in bitmap_vlans(val.asOctets(), block * 1024)]
+                    for port in blocks]
+
+        expected = old()
+        if new() != expected or list(table_vlans(table).values()) != expected:
+            raise ValueError("The decoders disagree")
+        seconds = {'string round trip': _time(old, repeat), 'lookup table': _time(new, repeat),
+                   'table_vlans': _time(lambda: table_vlans(table), repeat)}
+        results['decode {0} ports, {1} vlans each'.format(PORTS, density)] = seconds
+
+    block = OctetString(_bitmap(DENSITIES['all'], rand)[:BLOCK_SIZE])
+    offsets = [5, 100, 1000]
+    if _old_encode(block, "0", offsets) != OctetString(set_bits(block.asOctets(), offsets, False)):
+        raise ValueError("The encoders disagree")
+    results['clear 3 bits in a block'] = {
+        'string round trip': _time(lambda: _old_encode(block, "0", offsets), repeat),
+        'set_bits': _time(lambda: OctetString(set_bits(block.asOctets(), offsets, False)), repeat)}
+
+    for name, seconds in results.items():
+        baseline = seconds['string round trip']
+        results[name] = {method: {'seconds': value, 'speedup': baseline / value} for method, value in seconds.items()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vlan bitmap decoding and encoding")
+    parser.add_argument('--repeat', type=int, default=20, help="Times to run each, the best counts")
+    args = parser.parse_args()
+    print(json.dumps({'numpy': trunks.numpy is not None, 'results': run(args.repeat)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
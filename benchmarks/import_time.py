@@ -0,0 +1,84 @@
+"""
+.. module:: import_time
+   :synopsis: Import and start-up time benchmark
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Measures, in fresh interpreters, how long `import cisco_switch` takes and how long
+the first SNMP request then spends setting up the engine, with and without MIBs.
+The baseline is what import used to cost: pysnmp's command generator and the MIBs loaded up-front.
+
+    python benchmarks/import_time.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+__author__ = 'CVi'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+SCENARIOS = {
+    # What import cost before the engine was made lazy
+    'eager (old import)': """
+import cisco_switch.snmp_funcs as sf
+sf.mibBuilder
+""",
+    'import': """
+import cisco_switch
+""",
+    'import + engine': """
+import cisco_switch.snmp_funcs as sf
+sf._command_generator()
+""",
+    'import + engine, no MIBs': """
+import cisco_switch.snmp_funcs as sf
+sf.LOAD_MIBS = False
+sf._command_generator()
+""",
+}
+
+TEMPLATE = """
+import time
+_start = time.perf_counter()
+{code}
+print(time.perf_counter() - _start)
+"""
+
+
+def run(code):
+    """
+    Runs code in a fresh interpreter and returns the seconds it took.
+
+    :type code: str
+    :rtype: float
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    out = subprocess.check_output([sys.executable, '-c', TEMPLATE.format(code=code)], env=env)
+    return float(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and start-up time of cisco_switch")
+    parser.add_argument('--runs', type=int, default=5, help="Interpreters started per scenario")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, code in SCENARIOS.items():
+        times = [run(code) for _ in range(args.runs)]
+        results[name] = {'median': statistics.median(times), 'min': min(times), 'max': max(times)}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            print("{0:<28} median {median:7.1f} ms   min {min:7.1f} ms   max {max:7.1f} ms".format(
+                name, **{k: v * 1000 for k, v in result.items()}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""
+.. module:: operations
+   :synopsis: Round trips, bytes and wall time per switch operation
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Runs the common switch operations, and a full TrunkManager.apply, against fleets of simulated switches
+and counts requests (PDUs, resends included), bytes both ways and the wall time.
+The counts are compared with the limits in thresholds.json; a change that adds round trips to
+one of these operations makes the run fail.
+
+The simulated switches are served by a separate process, so they do not compete with the
+switch handles for the interpreter, from UDP ports base-port and up.
+
+    python benchmarks/operations.py --sizes 10 100 1000 --output results.json
+
+The limits are per operation and result key; "errors", the switches the operation failed on, is one of them.
+The walks of switches with as many ports and vlans as in WALK_ENDS are checked as well.
+The exit status is 1 if any threshold was exceeded, or a walk was wrong.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cisco_switch import CiscoSwitch
+from cisco_switch.fleet import Fleet
+from cisco_switch.metrics import Metrics
+from cisco_switch.portindex import PortIndexStore
+from cisco_switch.simulator import SimulatedFleet
+from cisco_switch.snmp_funcs import add_hook, remove_hook
+from cisco_switch.trunkmanager import TrunkManager, Host, Vlan, Port
+
+__author__ = 'CVi'
+
+THRESHOLDS = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'thresholds.json')
+SIZES = (10, 100, 1000)
+WORKERS = 16
+BASE_PORT = 16100
+
+# Every simulated switch has 48 ports, of which the first two are trunks carrying every vlan, and vlans 1-10.
+PORTS = 48
+VLANS = 10
+TRUNK = 10101
+# (ports, vlans) of switches where a GETBULK walk of 25 rows at a time ends one row short of a full page;
+# there pysnmp hands back the varbind the walk ended on as a row of its own.
+WALK_ENDS = ((24, 24), (24, 49))
+
+
+def _create_and_delete_vlans(switch, vlanids):
+    """
+    Creates the vlans in one vlan edit transaction and deletes them in another,
+    so TrunkManager.apply finds the vlans as they were.
+    """
+    with switch.vlan_transaction() as transaction:
+        for vlanid in vlanids:
+            transaction.create_vlan(vlanid, "VLAN{0:04d}".format(vlanid))
+    with switch.vlan_transaction() as transaction:
+        for vlanid in vlanids:
+            transaction.delete_vlan(vlanid)
+
+
+OPERATIONS = {
+    'port_names': lambda switch: switch.port_names(),
+    'get_vlan_names': lambda switch: switch.get_vlan_names(),
+    'vlans_on_port': lambda switch: switch.vlans_on_port(portindex=TRUNK),
+    'interface_counters': lambda switch: switch.interface_counters(),
+    'trunk_table': lambda switch: switch.trunk_table(),
+    'snapshot': lambda switch: switch.snapshot(),
+    'changed_since': lambda switch: switch.changed_since(),
+    # One vlan in each 1024 vlan block
+    'activate_vlans_on_port': lambda switch: switch.activate_vlans_on_port(portindex=TRUNK + 2,
+                                                                           vlans=[5, 1500, 2500, 3500]),
+    # Eight trunks pruned to vlans 1-10 and eight access ports moved to vlan 2, none of them the ring's trunks
+    'set_port_vlans': lambda switch: switch.set_port_vlans(trunks={TRUNK + 2 + n: range(1, 11) for n in range(8)},
+                                                           access={TRUNK + 10 + n: 2 for n in range(8)}),
+    'create_vlan': lambda switch: switch.create_vlan(100, "benchmark"),
+    # Twenty vlans created, then deleted
+    'vlan_transaction': lambda switch: _create_and_delete_vlans(switch, range(200, 220)),
+}
+
+
+class _Host(Host):
+    def get_outgoing_links(self):
+        return self.others_dict['links']
+
+
+class _TrunkManager(TrunkManager):
+    """
+    Switches in a ring, each linked to the next by its first port and to the one before by its second.
+    Every switch is to have vlans 1-9 and 20, and carry them all on both trunks;
+    so vlan 10 is deleted, vlan 20 created and the trunks pruned from every vlan down to ten.
+    """
+    def __init__(self, targets, **kwargs):
+        self.targets = targets
+        count = len(targets)
+        vlans = {vlan_id: Vlan(vlan_id, "VLAN{0:04d}".format(vlan_id)) for vlan_id in list(range(1, 10)) + [20]}
+        TrunkManager.__init__(self, vlans, {host_id: sorted(vlans) for host_id in range(count)}, simulate=False,
+                              **kwargs)
+
+    def get_host(self, host_id):
+        count = len(self.targets)
+        links = [Port("Gi1/0/1", (host_id + 1) % count), Port("Gi1/0/2", (host_id - 1) % count)]
+        community, host, port = self.targets[host_id]
+        return _Host("sw{0}".format(host_id), host_id, host, port=port, links=links)
+
+    def get_snmp_port(self, host):
+        return host.others_dict['port']
+
+
+class _Warnings(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class _Simulator(object):
+    """
+    Simulated switches served by python -m cisco_switch.simulator.
+    """
+    def __init__(self, count, base_port):
+        self.count = count
+        self.base_port = base_port
+        self.process = None
+
+    def targets(self):
+        return [("public", "127.0.0.1", self.base_port + n) for n in range(self.count)]
+
+    def __enter__(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+        self.process = subprocess.Popen([sys.executable, '-m', 'cisco_switch.simulator', '--count', str(self.count),
+                                         '--base-port', str(self.base_port), '--ports', str(PORTS),
+                                         '--vlans', str(VLANS)], stdout=subprocess.PIPE, env=env)
+        # It says so once every switch is listening
+        if not self.process.stdout.readline():
+            raise IOError("The simulator did not start")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.process.terminate()
+        self.process.wait()
+
+
+def measure(count, run):
+    """
+    Runs run() and returns the requests it made.
+
+    :param count: Switches run() works on
+    :rtype: dict
+    """
+    metrics = Metrics()
+    add_hook(metrics)
+    try:
+        start = time.perf_counter()
+        errors = run()
+        wall = time.perf_counter() - start
+    finally:
+        remove_hook(metrics)
+    switches = metrics.report()['switches'].values()
+    pdus = sum(stats['pdus'] + stats['retries'] for stats in switches)
+    size = sum(stats['request_bytes'] + stats['response_bytes'] for stats in switches)
+    return {'switches': count, 'errors': errors, 'wall_seconds': wall, 'pdus': pdus, 'bytes': size,
+            'pdus_per_switch': pdus / count, 'bytes_per_switch': size / count, 'seconds_per_switch': wall / count}
+
+
+def run_size(count, workers, base_port):
+    """
+    Runs every operation on a fresh fleet of count switches.
+
+    :rtype: dict[str, dict]
+    """
+    results = {}
+    with _Simulator(count, base_port) as simulator:
+        for name, operation in OPERATIONS.items():
+            def run():
+                return sum(not result.ok for result in Fleet(simulator.targets(), workers=workers).run(operation))
+            results[name] = measure(count, run)
+
+        index_store = PortIndexStore()
+
+        def apply():
+            # apply logs the switches it could not connect to and goes on
+            warnings = _Warnings()
+            logging.getLogger().addHandler(warnings)
+            try:
+                _TrunkManager(simulator.targets(), workers=workers, index_store=index_store).apply()
+            finally:
+                logging.getLogger().removeHandler(warnings)
+            return warnings.count
+        results['TrunkManager.apply'] = measure(count, apply)
+        # Nothing left to change, and the port names are known
+        results['TrunkManager.apply again'] = measure(count, apply)
+    return results
+
+
+def check(results, thresholds):
+    """
+    :return: A description of every measurement above its threshold
+    :rtype: list[str]
+    """
+    failures = []
+    for size, operations in results.items():
+        for name, result in operations.items():
+            for key, limit in thresholds.get(name, {}).items():
+                if result[key] > limit:
+                    failures.append("{0} on {1} switches: {2} is {3:g}, the limit is {4}".format(
+                        name, size, key, result[key], limit))
+    return failures
+
+
+def check_walks():
+    """
+    Walks the ports and vlans of switches in WALK_ENDS and checks that exactly the ports and vlans they have,
+    all of them named, come back.
+
+    :return: A description of every walk that did not
+    :rtype: list[str]
+    """
+    failures = []
+    for ports, vlans in WALK_ENDS:
+        with SimulatedFleet(1, ports=ports, vlans=range(1, vlans + 1)) as fleet:
+            community, host, port = fleet.targets()[0]
+            with CiscoSwitch(community, host, port=port) as switch:
+                walks = {'port_names': switch.port_names(), 'port_names_regular': switch.port_names_regular()}
+                vlan_names = switch.get_vlan_names()
+        for name, names in walks.items():
+            if len(names) != ports or not all(names):
+                failures.append("{0} with {1} ports: {2} came back".format(name, ports, sorted(names)))
+        if sorted(vlan_names) != list(range(1, vlans + 1)) or not all(vlan_names.values()):
+            failures.append("get_vlan_names with {0} vlans: {1} came back".format(vlans, vlan_names))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Round trips, bytes and wall time per switch operation")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="Fleet sizes to run")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="Switches worked on at a time")
+    parser.add_argument('--base-port', type=int, default=BASE_PORT, help="UDP port of the first simulated switch")
+    parser.add_argument('--thresholds', default=THRESHOLDS, help="JSON file with the limits per operation")
+    parser.add_argument('--output', help="Write the results here as well")
+    args = parser.parse_args()
+    # TrunkManager logs every change it makes
+    logging.basicConfig(level=logging.WARNING)
+
+    with open(args.thresholds) as f:
+        thresholds = json.load(f)
+    results = {str(size): run_size(size, args.workers, args.base_port) for size in args.sizes}
+    failures = check(results, thresholds) + check_walks()
+    report = json.dumps({'results': results, 'thresholds': thresholds, 'failures': failures}, indent=2)
+
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,11 @@ from cisco_switch.base import SwitchBase
 from .ro import CiscoROSwitch
 from .rw import CiscoWOSwitch
 from .meta import CiscoVlan, CiscoPort
-from cisco_switch.snmp_funcs import fetch_binds, snmp_next, snmp_get, snmp_set, set_vals
+from .aio import AsyncCiscoSwitch
+from cisco_switch.snmp_funcs import fetch_binds, snmp_next, snmp_bulk, snmp_get, snmp_set, set_vals
 
 __author__ = 'CVi'
-__all__ = ['CiscoROSwitch', 'CiscoWOSwitch', 'CiscoSwitch', 'CiscoVlan', 'CiscoPort']
+__all__ = ['CiscoROSwitch', 'CiscoWOSwitch', 'CiscoSwitch', 'CiscoVlan', 'CiscoPort', 'AsyncCiscoSwitch']
 
 
 class CiscoSwitch(CiscoROSwitch, CiscoWOSwitch):
@@ -17,10 +18,11 @@ class CiscoSwitch(CiscoROSwitch, CiscoWOSwitch):
     def get_ports(self):
         """
         Returns all ports as a map with CiscoPort objects.
+        The names come from port_index, walked only if it does not hold any more.
 
         :rtype : map[CiscoPort]
         """
-        return map(lambda item: CiscoPort(self, item[1], item[0]), self.port_names().items())
+        return map(lambda item: CiscoPort(self, item[1], item[0]), self.port_index().port_names().items())
 
     def get_ports_regular(self):
         """
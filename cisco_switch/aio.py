@@ -0,0 +1,618 @@
+"""
+.. module:: aio
+   :synopsis: Asyncio switch class
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Every method of CiscoROSwitch and CiscoWOSwitch, as coroutines.
+Methods that are plain SNMP lookups are rebuilt from the sync classes,
+so the OID templates only live in ro.py and rw.py.
+
+    >>> async def trunks(switches):
+    ...     return await asyncio.gather(*[sw.trunk_status(portindex=10101) for sw in switches])
+"""
+import asyncio
+import logging
+import time
+from functools import wraps
+from pysnmp.proto.rfc1905 import NoSuchInstance
+from cisco_switch.base import SwitchBase, get_vlan
+from cisco_switch.ro import CiscoROSwitch, COUNTER_COLUMNS, NARROW_COLUMNS, SYS_UPTIME, TRUNK_TABLE_COLUMNS, \
+    IF_LAST_CHANGE, IF_TABLE_LAST_CHANGE, IF_NAME, IF_DESCR, PORT_INDEX_SCALARS, PORT_INDEX_MAX_AGE, \
+    _counter_rows, _narrow_counters, _trunk_rows, _trunk_bitmap_items, _trunk_bitmaps, _change_items, _change_token, \
+    _changed, _index_state, _port_index, SNAPSHOT_COLUMNS, VLAN_NAMES, _snapshot_rows, _snapshot_trunks, _snapshot, \
+    ACCESS_VLAN
+from cisco_switch.counters import InterfaceCounters
+from cisco_switch.trunks import VlanSet
+from cisco_switch.portindex import PortIndexStore
+from cisco_switch.rw import CiscoWOSwitch, VlanTransaction, VLAN_EDIT_NAMES, VLAN_EDIT_OPERATION, VLAN_EDIT_OWNER, \
+    VLAN_EDIT_TABLE, VLAN_APPLY_STATUS, TRUNK_SET_ATTEMPTS, APPLY_POLLS, APPLY_INTERVAL, _vlan_items, \
+    _vlan_update, _check_serial, _port_vlan_wanted, _port_vlan_reads, _port_vlan_changes, _port_vlan_sets, \
+    _take_binds, _taken, _apply_done, _wr_mem_binds, _tftp_binds
+from cisco_switch.batch import MAX_SIZE, MESSAGE_OVERHEAD
+from cisco_switch.snmp_async import AsyncSnmpSession, fetch_binds_async, walk_binds_async, set_vals_async
+from cisco_switch.snmp_funcs import instrumented
+
+__author__ = 'CVi'
+__all__ = ['AsyncCiscoSwitch', 'AsyncVlanTransaction']
+
+
+def _asynchronous(method):
+    """
+    Rebuilds a fetch_binds, walk_binds or set_vals decorated method on the async decorators.
+
+    Outer decorators (get_port, get_vlan) are not carried over, apply them again; get_port as get_port_async.
+    """
+    func = method
+    while hasattr(func.__wrapped__, 'snmp_items') or hasattr(func.__wrapped__, 'snmp_walk') \
+            or hasattr(func.__wrapped__, 'snmp_set_items'):
+        func = func.__wrapped__
+    if hasattr(func, 'snmp_items'):
+        return fetch_binds_async(*func.snmp_items)(func.__wrapped__)
+    elif hasattr(func, 'snmp_walk'):
+        return walk_binds_async(func.snmp_walk)(func.__wrapped__)
+    else:
+        return set_vals_async(*func.snmp_set_items)(func.__wrapped__)
+
+
+def get_port_async(func):
+    """
+    get_port for coroutines, port names are looked up with AsyncCiscoSwitch.ifindex.
+    """
+    @wraps(func)
+    async def func_wrapper(self, portindex=0, port=None, **kwags):
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+        return await func(self, portindex=portindex, port=port, **kwags)
+    return func_wrapper
+
+
+class AsyncVlanTransaction(VlanTransaction):
+    """
+    VlanTransaction for AsyncCiscoSwitch, used with async with.
+    """
+    async def send(self):
+        """
+        Makes the queued edits in one vlan edit transaction, as VlanTransaction.send.
+        """
+        if not self.edits:
+            return
+        switch = self.switch
+        await switch._start_vlan_transaction(self.vlandomain)
+        try:
+            for pairs in self._sets(await switch.session.get(*self._items())):
+                try:
+                    await switch.session.set(*pairs)
+                except IOError:
+                    if not self._applied(pairs, await switch.session.get(*[item for item, value in pairs])):
+                        raise
+            await switch._commit_vlan_transaction(self.vlandomain)
+        except Exception:
+            await self._abort()
+            raise
+        finally:
+            self.edits = {}
+
+    async def _abort(self):
+        """
+        Releases the edit buffer after send failed, what the release raises is logged as in VlanTransaction._abort;
+        AsyncSnmpSession has no deadline to lift.
+        """
+        try:
+            await self.switch._abort_vlan_transaction(self.vlandomain)
+        except Exception:
+            logging.getLogger(__name__).exception("Could not release the vlan edit buffer of {0}"
+                                                  .format(self.switch.server))
+
+    def __enter__(self):
+        # A plain with would queue the edits and never send them, send is a coroutine here
+        raise TypeError("use async with")
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        raise TypeError("use async with")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.send()
+
+
+@instrumented
+class AsyncCiscoSwitch(SwitchBase):
+    """
+    Asyncio switch class
+
+    Same methods as CiscoROSwitch and CiscoWOSwitch, all of them coroutines.
+    Many switches can be worked on concurrently from one event loop.
+    """
+    def __init__(self, community, server, port=161, max_repetitions=25, index_store=None):
+        """
+        :param community: SNMP Community
+        :type community: basestring
+        :param server: Host (switch) FQDN or IP
+        :type server: basestring
+        :param port: SNMP port on the switch
+        :type port: int
+        :param max_repetitions: Rows per GETBULK when walking tables, 0 walks with GETNEXT
+        :type max_repetitions: int
+        :param index_store: Where to keep the port name index, None to keep it with this switch object only
+        :type index_store: cisco_switch.portindex.PortIndexStore
+        """
+        self.community = community
+        self.server = server
+        self.port = port
+        self.max_repetitions = max_repetitions
+        self.session = AsyncSnmpSession(community, server, port=port)
+        self.index_store = PortIndexStore() if index_store is None else index_store
+
+    def close(self):
+        """
+        Closes the SNMP session with the switch.
+        """
+        self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    trunk_status = get_port_async(_asynchronous(CiscoROSwitch.trunk_status))
+    admin_status = get_port_async(_asynchronous(CiscoROSwitch.admin_status))
+    octets_in = get_port_async(_asynchronous(CiscoROSwitch.octets_in))
+    octets_out = get_port_async(_asynchronous(CiscoROSwitch.octets_out))
+    port_names = _asynchronous(CiscoROSwitch.port_names)
+    port_names_regular = _asynchronous(CiscoROSwitch.port_names_regular)
+    vlans_on_port = get_port_async(_asynchronous(CiscoROSwitch.vlans_on_port))
+    vlan_set_on_port = get_port_async(_asynchronous(CiscoROSwitch.vlan_set_on_port))
+    get_vlan_names = _asynchronous(CiscoROSwitch.get_vlan_names)
+    get_port_alias = get_port_async(_asynchronous(CiscoROSwitch.get_port_alias))
+    get_vlan_name = get_vlan(_asynchronous(CiscoROSwitch.get_vlan_name))
+    get_access_vlan = _asynchronous(CiscoROSwitch.get_access_vlan)
+
+    async def interface_counters(self):
+        """
+        Octet, packet and error counters of every interface, 64 bit where the interface has them.
+
+        :rtype: cisco_switch.counters.InterfaceCounters
+        """
+        binds = await self.session.table(list(COUNTER_COLUMNS.values()), scalars=[SYS_UPTIME],
+                                         max_repetitions=self.max_repetitions)
+        rows = {}
+        uptime = _counter_rows(binds, COUNTER_COLUMNS, rows)
+        narrow, items = _narrow_counters(rows)
+        if items:
+            _counter_rows(await self.session.get(*items), NARROW_COLUMNS, rows)
+        return InterfaceCounters.from_rows(rows, narrow, uptime)
+
+    async def port_index(self, max_age=PORT_INDEX_MAX_AGE):
+        """
+        The port name/ifIndex index of the switch, see CiscoROSwitch.port_index.
+
+        :rtype: cisco_switch.portindex.PortIndex
+        """
+        index = self.index_store.get(self.server, self.port)
+        if index is not None:
+            if index.checked and time.monotonic() - index.checked < max_age:
+                return index
+            now = time.time()
+            binds = await self.session.get(SYS_UPTIME + (0,), IF_TABLE_LAST_CHANGE)
+            if index.holds(*_index_state(binds, now)):
+                index.checked = time.monotonic()
+                return index
+        for column in (IF_NAME, IF_DESCR):
+            now = time.time()
+            binds = await self.session.table([column.prefix], scalars=PORT_INDEX_SCALARS,
+                                             max_repetitions=self.max_repetitions)
+            index = _port_index(binds, column, now)
+            if index is not None:
+                break
+        else:
+            raise IOError("{0} has no ifName or ifDescr".format(self.server))
+        index.checked = time.monotonic()
+        self.index_store.put(self.server, self.port, index)
+        return index
+
+    async def _get_port(self, port):
+        """
+        Fetches Portindex from a port object, or by name from port_index
+
+        :type port: CiscoPort | str
+        """
+        if isinstance(port, str):
+            return await self.ifindex(port)
+        return SwitchBase._get_port(self, port)
+
+    async def _portindexes(self, ports):
+        """
+        :return: ports with the port names and objects in it looked up
+        :rtype: dict[int, object]
+        """
+        return {port if isinstance(port, int) else await self._get_port(port): value
+                for port, value in (ports or {}).items()}
+
+    async def ifindex(self, name):
+        """
+        ifIndex of a port by name, see CiscoROSwitch.ifindex.
+
+        :rtype: int
+        :raises KeyError: If the switch has no such port
+        """
+        return (await self.port_index()).ifindex(name)
+
+    async def changed_since(self, token=None, vlandomain=1, ports=False):
+        """
+        What changed on the switch since token was had, see CiscoROSwitch.changed_since.
+
+        :return: New token and the subsystems that changed
+        :rtype: (str, frozenset[str])
+        """
+        binds = await self.session.get(*_change_items(vlandomain))
+        port_binds = None
+        if ports:
+            port_binds = await self.session.table([IF_LAST_CHANGE.prefix], max_repetitions=self.max_repetitions)
+        new = _change_token(binds, port_binds)
+        return new, _changed(token, new)
+
+    async def trunk_table(self):
+        """
+        Trunk state of every port in vlanTrunkPortTable, vlan bitmaps for the ports that are trunking.
+
+        :return: TrunkState per ifIndex
+        :rtype: dict[int, cisco_switch.trunks.TrunkState]
+        """
+        binds = await self.session.table(list(TRUNK_TABLE_COLUMNS.values()), max_repetitions=self.max_repetitions)
+        ports = _trunk_rows(binds)
+        items = _trunk_bitmap_items(ports)
+        if items:
+            _trunk_bitmaps(ports, await self.session.get(*items))
+        return ports
+
+    async def snapshot(self, vlandomain=1):
+        """
+        Snapshot of the ports and vlans of the switch, as CiscoROSwitch.snapshot.
+
+        :rtype: cisco_switch.state.SwitchState
+        """
+        taken = time.time()
+        binds = await self.session.table(list(SNAPSHOT_COLUMNS.values()) + [VLAN_NAMES.format(vlandomain=vlandomain)],
+                                         scalars=[SYS_UPTIME], max_repetitions=self.max_repetitions)
+        rows, vlans, uptime = _snapshot_rows(binds, vlandomain)
+        trunks = _snapshot_trunks(rows)
+        items = _trunk_bitmap_items(trunks)
+        if items:
+            _trunk_bitmaps(trunks, await self.session.get(*items))
+        return _snapshot(self.server, self.port, rows, vlans, uptime, vlandomain, trunks, taken)
+
+    def stream(self, item, cursor=None):
+        """
+        Walks item a page at a time as it is iterated over, with async for; see CiscoROSwitch.stream.
+
+        :rtype: cisco_switch.snmp_async.AsyncWalk
+        """
+        return self.session.stream(item, cursor, self.max_repetitions)
+
+    set_port_alias = get_port_async(_asynchronous(CiscoWOSwitch.set_port_alias))
+    _set_port_adminstatus = _asynchronous(CiscoWOSwitch._set_port_adminstatus)
+    _set_port_trunk = _asynchronous(CiscoWOSwitch._set_port_trunk)
+
+    async def _meta_vlan(self, portindex, status, vlanid=0, vlan_list=()):
+        """
+        Meta function for updating vlan on a port, in one GET and one SET as CiscoWOSwitch._meta_vlan
+
+        :param portindex: Index of the interface/port
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :param status: New vlan status as a 0/1 string.
+        :param vlan_list: if vlanid is 0, you can bulk set using this.
+        """
+        vlans = VlanSet((vlanid,) if vlanid else vlan_list)
+        if not vlans:
+            return
+        items = _vlan_items(portindex, vlans)
+        error = serial = None
+        for attempt in range(TRUNK_SET_ATTEMPTS):
+            binds = await self.session.get(*items)
+            _check_serial(error, serial, binds)
+            pairs = _vlan_update(portindex, vlans, status, binds)
+            if not pairs:
+                return
+            try:
+                await self.session.set(*pairs)
+                return
+            except IOError as e:
+                error, serial = e, pairs[0][1]
+        raise error
+
+    async def set_port_vlans(self, trunks=None, access=None, max_size=MAX_SIZE):
+        """
+        Sets the vlans of many ports at once, as CiscoWOSwitch.set_port_vlans.
+
+        :return: The portindexes that were changed
+        :rtype: list[int]
+        """
+        trunks, access = _port_vlan_wanted(self, await self._portindexes(trunks), await self._portindexes(access))
+        if not trunks and not access:
+            return []
+        budget = max_size - MESSAGE_OVERHEAD - len(self.community)
+        reads = _port_vlan_reads(trunks, access, budget)
+        changed = set()
+        error = serial = None
+        for attempt in range(TRUNK_SET_ATTEMPTS):
+            binds = [bind for items in reads for bind in await self.session.get(*items)]
+            _check_serial(error, serial, binds)
+            for portindexes, pairs, guard in _port_vlan_sets(*_port_vlan_changes(trunks, access, binds), budget):
+                try:
+                    await self.session.set(*pairs)
+                except IOError as e:
+                    if guard is None:
+                        raise
+                    error, serial = e, guard
+                    break
+                changed.update(portindexes)
+            else:
+                return sorted(changed)
+        raise error
+
+    async def activate_vlan_on_port(self, portindex=0, vlanid=0, vlan=None, port=None):
+        """
+        Activates a vlan on the port
+
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :type vlanid: int
+        """
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+        if vlanid == 0 and vlan is not None:
+            vlanid = self._get_vlan(vlan)
+
+        await self._meta_vlan(portindex=portindex, vlanid=vlanid, status="1")
+
+    async def deactivate_vlan_on_port(self, portindex=0, vlanid=0, vlan=None, port=None):
+        """
+        Deactivates a vlan on the port
+
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :type vlanid: int
+        """
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+        if vlanid == 0 and vlan is not None:
+            vlanid = self._get_vlan(vlan)
+
+        await self._meta_vlan(portindex=portindex, vlanid=vlanid, status="0")
+
+    async def _meta_vlans(self, portindex, status, vlans):
+        """
+        Updates a list of vlans on a port, in one GET and one SET guarded by the serial, as _meta_vlan.
+        """
+        vlans = self._extract_vlan_ids(vlans)
+        await self._meta_vlan(portindex, status, vlan_list=[v for v in vlans if 0 < v <= 4095])
+
+    async def activate_vlans_on_port(self, portindex=0, vlans=(), port=None):
+        """
+        Activates a list of vlans on the port
+
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        :param vlans: List of VlanID, usually the 802.1q tag number.
+        :type vlans: list[int]
+        """
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+        await self._meta_vlans(portindex, "1", vlans)
+
+    async def deactivate_vlans_on_port(self, portindex=0, vlans=(), port=None):
+        """
+        Deactivates a list of vlans on the port
+
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        :param vlans: List of VlanID, usually the 802.1q tag number.
+        :type vlans: list[int]
+        """
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+        await self._meta_vlans(portindex, "0", vlans)
+
+    async def wr_mem(self):
+        """
+        Saves the configuration to flash/disk.
+        """
+        await self.session.set(*_wr_mem_binds())
+
+    async def tftp_export(self, tftpserver, filename):
+        """
+        Copies running config to a tftp server.
+        """
+        await self.session.set(*_tftp_binds(tftpserver, filename, 4, 1))
+
+    async def tftp_import(self, tftpserver, filename):
+        """
+        Copies running config from a tftp server.
+        """
+        await self.session.set(*_tftp_binds(tftpserver, filename, 1, 4))
+
+    async def activate_port(self, portindex=0, port=None):
+        """
+        Activates the port
+
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        """
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+
+        await self._set_port_adminstatus(portindex=portindex, value=1)
+
+    async def deactivate_port(self, portindex=0, port=None):
+        """
+        Deactivates the port
+
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        """
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+
+        await self._set_port_adminstatus(portindex=portindex, value=2)
+
+    async def make_port_trunk(self, portindex=0, port=None):
+        """
+        Makes the port a trunk, equivalent to
+           >> switchport mode trunk
+
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        """
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+
+        await self._set_port_trunk(portindex=portindex, value=1)
+
+    async def make_port_access(self, portindex=0, port=None):
+        """
+        Makes the port access, equivalent to
+          >> switchport mode access
+
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        """
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+
+        await self._set_port_trunk(portindex=portindex, value=2)
+
+    def vlan_transaction(self, vlandomain=1, max_size=MAX_SIZE):
+        """
+        Queues up vlan edits and makes them in one vlan edit transaction, as CiscoWOSwitch.vlan_transaction;
+        with async with.
+
+        :rtype: AsyncVlanTransaction
+        """
+        return AsyncVlanTransaction(self, vlandomain, max_size)
+
+    async def _start_vlan_transaction(self, vlandomain):
+        """
+        Initiates a vlan update transaction
+        raises BlockingIOError if one is in progress.
+        raises IOError if the edit table did not get populated
+
+        :param vlandomain: vlan domain, usually 1
+        """
+        names = VLAN_EDIT_NAMES.format(vlandomain=vlandomain)
+        owner = VLAN_EDIT_OWNER.format(vlandomain=vlandomain)
+        if await self.session.next(names, max_rows=1):
+            data = await self.session.get(owner)
+            raise BlockingIOError("The vlan is being editd by {0}".format(str(data[0][1])))
+
+        pairs = _take_binds(vlandomain)
+        try:
+            await self.session.set(*pairs)
+        except IOError:
+            if not _taken(pairs, await self.session.get(owner)):
+                raise
+
+        if not await self.session.next(VLAN_EDIT_TABLE, max_rows=1):
+            raise IOError("Vlan Edit table did not prepare properly")
+
+    async def _commit_vlan_transaction(self, vlandomain):
+        """
+        Finishes and commits a vlan transaction
+        raises IOError if the update status becomes something other than succeeded
+
+        :param vlandomain: vlan domain, usually 1
+        """
+        edits = VLAN_EDIT_OPERATION.format(vlandomain=vlandomain)
+        updat = VLAN_APPLY_STATUS.format(vlandomain=vlandomain)
+        await self.session.set((edits, 3))
+        for poll in range(APPLY_POLLS):
+            if poll:
+                # Give the switch some breathing time
+                await asyncio.sleep(APPLY_INTERVAL)
+            if _apply_done(await self.session.get(updat)):
+                break
+        await self.session.set((edits, 4))
+
+    async def _abort_vlan_transaction(self, vlandomain):
+        """
+        Cancel a vlan transaction.
+
+        :param vlandomain: vlan domain, usually 1
+        """
+        edits = VLAN_EDIT_OPERATION.format(vlandomain=vlandomain)
+        await self.session.set((edits, 4))
+
+    async def create_vlan(self, vlanid, name, vlandomain=1):
+        """
+        Creates a new vlan
+        Raises ValueError if vlan does already exist
+
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :type vlanid: int
+        :param name: Name of vlan
+        :type name: basestring
+        :param vlandomain: vlan domain, usually 1
+        :type vlandomain: int
+        """
+        async with self.vlan_transaction(vlandomain) as transaction:
+            transaction.create_vlan(vlanid, name)
+
+    async def rename_vlan(self, vlanid=0, name=None, vlandomain=1, vlan=None):
+        """
+        Renames a vlan
+        Raises KeyError if vlan does not exist
+
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :type vlanid: int
+        :param name: New name of vlan
+        :type name: basestring
+        :param vlandomain: vlan domain, usually 1
+        :type vlandomain: int
+        """
+        async with self.vlan_transaction(vlandomain) as transaction:
+            transaction.rename_vlan(vlanid, name, vlan=vlan)
+
+    async def set_access_vlan(self, portindex=0, vlanid=0, vlan=None, port=None):
+        """
+        Sets the access vlan on an access port
+        raises ValueError if the port is not found in access port table
+        raises IOError if the access vlan did not change to the new value
+
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :type vlanid: int
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        """
+        if portindex == 0 and port is not None:
+            portindex = await self._get_port(port)
+        if vlanid == 0 and vlan is not None:
+            vlanid = self._get_vlan(vlan)
+
+        accessvlan = ACCESS_VLAN.format(portindex=portindex)
+        if type((await self.session.get(accessvlan))[0][1]) == NoSuchInstance:
+            raise ValueError("Port does not exist or is not set to mode access")
+        await self.session.set((accessvlan, vlanid))
+        if int((await self.session.get(accessvlan))[0][1]) != vlanid:
+            raise IOError("Could not update access vlan")
+
+    async def delete_vlan(self, vlanid=0, vlandomain=1, vlan=None):
+        """
+        Delete a vlan
+        Raises KeyError if vlan does not exist
+
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :type vlanid: int
+        :param vlandomain: vlan domain, usually 1
+        :type vlandomain: int
+        """
+        async with self.vlan_transaction(vlandomain) as transaction:
+            transaction.delete_vlan(vlanid, vlan=vlan)
+
+    def __str__(self):
+        return "<AsyncCiscoSwitch: {0}>".format(self.server)
@@ -0,0 +1,182 @@
+"""
+.. module:: batch
+   :synopsis: Coalescing of reads into few GET requests
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Inside a batch the plain lookups (the fetch_binds methods of CiscoROSwitch) are not sent right away,
+they return a BatchResult and their OIDs are collected.
+When the batch ends the OIDs are packed into as few GET requests as fit in a message.
+
+    >>> with switch.batch() as b:
+    ...     status = {p.name: p.admin_status() for p in switch.get_ports()}
+    ...     alias = b.get_port_alias(portindex=10101)
+    >>> alias.result()
+
+Table walks and writes inside a batch are sent right away, as usual.
+"""
+from cisco_switch.oids import oid_size
+from cisco_switch.snmp_funcs import tagged
+
+__author__ = 'CVi'
+__all__ = ['Batch', 'BatchResult']
+
+# Largest SNMP message to ask for; fits a 1500 byte MTU without fragmenting.
+MAX_SIZE = 1472
+# Guess for how large a value is in the response, the session splits requests that still come back tooBig.
+VALUE_SIZE = 16
+# Message, PDU and varbind list headers, request-id, error-status and error-index.
+MESSAGE_OVERHEAD = 32
+VARBIND_OVERHEAD = 6
+
+
+class BatchResult(object):
+    """
+    Result of a lookup in a batch, available once the batch has been sent.
+    """
+    def __init__(self):
+        self._done = False
+        self._value = None
+        self._exception = None
+
+    def _set_result(self, value):
+        self._value = value
+        self._done = True
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._done = True
+
+    def done(self):
+        """
+        :return: True once the batch has been sent
+        :rtype: bool
+        """
+        return self._done
+
+    def exception(self):
+        """
+        :return: The exception raised by the lookup, None if it succeeded
+        """
+        if not self._done:
+            raise BlockingIOError("The batch has not been sent yet")
+        return self._exception
+
+    def result(self):
+        """
+        The value the method would have returned, raises what it would have raised.
+        Raises BlockingIOError if the batch has not been sent yet.
+        """
+        if self.exception() is not None:
+            raise self._exception
+        return self._value
+
+    def __repr__(self):
+        if not self._done:
+            return "<BatchResult: pending>"
+        return "<BatchResult: {0!r}>".format(self._exception or self._value)
+
+
+class Batch(object):
+    """
+    Collects lookups on one switch and sends them together.
+
+    Use through CiscoROSwitch.batch(); attributes not found on the batch are looked up on the switch,
+    so methods can be called on either.
+    """
+    def __init__(self, switch, max_size=MAX_SIZE, value_size=VALUE_SIZE):
+        """
+        :param switch: Switch to collect lookups for
+        :type switch: cisco_switch.CiscoROSwitch
+        :param max_size: Largest message to send or ask for, in bytes
+        :type max_size: int
+        :param value_size: Expected size of a value in the response, in bytes
+        :type value_size: int
+        """
+        self.switch = switch
+        self.max_size = max_size
+        self.value_size = value_size
+        self.pending = []
+        self.previous = None
+
+    def add(self, items, callback):
+        """
+        Queues a lookup.
+
+        :param items: OIDs to fetch
+        :type items: list[str]
+        :param callback: Called with the varbinds of items once fetched, the return value is the result
+        :return: Result of the callback, once the batch is sent
+        :rtype: BatchResult
+        """
+        result = BatchResult()
+        self.pending.append((items, callback, result))
+        return result
+
+    def _chunks(self, oids):
+        """
+        Splits oids into requests that are expected to fit in a message.
+        """
+        budget = self.max_size - MESSAGE_OVERHEAD - len(self.switch.community)
+        most = self.switch.session.limit.max_varbinds
+        chunk = []
+        size = 0
+        for oid in oids:
+            item_size = oid_size(oid) + self.value_size + VARBIND_OVERHEAD
+            if chunk and (size + item_size > budget or len(chunk) == most):
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append(oid)
+            size += item_size
+        if chunk:
+            yield chunk
+
+    def _fetch(self, oids, values):
+        """
+        GETs oids into values, errors are stored in values in place of the varbinds.
+        """
+        try:
+            binds = self.switch.session.get(*oids)
+        except IOError as e:
+            for oid in oids:
+                values[oid] = e
+            return
+        for oid, bind in zip(oids, binds):
+            values[oid] = bind
+
+    @tagged('batch')
+    def send(self):
+        """
+        Sends the collected lookups and resolves their results.
+        """
+        pending, self.pending = self.pending, []
+        oids = list(dict.fromkeys(oid for items, callback, result in pending for oid in items))
+
+        values = {}
+        for chunk in self._chunks(oids):
+            self._fetch(chunk, values)
+
+        for items, callback, result in pending:
+            binds = [values[oid] for oid in items]
+            errors = [bind for bind in binds if isinstance(bind, Exception)]
+            if errors:
+                result._set_exception(errors[0])
+                continue
+            try:
+                result._set_result(callback(binds))
+            except Exception as e:
+                result._set_exception(e)
+
+    def __getattr__(self, name):
+        return getattr(self.switch, name)
+
+    def __enter__(self):
+        self.previous = self.switch.batching
+        self.switch.batching = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.switch.batching = self.previous
+        if exc_type is None:
+            self.send()
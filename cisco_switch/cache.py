@@ -0,0 +1,212 @@
+"""
+.. module:: cache
+   :synopsis: Response cache for SNMP reads
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Keeps GET and walk responses for a while, so asking the same switch for the same OIDs again
+within seconds is answered without a round trip.
+How long depends on the OID; names live for minutes, status for seconds and counters are never cached.
+
+    >>> cache = ResponseCache(max_entries=50000)
+    >>> switch = CiscoSwitch("public", "sw1.example.com", cache=cache)
+    >>> switch.get_vlan_names()
+    >>> switch.get_vlan_name(vlanid=10)  # Answered from the walk above
+
+One cache may be shared by any number of switches and threads, entries are per (server, port, OID).
+Writes through the session invalidate what they may have changed, see ResponseCache.written.
+"""
+import threading
+import time
+from collections import OrderedDict
+from cisco_switch.oids import oid as _oid
+
+__author__ = 'CVi'
+__all__ = ['ResponseCache', 'DEFAULT_TTLS']
+
+# Seconds responses are kept, per OID prefix. The longest matching prefix applies.
+# A write to an OID drops everything cached under the same prefix.
+DEFAULT_TTLS = {
+    # ifName and ifDescr
+    '1.3.6.1.2.1.31.1.1.1.1': 300,
+    '1.3.6.1.2.1.2.2.1.2': 300,
+    # ifAlias
+    '1.3.6.1.2.1.31.1.1.1.18': 60,
+    # vtpVlanEntry, names and state of the vlans
+    '1.3.6.1.4.1.9.9.46.1.3.1.1': 60,
+    # ifAdminStatus
+    '1.3.6.1.2.1.2.2.1.7': 10,
+    # vlanTrunkPortEntry, trunk mode, status and vlan bitmaps
+    '1.3.6.1.4.1.9.9.46.1.6.1.1': 10,
+    # vmMembershipEntry, access vlans
+    '1.3.6.1.4.1.9.9.68.1.2.2.1': 10,
+}
+# Seconds for OIDs not under any prefix; counters, edit buffers and serial numbers are not to be cached.
+DEFAULT_TTL = 0
+MAX_ENTRIES = 10000
+
+
+def _under(oid, prefix):
+    """
+    :return: True if oid is prefix or in the subtree under it
+    :rtype: bool
+    """
+    return oid[:len(prefix)] == prefix
+
+
+class ResponseCache(object):
+    """
+    LRU cache of SNMP responses with per OID prefix time to live.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES, ttls=None, default_ttl=DEFAULT_TTL):
+        """
+        :param max_entries: Entries kept, the least recently used are dropped beyond this
+        :type max_entries: int
+        :param ttls: Seconds to keep responses per OID prefix, DEFAULT_TTLS if None
+        :type ttls: dict[str, float]
+        :param default_ttl: Seconds to keep responses not under any of the prefixes, 0 for not at all
+        :type default_ttl: float
+        """
+        self.max_entries = max_entries
+        self.ttls = {_oid(prefix): ttl for prefix, ttl in (DEFAULT_TTLS if ttls is None else ttls).items()}
+        self.default_ttl = default_ttl
+        # Longest first, the first match is the most specific
+        self.prefixes = sorted(self.ttls, key=len, reverse=True)
+        self.entries = OrderedDict()
+        # Keys of the entries per (server, port), so invalidating a switch only looks at its own
+        self.switches = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _prefix(self, oid):
+        """
+        :return: The most specific prefix configured for oid, None if there is none
+        :rtype: tuple[int]
+        """
+        for prefix in self.prefixes:
+            if _under(oid, prefix):
+                return prefix
+        return None
+
+    def ttl(self, oid):
+        """
+        :return: Seconds responses for oid are kept
+        :rtype: float
+        """
+        prefix = self._prefix(_oid(oid))
+        return self.default_ttl if prefix is None else self.ttls[prefix]
+
+    def _drop(self, key):
+        del self.entries[key]
+        keys = self.switches[key[:2]]
+        keys.discard(key)
+        if not keys:
+            del self.switches[key[:2]]
+
+    def _lookup(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires <= now:
+            self._drop(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, now):
+        ttl = self.ttl(key[3])
+        if ttl <= 0:
+            return
+        self.entries[key] = (now + ttl, value)
+        self.entries.move_to_end(key)
+        self.switches.setdefault(key[:2], set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self._drop(next(iter(self.entries)))
+
+    def lookup(self, server, port, items):
+        """
+        Cached varbinds for items.
+
+        :return: Varbind per item found, and the items that were not
+        :rtype: (dict, list)
+        """
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self.lock:
+            for item in items:
+                entry = self._lookup((server, port, 'get', _oid(item)), now)
+                if entry is None:
+                    missing.append(item)
+                else:
+                    found[item] = entry[1]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def store(self, server, port, binds):
+        """
+        Keeps the varbinds of a GET response.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for bind in binds:
+                oid = _oid(bind[0])
+                self._store((server, port, 'get', oid), bind, now)
+
+    def lookup_walk(self, server, port, item):
+        """
+        :return: Cached varbinds of a walk of item, None if not cached
+        :rtype: list[tuple]
+        """
+        with self.lock:
+            entry = self._lookup((server, port, 'walk', _oid(item)), time.monotonic())
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def store_walk(self, server, port, item, binds):
+        """
+        Keeps the varbinds of a walk of item, and each of them as a GET response.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._store((server, port, 'walk', _oid(item)), binds, now)
+            for bind in binds:
+                self._store((server, port, 'get', _oid(bind[0])), bind, now)
+
+    def invalidate(self, server, port, prefix=None):
+        """
+        Drops what is cached for a switch, under prefix or all of it.
+        Walks of a subtree overlapping prefix are dropped as well.
+        """
+        prefix = None if prefix is None else _oid(prefix)
+        with self.lock:
+            stale = [key for key in self.switches.get((server, port), ()) if
+                     prefix is None or _under(key[3], prefix) or (key[2] == 'walk' and _under(prefix, key[3]))]
+            for key in stale:
+                self._drop(key)
+
+    def written(self, server, port, items):
+        """
+        Invalidates what a SET of items may have changed: everything under the TTL prefix of each item,
+        the item itself if it has none.
+        Writes with side effects outside that need an invalidate of their own.
+        """
+        for prefix in set(self._prefix(_oid(item)) or _oid(item) for item in items):
+            self.invalidate(server, port, prefix)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.switches.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "<ResponseCache: {0} entries, {1} hits, {2} misses>".format(len(self.entries), self.hits, self.misses)
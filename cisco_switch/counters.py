@@ -0,0 +1,313 @@
+"""
+.. module:: counters
+   :synopsis: Interface counters of a whole switch
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+What CiscoROSwitch.interface_counters returns: the counters of every interface at one point in time,
+kept as one array per counter instead of a dict per interface.
+And the rates between two of them, a column at a time; with NumPy if it is installed, in plain Python if not.
+
+    >>> counters = switch.interface_counters()
+    >>> counters[10101]['in_octets']
+    >>> counters.column('in_octets')[counters.position(10101)]
+    >>> for per_second in sample_rates(switch, interval=10):
+    ...     print(per_second[10101]['in_octets'] * 8, "bit/s")
+"""
+import asyncio
+import bisect
+import math
+import time
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'CVi'
+__all__ = ['InterfaceCounters', 'CounterRates', 'COUNTERS', 'rates', 'sample_rates', 'sample_rates_async']
+
+# The counters kept per interface
+COUNTERS = ('in_octets', 'out_octets', 'in_packets', 'out_packets', 'in_errors', 'out_errors')
+# Counters that are 64 bit if the interface has them in ifXTable (HC), error counters are 32 bit on every interface
+HC_COUNTERS = ('in_octets', 'out_octets', 'in_packets', 'out_packets')
+MASK_32 = 2 ** 32 - 1
+
+
+class _Columns(object):
+    """
+    Values per interface, one array per column; position i of every column is interface indexes[i].
+    """
+    def __init__(self, indexes, columns):
+        """
+        :param indexes: ifIndex of every interface, ascending
+        :type indexes: array.array
+        :param columns: Values per column name, in the order of indexes
+        :type columns: dict
+        """
+        self.indexes = indexes
+        self.columns = columns
+
+    def position(self, ifindex):
+        """
+        :return: Position of the interface in the columns
+        :rtype: int
+        :raises KeyError: If there is no such interface
+        """
+        i = bisect.bisect_left(self.indexes, ifindex)
+        if i == len(self.indexes) or self.indexes[i] != ifindex:
+            raise KeyError(ifindex)
+        return i
+
+    def column(self, key):
+        """
+        :param key: Column name, one of COUNTERS
+        """
+        return self.columns[key]
+
+    def __getitem__(self, ifindex):
+        """
+        :return: Every column of the interface
+        :rtype: dict
+        """
+        i = self.position(ifindex)
+        return {key: column[i] for key, column in self.columns.items()}
+
+    def __contains__(self, ifindex):
+        try:
+            self.position(ifindex)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.indexes)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def as_dict(self):
+        """
+        :return: Columns per ifIndex
+        :rtype: dict[int, dict]
+        """
+        return {index: {key: column[i] for key, column in self.columns.items()}
+                for i, index in enumerate(self.indexes)}
+
+
+class InterfaceCounters(_Columns):
+    """
+    Counters of every interface of a switch, read together.
+
+    wide[i] is 1 if the octet and packet counters of interface indexes[i] are 64 bit, 0 if they are 32 bit
+    (the interface has no HC counters).
+    """
+    def __init__(self, indexes, wide, columns, uptime=None, timestamp=None):
+        """
+        :param indexes: ifIndex of every interface, ascending
+        :type indexes: array.array
+        :param wide: 1 per interface with 64 bit counters, 0 otherwise
+        :type wide: array.array
+        :param columns: Counter values per counter name, in the order of indexes
+        :type columns: dict[str, array.array]
+        :param uptime: sysUpTime of the switch in hundredths of a second, None if unknown
+        :type uptime: int
+        :param timestamp: time.monotonic() when the counters were read
+        :type timestamp: float
+        """
+        _Columns.__init__(self, indexes, columns)
+        self.wide = wide
+        self.uptime = uptime
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+
+    @classmethod
+    def from_rows(cls, rows, narrow=(), uptime=None, timestamp=None):
+        """
+        :param rows: Counter values per counter name, per ifIndex; missing counters are 0
+        :type rows: dict[int, dict[str, int]]
+        :param narrow: ifIndexes of the interfaces with 32 bit counters
+        :type narrow: collections.Iterable[int]
+        :rtype: InterfaceCounters
+        """
+        indexes = sorted(rows)
+        narrow = set(narrow)
+        return cls(array('L', indexes), array('B', [index not in narrow for index in indexes]),
+                   {key: array('Q', [rows[index].get(key, 0) for index in indexes]) for key in COUNTERS},
+                   uptime, timestamp)
+
+    def take(self, indexes):
+        """
+        :param indexes: ifIndexes to keep, ascending, all of them present
+        :return: The counters of those interfaces only
+        :rtype: InterfaceCounters
+        """
+        positions = [self.position(ifindex) for ifindex in indexes]
+        columns = {key: array('Q', [column[i] for i in positions]) for key, column in self.columns.items()}
+        return InterfaceCounters(array('L', indexes), array('B', [self.wide[i] for i in positions]), columns,
+                                 self.uptime, self.timestamp)
+
+    def __repr__(self):
+        return "<InterfaceCounters: {0} interfaces, {1} with 32 bit counters>".format(
+            len(self.indexes), len(self.wide) - sum(self.wide))
+
+
+class CounterRates(_Columns):
+    """
+    Per second rates of every counter of every interface, between two readings.
+    Columns are NumPy arrays if NumPy is installed, array.array('d') otherwise; NaN where a counter was reset.
+    """
+    def __init__(self, indexes, columns, seconds):
+        """
+        :param seconds: Time between the readings
+        :type seconds: float
+        """
+        _Columns.__init__(self, indexes, columns)
+        self.seconds = seconds
+
+    def __repr__(self):
+        return "<CounterRates: {0} interfaces over {1:.2f}s>".format(len(self.indexes), self.seconds)
+
+
+def _seconds(old, new):
+    """
+    :return: Seconds between two readings, by sysUpTime if both have it
+    :rtype: float
+    :raises ValueError: If the switch was restarted in between
+    """
+    elapsed = new.timestamp - old.timestamp
+    if old.uptime is None or new.uptime is None:
+        seconds = elapsed
+    elif new.uptime < old.uptime or new.uptime / 100 < elapsed:
+        # Also when sysUpTime wraps, every 497 days
+        raise ValueError("The switch was restarted between the readings")
+    else:
+        seconds = (new.uptime - old.uptime) / 100
+    if seconds <= 0:
+        raise ValueError("The readings are not apart in time")
+    return seconds
+
+
+def _numpy_rates(old, new, seconds):
+    wide = (numpy.frombuffer(old.wide, dtype=numpy.uint8) & numpy.frombuffer(new.wide, dtype=numpy.uint8)) == 1
+    columns = {}
+    for key in COUNTERS:
+        before = numpy.frombuffer(old.columns[key], dtype=numpy.uint64)
+        after = numpy.frombuffer(new.columns[key], dtype=numpy.uint64)
+        # Wraps modulo 2 ** 64 by itself; masked down to modulo 2 ** 32 for 32 bit counters
+        delta = after - before
+        if key in HC_COUNTERS:
+            delta = numpy.where(wide, delta, delta & MASK_32)
+            per_second = delta / seconds
+            # A 64 bit counter does not wrap in years, going backwards it was reset
+            per_second[wide & (after < before)] = numpy.nan
+        else:
+            per_second = (delta & MASK_32) / seconds
+        columns[key] = per_second
+    return columns
+
+
+def _python_rates(old, new, seconds):
+    moduli = [2 ** 64 if a and b else 2 ** 32 for a, b in zip(old.wide, new.wide)]
+    columns = {}
+    for key in COUNTERS:
+        hc = key in HC_COUNTERS
+        columns[key] = array('d', [
+            math.nan if hc and modulus == 2 ** 64 and after < before else
+            ((after - before) % (modulus if hc else 2 ** 32)) / seconds
+            for before, after, modulus in zip(old.columns[key], new.columns[key], moduli)])
+    return columns
+
+
+def rates(old, new):
+    """
+    Per second rates of every counter of the interfaces in both readings.
+
+    A 32 bit counter that went backwards is taken to have wrapped (once, it can not be told if it did more often),
+    a 64 bit one to have been reset; its rate is NaN.
+
+    :type old: InterfaceCounters
+    :type new: InterfaceCounters
+    :rtype: CounterRates
+    :raises ValueError: If the switch was restarted between the readings, no rates can be had
+    """
+    seconds = _seconds(old, new)
+    if old.indexes != new.indexes:
+        # Interfaces came or went
+        common = sorted(set(old.indexes) & set(new.indexes))
+        old, new = old.take(common), new.take(common)
+    if numpy is not None:
+        columns = _numpy_rates(old, new, seconds)
+    else:
+        columns = _python_rates(old, new, seconds)
+    return CounterRates(new.indexes, columns, seconds)
+
+
+def _next_reading(due, interval):
+    """
+    :param due: When the reading just done was due
+    :return: When the next is due, on the same beat; beats missed by slow readings are skipped
+    :rtype: float
+    """
+    now = time.monotonic()
+    due += interval
+    if due < now:
+        due += math.ceil((now - due) / interval) * interval
+    return due
+
+
+def sample_rates(switch, interval=10.0, count=None):
+    """
+    Reads the counters of every interface every interval seconds,
+    and yields the rates since the reading before (the first comes after two readings).
+    A restart of the switch starts over, nothing is yielded for the interval it falls in.
+
+    :param switch: Switch to read
+    :type switch: cisco_switch.ro.CiscoROSwitch
+    :param interval: Seconds from one reading to the next
+    :type interval: float
+    :param count: Rates to yield, None for no end to it
+    :type count: int
+    :rtype: collections.Iterator[CounterRates]
+    """
+    due = time.monotonic()
+    previous = None
+    while count is None or count > 0:
+        counters = switch.interface_counters()
+        if previous is not None:
+            try:
+                result = rates(previous, counters)
+            except ValueError:
+                result = None
+            if result is not None:
+                yield result
+                count = None if count is None else count - 1
+        previous = counters
+        due = _next_reading(due, interval)
+        if count is None or count > 0:
+            time.sleep(max(due - time.monotonic(), 0))
+
+
+async def sample_rates_async(switch, interval=10.0, count=None):
+    """
+    sample_rates for an AsyncCiscoSwitch.
+
+    :type switch: cisco_switch.aio.AsyncCiscoSwitch
+    :rtype: collections.AsyncIterator[CounterRates]
+    """
+    due = time.monotonic()
+    previous = None
+    while count is None or count > 0:
+        counters = await switch.interface_counters()
+        if previous is not None:
+            try:
+                result = rates(previous, counters)
+            except ValueError:
+                result = None
+            if result is not None:
+                yield result
+                count = None if count is None else count - 1
+        previous = counters
+        due = _next_reading(due, interval)
+        if count is None or count > 0:
+            await asyncio.sleep(max(due - time.monotonic(), 0))
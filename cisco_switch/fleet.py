@@ -0,0 +1,177 @@
+"""
+.. module:: fleet
+   :synopsis: Running the same operation on many switches
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Runs an operation on every switch in a list from a pool of threads,
+handing back the results (or exceptions) per switch as they complete.
+
+    >>> fleet = Fleet([("public", "sw1.example.com"), ("public", "sw2.example.com")], deadline=10)
+    >>> for result in fleet.run("get_vlan_names"):
+    ...     print(result.host, result.exception or result.result)
+
+Each worker thread has its own SNMP engine, building one takes a fraction of a second
+(less with snmp_funcs.LOAD_MIBS = False).
+Code that is async already is better off with AsyncCiscoSwitch and asyncio.gather.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from cisco_switch import CiscoSwitch
+
+__author__ = 'CVi'
+__all__ = ['Fleet', 'HostResult']
+
+WORKERS = 16
+
+
+class HostResult(object):
+    """
+    Outcome of an operation on one switch.
+    """
+    def __init__(self, community, host, port, result=None, exception=None, elapsed=0.0):
+        """
+        :param community: SNMP Community
+        :type community: basestring
+        :param host: Host (switch) FQDN or IP
+        :type host: basestring
+        :param port: SNMP port on the switch
+        :type port: int
+        :param result: What the operation returned
+        :param exception: What the operation raised, None if it succeeded
+        :type exception: Exception
+        :param elapsed: Seconds the operation ran
+        :type elapsed: float
+        """
+        self.community = community
+        self.host = host
+        self.port = port
+        self.result = result
+        self.exception = exception
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.exception is None
+
+    def __repr__(self):
+        return "<HostResult: {0} {1!r}>".format(self.host, self.exception or self.result)
+
+
+class Fleet(object):
+    """
+    A set of switches to run operations on, a bounded number at a time.
+    """
+    def __init__(self, targets, workers=WORKERS, host_deadline=None, deadline=None, switch_class=CiscoSwitch,
+                 **switch_kwargs):
+        """
+        :param targets: (community, host) or (community, host, port) per switch
+        :type targets: list[tuple]
+        :param workers: Switches worked on at a time
+        :type workers: int
+        :param host_deadline: Seconds an operation may run on one switch, None for no limit
+        :type host_deadline: float
+        :param deadline: Seconds a whole run may take, None for no limit
+        :type deadline: float
+        :param switch_class: Class of the switch handles made for the operation
+        :param switch_kwargs: Passed on to switch_class, max_repetitions for instance
+        """
+        self.targets = [(target[0], target[1], target[2] if len(target) > 2 else 161) for target in targets]
+        self.workers = workers
+        self.host_deadline = host_deadline
+        self.deadline = deadline
+        self.switch_class = switch_class
+        self.switch_kwargs = switch_kwargs
+
+    def _work(self, target, operation, args, kwargs, started, end):
+        """
+        Runs operation on one switch, in a worker thread.
+        """
+        community, host, port = target
+        start = started[target] = time.monotonic()
+        switch = self.switch_class(community, host, port=port, **self.switch_kwargs)
+        deadlines = [deadline for deadline in (end, self.host_deadline and start + self.host_deadline)
+                     if deadline is not None]
+        if deadlines:
+            switch.session.deadline = min(deadlines)
+        try:
+            if callable(operation):
+                return operation(switch, *args, **kwargs)
+            return getattr(switch, operation)(*args, **kwargs)
+        finally:
+            switch.close()
+
+    def run(self, operation, *args, **kwargs):
+        """
+        Runs operation on every switch, yields a HostResult per switch as they complete.
+
+        The deadlines are enforced between SNMP requests, an operation past its deadline fails
+        with TimeoutError on its next request. Its result is yielded as a TimeoutError right away.
+        Switches not started before the overall deadline are not contacted at all.
+
+        :param operation: Name of a switch method, or a callable taking the switch as first argument.
+        :type operation: basestring | callable
+        :param args: Passed on to operation
+        :param kwargs: Passed on to operation
+        :rtype: collections.Iterable[HostResult]
+        """
+        end = None if self.deadline is None else time.monotonic() + self.deadline
+        started = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = {}
+        try:
+            futures = {executor.submit(self._work, target, operation, args, kwargs, started, end): target
+                       for target in self.targets}
+            pending = set(futures)
+            while pending:
+                now = time.monotonic()
+                if end is not None and now >= end:
+                    break
+                timeouts = [] if end is None else [end]
+                if self.host_deadline is not None:
+                    timeouts.extend(started[futures[future]] + self.host_deadline for future in pending
+                                    if futures[future] in started)
+                timeout = max(min(timeouts) - now, 0) if timeouts else None
+
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._result(futures[future], future, started)
+
+                if self.host_deadline is not None:
+                    now = time.monotonic()
+                    expired = {future for future in pending if futures[future] in started
+                               and now >= started[futures[future]] + self.host_deadline}
+                    pending -= expired
+                    for future in expired:
+                        community, host, port = futures[future]
+                        yield HostResult(community, host, port, elapsed=now - started[futures[future]],
+                                         exception=TimeoutError("Deadline for {0} has passed".format(host)))
+
+            for future in pending:
+                future.cancel()
+                community, host, port = futures[future]
+                exception = TimeoutError("Overall deadline passed before {0} was done".format(host))
+                elapsed = time.monotonic() - started[futures[future]] if futures[future] in started else 0.0
+                yield HostResult(community, host, port, exception=exception, elapsed=elapsed)
+        finally:
+            # Operations still running stop at their next request, once past their deadline.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _result(self, target, future, started):
+        community, host, port = target
+        elapsed = time.monotonic() - started.get(target, time.monotonic())
+        exception = future.exception()
+        if exception is not None:
+            return HostResult(community, host, port, exception=exception, elapsed=elapsed)
+        return HostResult(community, host, port, result=future.result(), elapsed=elapsed)
+
+    def run_all(self, operation, *args, **kwargs):
+        """
+        Like run, but waits for every switch.
+
+        :return: HostResult per (host, port)
+        :rtype: dict[(basestring, int), HostResult]
+        """
+        return {(result.host, result.port): result for result in self.run(operation, *args, **kwargs)}
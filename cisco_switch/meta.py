@@ -66,6 +66,14 @@ class CiscoPort(SwitchBase):
         """
         return self.switch.vlans_on_port(port=self)
 
+    def vlan_set(self):
+        """Get all the vlans on the trunk, as a VlanSet
+
+        :return: All vlanids on a port (if in trunk mode)
+        :rtype: cisco_switch.trunks.VlanSet
+        """
+        return self.switch.vlan_set_on_port(port=self)
+
     def get_alias(self):
         """
         Get the alias of the port
@@ -153,7 +161,7 @@ class CiscoPort(SwitchBase):
         :return: The access vlan on the port
         :rtype: int
         """
-        self.switch.get_access_vlan(port=self)
+        return self.switch.get_access_vlan(port=self)
 
     def set_access_vlan(self, vlanid=0, vlan=None):
         """
@@ -0,0 +1,181 @@
+"""
+.. module:: metrics
+   :synopsis: In-memory aggregation of SNMP request records
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Collects the PduRecords reported through snmp_funcs.add_hook into latency histograms
+per switch and per switch method, for finding the slow switches and the chatty methods.
+
+    >>> metrics = Metrics()
+    >>> add_hook(metrics)
+    >>> fleet.run_all("get_vlan_names")
+    >>> metrics.slowest_switches(5)
+    >>> metrics.chattiest_methods(5)
+    >>> json.dumps(metrics.report())
+"""
+import bisect
+import threading
+
+__author__ = 'CVi'
+__all__ = ['Metrics', 'Histogram', 'RequestStats']
+
+# Upper bounds of the latency buckets in seconds, the last bucket takes whatever is slower.
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+
+class Histogram(object):
+    """
+    Counts of values per bucket, with the count, sum, min and max.
+    """
+    def __init__(self, bounds=BUCKETS):
+        """
+        :param bounds: Upper bounds of the buckets, ascending
+        :type bounds: tuple[float]
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, fraction):
+        """
+        Upper bound of the bucket the value at fraction (0.95 for the 95th percentile) falls in,
+        the largest value seen if it is in the last bucket.
+
+        :type fraction: float
+        :rtype: float
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'min': self.min, 'max': self.max,
+                'p50': self.percentile(0.5), 'p95': self.percentile(0.95), 'p99': self.percentile(0.99),
+                'buckets': dict(zip([str(bound) for bound in self.bounds] + ['inf'], self.counts))}
+
+
+class RequestStats(object):
+    """
+    Totals over the requests for one switch or one method.
+    """
+    def __init__(self):
+        self.latency = Histogram()
+        self.pdus = 0
+        self.varbinds = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.errors = 0
+        # Calls that made requests, counted at the first request of each
+        self.calls = 0
+
+    def add(self, record):
+        """
+        :type record: cisco_switch.snmp_funcs.PduRecord
+        """
+        self.latency.add(record.latency)
+        self.pdus += 1
+        self.varbinds += record.varbinds
+        self.request_bytes += record.request_bytes
+        self.response_bytes += record.response_bytes
+        self.retries += record.retries
+        if not record.answered:
+            self.timeouts += 1
+        elif record.error_status:
+            self.errors += 1
+        if record.first:
+            self.calls += 1
+
+    @property
+    def pdus_per_call(self):
+        return self.pdus / self.calls if self.calls else None
+
+    def as_dict(self):
+        return {'pdus': self.pdus, 'calls': self.calls, 'pdus_per_call': self.pdus_per_call,
+                'varbinds': self.varbinds, 'request_bytes': self.request_bytes,
+                'response_bytes': self.response_bytes, 'retries': self.retries, 'timeouts': self.timeouts,
+                'errors': self.errors, 'latency': self.latency.as_dict()}
+
+
+class Metrics(object):
+    """
+    Hook aggregating request records per switch and per switch method; thread safe.
+    Requests made outside of switch methods are counted under the method None.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.switches = {}
+        self.methods = {}
+
+    def __call__(self, record):
+        """
+        :type record: cisco_switch.snmp_funcs.PduRecord
+        """
+        with self.lock:
+            switch = self.switches.get((record.server, record.port))
+            if switch is None:
+                switch = self.switches[(record.server, record.port)] = RequestStats()
+            switch.add(record)
+            method = self.methods.get(record.method)
+            if method is None:
+                method = self.methods[record.method] = RequestStats()
+            method.add(record)
+
+    def slowest_switches(self, count=10, fraction=0.95):
+        """
+        :param count: Switches to list
+        :param fraction: Percentile to rank by, 0.95 for the 95th
+        :return: (server, port) and latency at the percentile, slowest first
+        :rtype: list[((str, int), float)]
+        """
+        with self.lock:
+            ranked = [(key, stats.latency.percentile(fraction)) for key, stats in self.switches.items()]
+        return sorted(ranked, key=lambda item: item[1], reverse=True)[:count]
+
+    def chattiest_methods(self, count=10):
+        """
+        :param count: Methods to list
+        :return: Method name and requests per call, chattiest first
+        :rtype: list[(str, float)]
+        """
+        with self.lock:
+            ranked = [(method, stats.pdus_per_call) for method, stats in self.methods.items()
+                      if stats.pdus_per_call is not None]
+        return sorted(ranked, key=lambda item: item[1], reverse=True)[:count]
+
+    def report(self):
+        """
+        Everything collected, as plain dicts and lists (JSON serializable).
+
+        :rtype: dict
+        """
+        with self.lock:
+            return {'switches': {"{0}:{1}".format(*key): stats.as_dict() for key, stats in self.switches.items()},
+                    'methods': {str(method): stats.as_dict() for method, stats in self.methods.items()}}
+
+    def reset(self):
+        with self.lock:
+            self.switches = {}
+            self.methods = {}
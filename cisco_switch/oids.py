@@ -0,0 +1,134 @@
+"""
+.. module:: oids
+   :synopsis: Numeric OIDs, templates and prefix matching
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+OIDs are kept as tuples of ints; building one for a port is a tuple concatenation
+and telling which column a varbind belongs to is a comparison of the leading arcs,
+no strings are formatted or parsed on the way.
+
+    >>> ADMIN_STATUS = OidTemplate("1.3.6.1.2.1.2.2.1.7.{portindex}")
+    >>> ADMIN_STATUS.format(portindex=10101)
+    (1, 3, 6, 1, 2, 1, 2, 2, 1, 7, 10101)
+    >>> index(name, ADMIN_STATUS.prefix)
+    (10101,)
+"""
+__author__ = 'CVi'
+__all__ = ['OidTemplate', 'oid', 'dotted', 'oid_size', 'under', 'index', 'by_column']
+
+
+def oid(item):
+    """
+    An OID as a tuple of ints.
+
+    :param item: Dotted string, tuple or pysnmp ObjectName
+    :rtype: tuple[int]
+    """
+    if isinstance(item, tuple):
+        return item
+    elif isinstance(item, str):
+        return tuple(int(arc) for arc in item.strip('.').split('.'))
+    return item.asTuple()
+
+
+def dotted(item):
+    """
+    An OID as a dotted string.
+
+    :rtype: str
+    """
+    return '.'.join(map(str, oid(item)))
+
+
+def oid_size(item):
+    """
+    Size of an OID, BER encoded.
+
+    :type item: str | tuple[int]
+    :rtype: int
+    """
+    arcs = oid(item)
+    size = 1
+    for arc in arcs[2:]:
+        size += 1
+        while arc >= 0x80:
+            arc >>= 7
+            size += 1
+    return size + 2
+
+
+def under(name, prefix):
+    """
+    :param name: OID to test, tuple or pysnmp ObjectName
+    :param prefix: OID prefix as a tuple
+    :type prefix: tuple[int]
+    :return: True if name is prefix or in the subtree under it
+    :rtype: bool
+    """
+    return oid(name)[:len(prefix)] == prefix
+
+
+def index(name, prefix):
+    """
+    The arcs of name after prefix, the row index of a column.
+
+    :param name: OID, tuple or pysnmp ObjectName
+    :param prefix: OID prefix as a tuple
+    :type prefix: tuple[int]
+    :rtype: tuple[int]
+    """
+    return oid(name)[len(prefix):]
+
+
+def by_column(binds, columns):
+    """
+    Sorts varbinds by the column their name is under.
+
+    :param binds: Varbinds
+    :param columns: Column OID prefix per column key
+    :type columns: dict[str, tuple[int]]
+    :return: Value per column key, columns without a varbind are left out
+    :rtype: dict
+    """
+    values = {}
+    for name, val in binds:
+        name = oid(name)
+        for key, prefix in columns.items():
+            if name[:len(prefix)] == prefix:
+                values[key] = val
+                break
+    return values
+
+
+class OidTemplate(object):
+    """
+    OID with trailing fields filled in per call, "1.3.6.1.2.1.2.2.1.7.{portindex}" for instance.
+    Parsed once; format returns a tuple.
+    """
+    __slots__ = ('prefix', 'fields')
+
+    def __init__(self, template):
+        """
+        :param template: Dotted OID, the trailing arcs may be {field}s
+        :type template: str
+        """
+        arcs = template.strip('.').split('.')
+        fields = []
+        while arcs and arcs[-1].startswith('{'):
+            fields.insert(0, arcs.pop()[1:-1])
+        self.prefix = tuple(int(arc) for arc in arcs)
+        self.fields = tuple(fields)
+
+    def format(self, **kwargs):
+        """
+        :return: The OID with the fields filled in from kwargs
+        :rtype: tuple[int]
+        """
+        return self.prefix + tuple(int(kwargs[field]) for field in self.fields)
+
+    def __str__(self):
+        return '.'.join([dotted(self.prefix)] + ['{' + field + '}' for field in self.fields])
+
+    def __repr__(self):
+        return "<OidTemplate: {0}>".format(self)
@@ -0,0 +1,191 @@
+"""
+.. module:: portindex
+   :synopsis: Port name to ifIndex index, kept across processes
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Going from a port name to its ifIndex takes a walk of ifName. The index built from that walk is kept,
+in memory and optionally on disk, and checked with one GET of ifTableLastChange (and sysUpTime) before use;
+it is only walked again when an interface came or went, or the switch was restarted.
+Names are matched normalized, so the ifDescr (GigabitEthernet1/0/1) of a port finds it as well as its ifName
+(Gi1/0/1) does; ifDescr is only walked on switches without ifName.
+
+    >>> store = PortIndexStore("/var/cache/cisco_switch")
+    >>> switch = CiscoSwitch("public", "sw1.example.com", index_store=store)
+    >>> switch.ifindex("GigabitEthernet1/0/1")
+    >>> switch.admin_status(port="Gi1/0/1")
+
+One store may be shared by any number of switches, threads and processes; indexes are per (server, port).
+"""
+import json
+import os
+import re
+import threading
+
+__author__ = 'CVi'
+__all__ = ['PortIndex', 'PortIndexStore', 'normalize_name']
+
+# Interface types as ifDescr has them (and some common shorthands), and the abbreviation ifName uses
+ABBREVIATIONS = {
+    'fastethernet': 'fa', 'gigabitethernet': 'gi', 'gig': 'gi', 'twogigabitethernet': 'tw',
+    'fivegigabitethernet': 'fi', 'tengigabitethernet': 'te', 'ten': 'te', 'twentyfivegige': 'twe',
+    'fortygigabitethernet': 'fo', 'hundredgige': 'hu', 'appgigabitethernet': 'ap', 'ethernet': 'et', 'eth': 'et',
+    'port-channel': 'po', 'vlan': 'vl', 'loopback': 'lo', 'tunnel': 'tu', 'null': 'nu', 'serial': 'se',
+}
+# Seconds the boot time worked out from sysUpTime may move before the switch is taken to have been restarted;
+# the clocks of the switch and this machine drift apart a little.
+BOOT_SLACK = 60
+
+_NAME = re.compile(r'^([a-z-]+)(\d.*)$')
+
+
+def normalize_name(name):
+    """
+    :param name: Port name, as in ifName or ifDescr
+    :type name: str
+    :return: The name in lower case without spaces, the interface type abbreviated as ifName has it
+    :rtype: str
+    """
+    name = name.lower().replace(' ', '')
+    match = _NAME.match(name)
+    if match is None:
+        return name
+    kind, number = match.groups()
+    return ABBREVIATIONS.get(kind, kind) + number
+
+
+class PortIndex(object):
+    """
+    Names and ifIndexes of the ports of one switch, as they were at one value of ifTableLastChange.
+    """
+    def __init__(self, ports, last_change, boot):
+        """
+        :param ports: (ifIndex, name) per port; ifName, or ifDescr on switches without ifName
+        :type ports: list[tuple[int, str]]
+        :param last_change: ifTableLastChange when the index was walked, None if the switch does not have it
+        :type last_change: int
+        :param boot: time.time() when the switch was booted, worked out from sysUpTime; None if unknown
+        :type boot: float
+        """
+        self.ports = sorted(tuple(port) for port in ports)
+        self.last_change = last_change
+        self.boot = boot
+        # time.monotonic() when the index was last found to hold, 0 if it has not been checked in this process
+        self.checked = 0
+        self.indexes = {normalize_name(name): ifindex for ifindex, name in self.ports}
+
+    def holds(self, last_change, boot):
+        """
+        :param last_change: ifTableLastChange now
+        :param boot: Boot time worked out from sysUpTime now
+        :return: True if no interface came or went since the index was walked, and the switch was not restarted
+        :rtype: bool
+        """
+        if last_change is None or boot is None or self.boot is None:
+            return False
+        return last_change == self.last_change and abs(boot - self.boot) <= BOOT_SLACK
+
+    def ifindex(self, name):
+        """
+        :param name: ifName or ifDescr of the port, in any case and abbreviated or not
+        :type name: str
+        :rtype: int
+        :raises KeyError: If there is no such port
+        """
+        return self.indexes[normalize_name(name)]
+
+    def port_names(self):
+        """
+        :return: ifIndex per port name, as CiscoROSwitch.port_names
+        :rtype: dict[str, int]
+        """
+        return {name: ifindex for ifindex, name in self.ports}
+
+    def __contains__(self, name):
+        return normalize_name(name) in self.indexes
+
+    def __len__(self):
+        return len(self.ports)
+
+    def as_dict(self):
+        """
+        :return: The index as JSON serializable values
+        :rtype: dict
+        """
+        return {'ports': self.ports, 'last_change': self.last_change, 'boot': self.boot}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: What as_dict returned
+        :type data: dict
+        :rtype: PortIndex
+        """
+        return cls(data['ports'], data['last_change'], data['boot'])
+
+    def __repr__(self):
+        return "<PortIndex: {0} ports, ifTableLastChange {1}>".format(len(self.ports), self.last_change)
+
+
+class PortIndexStore(object):
+    """
+    PortIndexes of any number of switches, in memory and as one JSON file per switch in a directory.
+    """
+    def __init__(self, directory=None):
+        """
+        :param directory: Where to keep the indexes across processes, created if need be; None for in memory only
+        :type directory: str
+        """
+        self.directory = directory
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def _path(self, server, port):
+        return os.path.join(self.directory, "{0}_{1}.json".format(re.sub(r'[^\w.-]', '_', server), port))
+
+    def get(self, server, port=161):
+        """
+        :return: The index of the switch, None if there is none (or the file of it can not be read)
+        :rtype: PortIndex
+        """
+        with self.lock:
+            index = self.indexes.get((server, port))
+        if index is not None or self.directory is None:
+            return index
+        try:
+            with open(self._path(server, port)) as f:
+                index = PortIndex.from_dict(json.load(f))
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+        with self.lock:
+            return self.indexes.setdefault((server, port), index)
+
+    def put(self, server, port, index):
+        """
+        Keeps the index of a switch, replacing the one there was.
+
+        :type index: PortIndex
+        """
+        with self.lock:
+            self.indexes[(server, port)] = index
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(server, port)
+        # Written next to it and moved in place, so other processes never read half a file
+        temporary = "{0}.{1}.{2}".format(path, os.getpid(), threading.get_ident())
+        with open(temporary, 'w') as f:
+            json.dump(index.as_dict(), f)
+        os.replace(temporary, path)
+
+    def forget(self, server, port=161):
+        """
+        Drops the index of a switch.
+        """
+        with self.lock:
+            self.indexes.pop((server, port), None)
+        if self.directory is not None:
+            try:
+                os.remove(self._path(server, port))
+            except FileNotFoundError:
+                pass
@@ -6,31 +6,360 @@
 
 Be aware, decorators are signature altering.
 """
+import time
+import zlib
 from cisco_switch.base import SwitchBase, get_port, get_vlan
-from cisco_switch.snmp_funcs import fetch_binds, snmp_next
+from cisco_switch.snmp_funcs import SnmpSession, fetch_binds, walk_binds, instrumented
+from cisco_switch.batch import Batch, MAX_SIZE
+from cisco_switch.oids import OidTemplate, oid, index, by_column
+from cisco_switch.counters import InterfaceCounters
+from cisco_switch.trunks import TrunkState, VlanSet, BLOCK_SIZE
+from cisco_switch.portindex import PortIndex, PortIndexStore
+from cisco_switch.state import PortState, SwitchState
 from pysnmp.proto.rfc1905 import NoSuchInstance
+from pysnmp.proto.rfc1902 import OctetString
+from pyasn1.type.univ import Integer
 
 __author__ = 'CVi'
 __all__ = ['CiscoROSwitch']
 
+# ifAdminStatus and ifOperStatus
+IF_ADMIN_STATUS = OidTemplate("1.3.6.1.2.1.2.2.1.7.{portindex}")
+IF_OPER_STATUS = OidTemplate("1.3.6.1.2.1.2.2.1.8.{portindex}")
+# ifInOctets and ifOutOctets
+IF_IN_OCTETS = OidTemplate("1.3.6.1.2.1.2.2.1.10.{portindex}")
+IF_OUT_OCTETS = OidTemplate("1.3.6.1.2.1.2.2.1.16.{portindex}")
+# ifInUcastPkts, ifOutUcastPkts, ifInErrors and ifOutErrors
+IF_IN_UCAST_PKTS = OidTemplate("1.3.6.1.2.1.2.2.1.11.{portindex}")
+IF_OUT_UCAST_PKTS = OidTemplate("1.3.6.1.2.1.2.2.1.17.{portindex}")
+IF_IN_ERRORS = OidTemplate("1.3.6.1.2.1.2.2.1.14.{portindex}")
+IF_OUT_ERRORS = OidTemplate("1.3.6.1.2.1.2.2.1.20.{portindex}")
+# ifHCInOctets, ifHCOutOctets, ifHCInUcastPkts and ifHCOutUcastPkts
+IF_HC_IN_OCTETS = OidTemplate("1.3.6.1.2.1.31.1.1.1.6.{portindex}")
+IF_HC_OUT_OCTETS = OidTemplate("1.3.6.1.2.1.31.1.1.1.10.{portindex}")
+IF_HC_IN_UCAST_PKTS = OidTemplate("1.3.6.1.2.1.31.1.1.1.7.{portindex}")
+IF_HC_OUT_UCAST_PKTS = OidTemplate("1.3.6.1.2.1.31.1.1.1.11.{portindex}")
+# sysUpTime, without the .0
+SYS_UPTIME = (1, 3, 6, 1, 2, 1, 1, 3)
+# managementDomainConfigRevNumber, bumped by every applied vlan edit
+VTP_CONFIG_REV = OidTemplate("1.3.6.1.4.1.9.9.46.1.2.1.1.4.{vlandomain}")
+# ifTableLastChange, sysUpTime when an interface last came or went
+IF_TABLE_LAST_CHANGE = "1.3.6.1.2.1.31.1.5.0"
+# ifLastChange, sysUpTime when a port last went up or down
+IF_LAST_CHANGE = OidTemplate("1.3.6.1.2.1.2.2.1.9")
+# vlanTrunkPortSetSerialNo, a TestAndIncr guarding the trunk vlan bitmaps
+TRUNK_SET_SERIAL = "1.3.6.1.4.1.9.9.46.1.6.2.0"
+# ifName, ifDescr and ifAlias
+IF_NAME = OidTemplate("1.3.6.1.2.1.31.1.1.1.1")
+IF_DESCR = OidTemplate("1.3.6.1.2.1.2.2.1.2")
+IF_ALIAS = OidTemplate("1.3.6.1.2.1.31.1.1.1.18.{portindex}")
+# vlanTrunkPortDynamicState, vlanTrunkPortDynamicStatus and vlanTrunkPortEncapsulationOperType
+TRUNK_DYNAMIC_STATE = OidTemplate("1.3.6.1.4.1.9.9.46.1.6.1.1.13.{portindex}")
+TRUNK_DYNAMIC_STATUS = OidTemplate("1.3.6.1.4.1.9.9.46.1.6.1.1.14.{portindex}")
+TRUNK_ENCAPSULATION = OidTemplate("1.3.6.1.4.1.9.9.46.1.6.1.1.16.{portindex}")
+# vlanTrunkPortVlansEnabled, -Enabled2k, -Enabled3k and -Enabled4k; one 1024 vlan block each.
+TRUNK_VLANS = (OidTemplate("1.3.6.1.4.1.9.9.46.1.6.1.1.4.{portindex}"),
+               OidTemplate("1.3.6.1.4.1.9.9.46.1.6.1.1.17.{portindex}"),
+               OidTemplate("1.3.6.1.4.1.9.9.46.1.6.1.1.18.{portindex}"),
+               OidTemplate("1.3.6.1.4.1.9.9.46.1.6.1.1.19.{portindex}"))
+# vtpVlanName
+VLAN_NAMES = OidTemplate("1.3.6.1.4.1.9.9.46.1.3.1.1.4.{vlandomain}")
+VLAN_NAME = OidTemplate("1.3.6.1.4.1.9.9.46.1.3.1.1.4.{vlandomain}.{vlanid}")
+# vmVlan
+ACCESS_VLAN = OidTemplate("1.3.6.1.4.1.9.9.68.1.2.2.1.2.{portindex}")
 
+TRUNK_STATUS_COLUMNS = {'admin': IF_ADMIN_STATUS.prefix, 'encapsulation': TRUNK_ENCAPSULATION.prefix,
+                        'dynamic': TRUNK_DYNAMIC_STATUS.prefix}
+# Column of each block
+TRUNK_VLANS_COLUMNS = {block: template.prefix for block, template in enumerate(TRUNK_VLANS)}
+# Columns walked for trunk_table, per TrunkState attribute
+TRUNK_TABLE_COLUMNS = {'dynamic_state': TRUNK_DYNAMIC_STATE.prefix, 'dynamic_status': TRUNK_DYNAMIC_STATUS.prefix,
+                       'encapsulation': TRUNK_ENCAPSULATION.prefix}
+# Columns walked for interface_counters, per counter name
+COUNTER_COLUMNS = {'in_octets': IF_HC_IN_OCTETS.prefix, 'out_octets': IF_HC_OUT_OCTETS.prefix,
+                   'in_packets': IF_HC_IN_UCAST_PKTS.prefix, 'out_packets': IF_HC_OUT_UCAST_PKTS.prefix,
+                   'in_errors': IF_IN_ERRORS.prefix, 'out_errors': IF_OUT_ERRORS.prefix}
+# The 32 bit counters asked for where an interface has no HC counters
+NARROW_COUNTERS = {'in_octets': IF_IN_OCTETS, 'out_octets': IF_OUT_OCTETS,
+                   'in_packets': IF_IN_UCAST_PKTS, 'out_packets': IF_OUT_UCAST_PKTS}
+NARROW_COLUMNS = {key: template.prefix for key, template in NARROW_COUNTERS.items()}
+# Columns walked for snapshot, per PortState attribute
+SNAPSHOT_COLUMNS = {'name': IF_NAME.prefix, 'alias': IF_ALIAS.prefix, 'admin_status': IF_ADMIN_STATUS.prefix,
+                    'oper_status': IF_OPER_STATUS.prefix, 'access_vlan': ACCESS_VLAN.prefix,
+                    'dynamic_state': TRUNK_DYNAMIC_STATE.prefix, 'dynamic_status': TRUNK_DYNAMIC_STATUS.prefix,
+                    'encapsulation': TRUNK_ENCAPSULATION.prefix}
+# What changed_since tells apart
+SUBSYSTEMS = ('vlans', 'interfaces', 'trunks')
+# Scalars read along with the port names, for checking the index later; sysUpTime and ifTableLastChange
+PORT_INDEX_SCALARS = [SYS_UPTIME, oid(IF_TABLE_LAST_CHANGE)[:-1]]
+# Seconds a port index that was found to hold is used without checking it again
+PORT_INDEX_MAX_AGE = 10
+
+
+def _counter_rows(binds, columns, rows):
+    """
+    Sorts counter varbinds into rows per ifIndex; values that are not numbers (noSuchInstance) are left out.
+
+    :param columns: Column prefix per counter name
+    :type columns: dict[str, tuple[int]]
+    :param rows: Counter values per counter name per ifIndex, added to
+    :type rows: dict[int, dict[str, int]]
+    :return: sysUpTime if it is among the varbinds, None if not
+    :rtype: int
+    """
+    uptime = None
+    for name, val in binds:
+        name = oid(name)
+        if name[:len(SYS_UPTIME)] == SYS_UPTIME:
+            uptime = int(val)
+            continue
+        for key, prefix in columns.items():
+            if name[:len(prefix)] == prefix:
+                if isinstance(val, Integer):
+                    rows.setdefault(name[len(prefix)], {})[key] = int(val)
+                break
+    return uptime
+
+
+def _narrow_counters(rows):
+    """
+    :return: ifIndexes of the rows missing HC counters, and the 32 bit counters to GET for them.
+    :rtype: (list[int], list[tuple[int]])
+    """
+    narrow = [ifindex for ifindex, row in sorted(rows.items()) if not all(key in row for key in NARROW_COUNTERS)]
+    return narrow, [template.format(portindex=ifindex) for ifindex in narrow for template in NARROW_COUNTERS.values()]
+
+
+def _change_items(vlandomain):
+    """
+    :return: The revision numbers and timestamps to GET for changed_since; uptime, vlans, interfaces, trunks.
+    :rtype: list
+    """
+    return [SYS_UPTIME + (0,), VTP_CONFIG_REV.format(vlandomain=vlandomain), IF_TABLE_LAST_CHANGE, TRUNK_SET_SERIAL]
+
+
+def _change_token(binds, ports=None):
+    """
+    :param binds: Varbinds of the _change_items, in order
+    :param ports: ifLastChange varbinds, None if not walked
+    :return: Token for changed_since; the values, empty where the switch has none, and a checksum of ports
+    :rtype: str
+    """
+    values = [str(int(val)) if isinstance(val, Integer) else '' for name, val in binds]
+    if ports is not None:
+        data = ';'.join('{0}={1}'.format(oid(name), int(val)) for name, val in sorted(ports, key=lambda b: oid(b[0])))
+        values.append('{0:08x}'.format(zlib.crc32(data.encode())))
+    return ':'.join(values)
+
+
+def _changed(old, new):
+    """
+    :param old: Token from before, None if there is none
+    :param new: Token just made
+    :return: The SUBSYSTEMS that changed between the tokens;
+        all of them if the switch was restarted, and those the switch has no indicator for.
+    :rtype: frozenset[str]
+    :raises ValueError: If old is not a token
+    """
+    if old is None:
+        return frozenset(SUBSYSTEMS)
+    old, new = old.split(':'), new.split(':')
+    if len(old) not in (4, 5) or not all(value.isdigit() for value in old[:4] if value):
+        raise ValueError("Not a change token")
+    if not old[0] or not new[0] or int(new[0]) < int(old[0]):
+        return frozenset(SUBSYSTEMS)
+    differ = [not a or a != b for a, b in zip(old[1:4], new[1:4])]
+    # Ports changed if the ifLastChange checksums differ, or only one of the tokens has one
+    differ[1] = differ[1] or old[4:] != new[4:]
+    return frozenset(subsystem for subsystem, changed in zip(SUBSYSTEMS, differ) if changed)
+
+
+def _index_state(binds, now):
+    """
+    :param binds: Varbinds with sysUpTime and ifTableLastChange among them
+    :param now: time.time() when they were read
+    :return: ifTableLastChange and the time.time() the switch was booted; None for those the switch has not
+    :rtype: (int, float)
+    """
+    last_change = boot = None
+    for name, val in binds:
+        name = oid(name)
+        if not isinstance(val, Integer):
+            continue
+        if name[:len(SYS_UPTIME)] == SYS_UPTIME:
+            boot = now - int(val) / 100
+        elif name[:len(PORT_INDEX_SCALARS[1])] == PORT_INDEX_SCALARS[1]:
+            last_change = int(val)
+    return last_change, boot
+
+
+def _port_index(binds, column, now):
+    """
+    :param binds: Varbinds of a names column, with the PORT_INDEX_SCALARS
+    :param column: The column, IF_NAME or IF_DESCR
+    :type column: OidTemplate
+    :param now: time.time() when they were read
+    :return: The index, None if the column is empty
+    :rtype: cisco_switch.portindex.PortIndex
+    """
+    ports = [(index(name, column.prefix)[0], str(val)) for name, val in binds
+             if oid(name)[:len(column.prefix)] == column.prefix]
+    return PortIndex(ports, *_index_state(binds, now)) if ports else None
+
+
+def _trunk_rows(binds):
+    """
+    :return: TrunkState per ifIndex, without the bitmaps
+    :rtype: dict[int, TrunkState]
+    """
+    ports = {}
+    for name, val in binds:
+        name = oid(name)
+        for key, prefix in TRUNK_TABLE_COLUMNS.items():
+            if name[:len(prefix)] == prefix:
+                port = ports.get(name[len(prefix)])
+                if port is None:
+                    port = ports[name[len(prefix)]] = TrunkState()
+                setattr(port, key, int(val))
+                break
+    return ports
+
+
+def _trunk_bitmap_items(ports):
+    """
+    :return: The vlanTrunkPortVlansEnabled columns to GET, those of the trunking ports
+    :rtype: list[tuple[int]]
+    """
+    return [template.format(portindex=ifindex) for ifindex, port in sorted(ports.items()) if port.trunking
+            for template in TRUNK_VLANS]
+
+
+def _trunk_bitmaps(ports, binds):
+    """
+    Puts the blocks in binds together into the bitmaps of ports.
+    """
+    blocks = {}
+    for name, val in binds:
+        name = oid(name)
+        for block, template in enumerate(TRUNK_VLANS):
+            if name[:len(template.prefix)] == template.prefix:
+                data = val.asOctets() if isinstance(val, OctetString) else b''
+                blocks.setdefault(name[len(template.prefix)], [b''] * len(TRUNK_VLANS))[block] = data
+                break
+    for ifindex, data in blocks.items():
+        ports[ifindex].bitmap = b''.join(block[:BLOCK_SIZE].ljust(BLOCK_SIZE, b'\x00') for block in data)
+
+
+def _snapshot_rows(binds, vlandomain):
+    """
+    Sorts the varbinds of a snapshot walk.
+
+    :return: Values per PortState attribute per ifIndex, name per vlanid and sysUpTime (None if not among them)
+    :rtype: (dict[int, dict], dict[int, str], int)
+    """
+    vlan_column = VLAN_NAMES.format(vlandomain=vlandomain)
+    rows, vlans, uptime = {}, {}, None
+    for name, val in binds:
+        name = oid(name)
+        if name[:len(SYS_UPTIME)] == SYS_UPTIME:
+            uptime = int(val)
+        elif name[:len(vlan_column)] == vlan_column:
+            vlans[name[len(vlan_column)]] = str(val)
+        else:
+            for key, prefix in SNAPSHOT_COLUMNS.items():
+                if name[:len(prefix)] == prefix:
+                    if isinstance(val, (Integer, OctetString)):
+                        rows.setdefault(name[len(prefix)], {})[key] = str(val) if key in ('name', 'alias') else int(val)
+                    break
+    return rows, vlans, uptime
+
+
+def _snapshot_trunks(rows):
+    """
+    :return: TrunkState per ifIndex of the ports in vlanTrunkPortTable, without the bitmaps
+    :rtype: dict[int, TrunkState]
+    """
+    return {ifindex: TrunkState(row.get('dynamic_state'), row.get('dynamic_status'), row.get('encapsulation'))
+            for ifindex, row in rows.items() if 'dynamic_status' in row}
+
+
+def _trunk_vlan_set(binds):
+    """
+    :param binds: Varbinds of the TRUNK_VLANS of a port
+    :rtype: VlanSet
+    """
+    blocks = by_column(binds, TRUNK_VLANS_COLUMNS)
+    return VlanSet.from_blocks({block: val.asOctets() for block, val in blocks.items() if isinstance(val, OctetString)})
+
+
+def _snapshot(server, port, rows, vlans, uptime, vlandomain, trunks, taken):
+    """
+    :param trunks: TrunkState per ifIndex, with the bitmaps of the ports that are trunking
+    :rtype: SwitchState
+    """
+    ports = [PortState(ifindex, vlans=None if ifindex not in trunks else trunks[ifindex].vlan_set(), **row)
+             for ifindex, row in rows.items()]
+    return SwitchState(server, port, ports, vlans, uptime, vlandomain, taken)
+
+
+@instrumented
 class CiscoROSwitch(SwitchBase):
     """
     Read only switch class
     """
-    def __init__(self, community, server):
+    def __init__(self, community, server, max_repetitions=25, port=161, cache=None, index_store=None):
         """
         :param community: SNMP Community
         :type community: basestring
         :param server: Host (switch) FQDN or IP
         :type server: basestring
+        :param max_repetitions: Rows per GETBULK when walking tables, 0 walks with GETNEXT
+        :type max_repetitions: int
+        :param port: SNMP port on the switch
+        :type port: int
+        :param cache: Cache to answer reads from, shared between switches if need be; None to always ask
+        :type cache: cisco_switch.cache.ResponseCache
+        :param index_store: Where to keep the port name index, shared between switches and processes if need be;
+            None to keep it with this switch object only
+        :type index_store: cisco_switch.portindex.PortIndexStore
         """
         self.community = community
         self.server = server
+        self.max_repetitions = max_repetitions
+        self.session = SnmpSession(community, server, port=port, cache=cache)
+        self.index_store = PortIndexStore() if index_store is None else index_store
+        self.batching = None
+
+    def batch(self, max_size=MAX_SIZE):
+        """
+        Collects lookups and sends them in as few GET requests as possible.
+        Within the with-block lookups return a BatchResult instead of the value,
+        the values are there once the block is done.
+
+            >>> with switch.batch() as b:
+            ...     up = [b.admin_status(portindex=i) for i in (10101, 10102)]
+            >>> [result.result() for result in up]
+
+        :param max_size: Largest message to send or ask for, in bytes
+        :type max_size: int
+        :rtype: cisco_switch.batch.Batch
+        """
+        return Batch(self, max_size=max_size)
+
+    def close(self):
+        """
+        Closes the SNMP session with the switch.
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     @get_port
-    @fetch_binds('1.3.6.1.2.1.2.2.1.7.{portindex}', '1.3.6.1.4.1.9.9.46.1.6.1.1.16.{portindex}',
-                 '1.3.6.1.4.1.9.9.46.1.6.1.1.14.{portindex}')
+    @fetch_binds(IF_ADMIN_STATUS, TRUNK_ENCAPSULATION, TRUNK_DYNAMIC_STATUS)
     def trunk_status(self, binds, portindex, port):
         """
         Status of a trunk port
@@ -40,21 +369,11 @@ class CiscoROSwitch(SwitchBase):
         :return: True if the port is active and trunk, False otherwise.
         :rtype: boolean
         """
-        admin = 0
-        is_trunk = 0
-        trunk = 0
-        for name, val in binds:
-            nm_str = name.prettyPrint()
-            if '1.3.6.1.2.1.2.2.1.7' in nm_str:
-                admin = val
-            elif '1.3.6.1.4.1.9.9.46.1.6.1.1.16' in nm_str:
-                trunk = val
-            elif '1.3.6.1.4.1.9.9.46.1.6.1.1.14' in nm_str:
-                is_trunk = val
-        return admin == 1 and is_trunk == 1 and trunk != 6
+        columns = by_column(binds, TRUNK_STATUS_COLUMNS)
+        return columns.get('admin') == 1 and columns.get('dynamic') == 1 and columns.get('encapsulation') != 6
 
     @get_port
-    @fetch_binds('1.3.6.1.2.1.2.2.1.7.{portindex}')
+    @fetch_binds(IF_ADMIN_STATUS)
     def admin_status(self, binds, portindex, port):
         """
         Retrieves the admin status of a port.
@@ -67,7 +386,7 @@ class CiscoROSwitch(SwitchBase):
         return binds[0][1] == 1
 
     @get_port
-    @fetch_binds('1.3.6.1.2.1.2.2.1.10.{portindex}')
+    @fetch_binds(IF_IN_OCTETS)
     def octets_in(self, binds, portindex, port):
         """
         Retrieves number of octets that has come in on the port.
@@ -80,7 +399,7 @@ class CiscoROSwitch(SwitchBase):
         return int(binds[0][1])
 
     @get_port
-    @fetch_binds('1.3.6.1.2.1.2.2.1.16.{portindex}')
+    @fetch_binds(IF_OUT_OCTETS)
     def octets_out(self, binds, portindex, port):
         """
         Retrieves number of octets that has come out on the port.
@@ -92,29 +411,184 @@ class CiscoROSwitch(SwitchBase):
         """
         return int(binds[0][1])
 
-    def port_names(self):
+    def interface_counters(self):
+        """
+        Octet, unicast packet and error counters of every interface, walked together with GETBULK
+        (ifXTable's 64 bit HC counters and ifTable's error counters); sysUpTime comes along.
+        Interfaces without HC counters get the 32 bit ones instead, in GETs of their own.
+
+        :rtype: cisco_switch.counters.InterfaceCounters
+        """
+        binds = self.session.table(list(COUNTER_COLUMNS.values()), scalars=[SYS_UPTIME],
+                                   max_repetitions=self.max_repetitions)
+        rows = {}
+        uptime = _counter_rows(binds, COUNTER_COLUMNS, rows)
+        narrow, items = _narrow_counters(rows)
+        if items:
+            _counter_rows(self.session.get(*items), NARROW_COLUMNS, rows)
+        return InterfaceCounters.from_rows(rows, narrow, uptime)
+
+    def changed_since(self, token=None, vlandomain=1, ports=False):
+        """
+        Tells what changed on the switch since token was had, from revision numbers and timestamps it keeps;
+        in one GET, and a walk of ifLastChange if ports is True.
+        Meant for skipping switches that have not changed since they were last audited.
+
+        vlans: managementDomainConfigRevNumber, bumped by every applied vlan edit.
+        interfaces: ifTableLastChange, bumped when interfaces come or go; with ports, also ports going up or down.
+        trunks: vlanTrunkPortSetSerialNo, bumped by every write of trunk vlans over SNMP
+        (changes made from the CLI do not bump it).
+        A restart of the switch, and an indicator the switch does not have, count as changes.
+
+            >>> token, changed = switch.changed_since(tokens.get(host))
+            >>> if 'vlans' in changed:
+            ...     audit(switch)
+            >>> tokens[host] = token
+
+        :param token: Token from the last call, None if there is none
+        :type token: str
+        :param vlandomain: vlan domain, usually 1
+        :type vlandomain: int
+        :param ports: Walk ifLastChange of every port as well
+        :type ports: bool
+        :return: New token, to keep for the next call, and the SUBSYSTEMS that changed
+        :rtype: (str, frozenset[str])
+        :raises ValueError: If token is not from changed_since
+        """
+        binds = self.session.get(*_change_items(vlandomain), fresh=True)
+        port_binds = None
+        if ports:
+            port_binds = self.session.table([IF_LAST_CHANGE.prefix], max_repetitions=self.max_repetitions)
+        new = _change_token(binds, port_binds)
+        return new, _changed(token, new)
+
+    def trunk_table(self):
+        """
+        Trunk state of every port in vlanTrunkPortTable; the state columns are walked together with GETBULK,
+        then the vlan bitmaps of the ports that are trunking are asked for. Ports that are not trunking get no bitmap.
+
+        :return: TrunkState per ifIndex
+        :rtype: dict[int, cisco_switch.trunks.TrunkState]
+        """
+        binds = self.session.table(list(TRUNK_TABLE_COLUMNS.values()), max_repetitions=self.max_repetitions)
+        ports = _trunk_rows(binds)
+        items = _trunk_bitmap_items(ports)
+        if items:
+            _trunk_bitmaps(ports, self.session.get(*items))
+        return ports
+
+    def snapshot(self, vlandomain=1):
+        """
+        Snapshot of the ports and vlans of the switch; every port column and the vlan table are walked together
+        with GETBULK, so it takes as many round trips as the longest of them, then the vlan bitmaps of the ports
+        that are trunking are asked for.
+
+        :param vlandomain: vlan domain, usually 1
+        :type vlandomain: int
+        :rtype: cisco_switch.state.SwitchState
+        """
+        taken = time.time()
+        binds = self.session.table(list(SNAPSHOT_COLUMNS.values()) + [VLAN_NAMES.format(vlandomain=vlandomain)],
+                                   scalars=[SYS_UPTIME], max_repetitions=self.max_repetitions)
+        rows, vlans, uptime = _snapshot_rows(binds, vlandomain)
+        trunks = _snapshot_trunks(rows)
+        items = _trunk_bitmap_items(trunks)
+        if items:
+            _trunk_bitmaps(trunks, self.session.get(*items))
+        return _snapshot(self.server, self.session.port, rows, vlans, uptime, vlandomain, trunks, taken)
+
+    def stream(self, item, cursor=None):
+        """
+        Walks item a page (max_repetitions varbinds) at a time as it is iterated over, holding no more than a page;
+        for tables too large to have in memory at once. Walk.cursor is the last OID handed out,
+        a walk that failed is resumed by passing it as cursor, here or to another switch handle.
+
+            >>> walk = switch.stream("1.3.6.1.2.1.31.1.1")
+            >>> for name, val in walk:
+            ...     store(name, val)
+
+        :param item: OID of the table, or column
+        :param cursor: OID to go on after, None to start at the beginning
+        :rtype: cisco_switch.snmp_funcs.Walk
+        """
+        return self.session.stream(item, cursor, self.max_repetitions)
+
+    def port_index(self, max_age=PORT_INDEX_MAX_AGE):
+        """
+        The port name/ifIndex index of the switch, from the index store.
+        An index checked less than max_age seconds ago is used as it is, an older one is checked with one GET
+        of sysUpTime and ifTableLastChange. It is walked again (ifName, or ifDescr if the switch has no ifName)
+        if there is none, an interface came or went since, or the switch was restarted.
+
+        :param max_age: Seconds since the index was last checked that it is used without checking
+        :type max_age: float
+        :rtype: cisco_switch.portindex.PortIndex
+        """
+        index = self.index_store.get(self.server, self.session.port)
+        if index is not None:
+            if index.checked and time.monotonic() - index.checked < max_age:
+                return index
+            now = time.time()
+            binds = self.session.get(SYS_UPTIME + (0,), IF_TABLE_LAST_CHANGE, fresh=True)
+            if index.holds(*_index_state(binds, now)):
+                index.checked = time.monotonic()
+                return index
+        for column in (IF_NAME, IF_DESCR):
+            now = time.time()
+            binds = self.session.table([column.prefix], scalars=PORT_INDEX_SCALARS,
+                                       max_repetitions=self.max_repetitions)
+            index = _port_index(binds, column, now)
+            if index is not None:
+                break
+        else:
+            raise IOError("{0} has no ifName or ifDescr".format(self.server))
+        index.checked = time.monotonic()
+        self.index_store.put(self.server, self.session.port, index)
+        return index
+
+    def ifindex(self, name):
+        """
+        ifIndex of a port by name, through port_index.
+
+        :param name: ifName or ifDescr of the port; Gi1/0/1, GigabitEthernet1/0/1 and gi 1/0/1 are all the same
+        :type name: str
+        :rtype: int
+        :raises KeyError: If the switch has no such port
+        """
+        return self.port_index().ifindex(name)
+
+    def _get_port(self, port):
+        """
+        Fetches Portindex from a port object, or by name from port_index
+
+        :type port: CiscoPort | str
+        """
+        if isinstance(port, str):
+            return self.ifindex(port)
+        return SwitchBase._get_port(self, port)
+
+    @walk_binds(IF_NAME)
+    def port_names(self, binds):
         """
         Gets all the ports and port IDs on a switch
 
         :return: Dictionary, port name as key and index as value.
         :rtype: dictionary
         """
-        pf = "1.3.6.1.2.1.31.1.1.1.1"
-        return {str(val): int(name.prettyPrint()[len(pf)+1:]) for name, val in snmp_next(self.community, self.server, pf)}
+        return {str(val): index(name, IF_NAME.prefix)[0] for name, val in binds}
 
-    def port_names_regular(self):
+    @walk_binds(IF_DESCR)
+    def port_names_regular(self, binds):
         """
         Gets all the ports and port IDs on a switch (without using ifXTable)
 
         :return: Dictionary, port name as key and index as value.
         :rtype: dictionary
         """
-        pf = "1.3.6.1.2.1.2.2.1.2"
-        return {str(val): int(str(name.getOid())[len(pf)+1:]) for name, val in snmp_next(self.community, self.server, pf)}
+        return {str(val): index(name, IF_DESCR.prefix)[0] for name, val in binds}
 
     @get_port
-    @fetch_binds('1.3.6.1.4.1.9.9.46.1.6.1.1.4.{portindex}', '1.3.6.1.4.1.9.9.46.1.6.1.1.17.{portindex}',
-                 '1.3.6.1.4.1.9.9.46.1.6.1.1.18.{portindex}', '1.3.6.1.4.1.9.9.46.1.6.1.1.19.{portindex}')
+    @fetch_binds(*TRUNK_VLANS)
     def vlans_on_port(self, binds, portindex, port):
         """Get all the vlans on a vlan trunk port.
 
@@ -123,26 +597,24 @@ class CiscoROSwitch(SwitchBase):
         :return: List of all vlanids on a port (if in trunk mode)
         :rtype: list[int]
         """
-        vlans = []
-        pf = "1.3.6.1.4.1.9.9.46.1.6.1.1"
-        mappings = {'4.': 0, '17': 1024, '18': 2048, '19': 3072}
-        for name, val in binds:
-            nm_str = name.prettyPrint()
-            val_str = val.prettyPrint()
-            pr_str = nm_str[len(pf)+1:][:2]
+        return list(_trunk_vlan_set(binds))
+
+    @get_port
+    @fetch_binds(*TRUNK_VLANS)
+    def vlan_set_on_port(self, binds, portindex, port):
+        """Get all the vlans on a vlan trunk port, as a VlanSet; for set algebra on them.
 
-            v = mappings.get(pr_str, -1024)
+            >>> switch.vlan_set_on_port(portindex=10101) | [20, 30]
 
-            if val_str == "b''" or val_str == "No Such Instance currently exists at this OID":
-                continue
-            l = val_str[2:].ljust(256, '0')
-            b = bin(int(l, 16))[2:].zfill(len(l)*4)
-            for i in range(len(b)):
-                if b[i] == "1":
-                    vlans.append(v+i)
-        return vlans
+        :param portindex: Index of the interface/port
+        :type portindex: int
+        :return: All vlanids on a port (if in trunk mode), iterating in ascending order
+        :rtype: cisco_switch.trunks.VlanSet
+        """
+        return _trunk_vlan_set(binds)
 
-    def get_vlan_names(self, vlandomain=1):
+    @walk_binds(VLAN_NAMES)
+    def get_vlan_names(self, binds, vlandomain=1):
         """
         Get all the vlans on a domain on a switch
 
@@ -151,12 +623,10 @@ class CiscoROSwitch(SwitchBase):
         :return: Dictionary, vlanid as key, name as value.
         :rtype: dictionary
         """
-        pf = "1.3.6.1.4.1.9.9.46.1.3.1.1.4.{vlandomain}".format(vlandomain=vlandomain)
-        cleaned = map(lambda x: (x[0].prettyPrint(), x[1]), snmp_next(self.community, self.server, pf))
-        return {int(name[name.rfind('.')+1:]): str(val) for name, val in cleaned}
+        return {oid(name)[-1]: str(val) for name, val in binds}
 
     @get_port
-    @fetch_binds("1.3.6.1.2.1.31.1.1.1.18.{portindex}")
+    @fetch_binds(IF_ALIAS)
     def get_port_alias(self, binds, portindex, port):
         """
         Get the alias of a port
@@ -169,7 +639,7 @@ class CiscoROSwitch(SwitchBase):
         return str(binds[0][1]) or None
 
     @get_vlan
-    @fetch_binds("1.3.6.1.4.1.9.9.46.1.3.1.1.4.{vlandomain}.{vlanid}")
+    @fetch_binds(VLAN_NAME)
     def get_vlan_name(self, binds, vlanid, vlandomain, vlan_name=None, vlan=None):
         """
         Get the name of a vlan
@@ -183,7 +653,7 @@ class CiscoROSwitch(SwitchBase):
         """
         return str(binds[0][1])
 
-    @fetch_binds('1.3.6.1.4.1.9.9.68.1.2.2.1.2.{portindex}')
+    @fetch_binds(ACCESS_VLAN)
     def get_access_vlan(self, binds, portindex):
         """get_access_vlan(community, server, portindex)
         Get the access vlan on a port
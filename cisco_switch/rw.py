@@ -4,80 +4,560 @@
 
 .. moduleauthor:: Christoffer Viken <christoffer@viken.me>
 """
+import logging
 import random
-from pysnmp.proto.rfc1902 import OctetString
+from pysnmp.proto.rfc1902 import OctetString, IpAddress
 import time
 from pysnmp.proto.rfc1905 import NoSuchInstance
 from cisco_switch import SwitchBase
 from cisco_switch.base import get_port
-from cisco_switch.snmp_funcs import snmp_next, snmp_get, snmp_set, set_vals
+from cisco_switch.snmp_funcs import SnmpSession, set_vals, instrumented
+from cisco_switch.oids import OidTemplate, oid_size
+from cisco_switch.batch import MAX_SIZE, MESSAGE_OVERHEAD, VARBIND_OVERHEAD
+from cisco_switch.ro import TRUNK_VLANS, TRUNK_SET_SERIAL, ACCESS_VLAN
+from cisco_switch.trunks import VlanSet, BLOCK_SIZE
 
 __author__ = 'CVi'
-__all__ = ['CiscoWOSwitch']
+__all__ = ['CiscoWOSwitch', 'VlanTransaction']
+
+# vlanTrunkPortVlansEnabled, -Enabled2k, -Enabled3k and -Enabled4k; one 1024 vlan block each.
+TRUNK_VLAN_BLOCKS = TRUNK_VLANS
+# vmVlan, changes when a port goes between trunk and access
+ACCESS_VLANS = "1.3.6.1.4.1.9.9.68.1.2.2.1.2"
+# vtpVlanEntry, changes when a vlan edit is applied
+VLAN_TABLE = "1.3.6.1.4.1.9.9.46.1.3.1.1"
+COPY_ENTRY = OidTemplate("1.3.6.1.4.1.9.9.96.1.1.1.1.{column}.{key}")
+VLAN_EDIT_OPERATION = OidTemplate("1.3.6.1.4.1.9.9.46.1.4.1.1.1.{vlandomain}")
+VLAN_APPLY_STATUS = OidTemplate("1.3.6.1.4.1.9.9.46.1.4.1.1.2.{vlandomain}")
+VLAN_EDIT_OWNER = OidTemplate("1.3.6.1.4.1.9.9.46.1.4.1.1.3.{vlandomain}")
+VLAN_EDIT_TABLE = "1.3.6.1.4.1.9.9.46.1.4.2"
+VLAN_EDIT_NAMES = OidTemplate("1.3.6.1.4.1.9.9.46.1.4.2.1.4.{vlandomain}")
+VLAN_EDIT_NAME = OidTemplate("1.3.6.1.4.1.9.9.46.1.4.2.1.4.{vlandomain}.{vlanid}")
+VLAN_EDIT_ROW_STATUS = OidTemplate("1.3.6.1.4.1.9.9.46.1.4.2.1.11.{vlandomain}.{vlanid}")
+# vtpVlanEditBufferOwner of the edit buffers taken, followed by a number telling them apart
+EDIT_OWNER = "cisco_swith.py"
+# vtpVlanEditRowStatus createAndGo and destroy
+ROW_CREATE_AND_GO = 4
+ROW_DESTROY = 6
+# Times a trunk vlan update is read and set, when vlanTrunkPortSetSerialNo moved between the GET and the SET
+TRUNK_SET_ATTEMPTS = 3
+# Times vtpVlanApplyStatus is read while an apply is in progress, and the seconds between
+APPLY_POLLS = 11
+APPLY_INTERVAL = 0.1
+
+
+def _vlan_block_value(vlans, status, block, value):
+    """
+    The new value of a trunk vlan block, with the vlans in it set to status.
+
+    :param vlans: Vlans to update, those in other blocks are left alone
+    :type vlans: VlanSet
+    :param status: New vlan status as a 0/1 string.
+    :param block: Block number, vlan 1024 * block is its first
+    :type block: int
+    :param value: Current value of the block
+    :type value: OctetString
+    :return: The new value, None if the vlans already have that status
+    :rtype: OctetString
+    """
+    current = VlanSet.from_blocks({block: value.asOctets() if isinstance(value, OctetString) else b''})
+    new = current | vlans if status == "1" else current - vlans
+    if block not in new.dirty_blocks(current):
+        return None
+    return OctetString(new.block(block))
+
 
+def _vlan_items(portindex, vlans):
+    """
+    :param vlans: Vlans to update
+    :type vlans: VlanSet
+    :return: vlanTrunkPortSetSerialNo and the blocks of the port with any of the vlans in them, to GET together
+    :rtype: list
+    """
+    return [TRUNK_SET_SERIAL] + [TRUNK_VLAN_BLOCKS[block].format(portindex=portindex) for block in vlans.dirty_blocks()]
+
+
+def _vlan_update(portindex, vlans, status, binds):
+    """
+    :param binds: Varbinds of the _vlan_items, in order
+    :return: Pairs to SET together; the serial as it was read, and the blocks that change.
+        Empty if the vlans already have that status.
+    :rtype: list[tuple]
+    """
+    pairs = []
+    for block, (name, value) in zip(vlans.dirty_blocks(), binds[1:]):
+        value = _vlan_block_value(vlans, status, block, value)
+        if value is not None:
+            pairs.append((TRUNK_VLAN_BLOCKS[block].format(portindex=portindex), value))
+    return [(TRUNK_SET_SERIAL, binds[0][1])] + pairs if pairs else []
+
+
+def _port_vlan_reads(trunks, access, budget):
+    """
+    :param trunks: Vlans wanted per trunk portindex
+    :type trunks: dict[int, VlanSet]
+    :param access: Access vlan wanted per access portindex
+    :type access: dict[int, int]
+    :param budget: Bytes of varbinds a response is to fit
+    :return: vlanTrunkPortSetSerialNo, every block of the trunk ports and the access vlans, packed into GETs
+        as _set_chunks packs SETs; the serial first, so it is read before anything it guards.
+    :rtype: list[list]
+    """
+    reads = [(TRUNK_SET_SERIAL, 0)] + \
+        [(template.format(portindex=portindex), OctetString(bytes(BLOCK_SIZE)))
+         for portindex in sorted(trunks) for template in TRUNK_VLAN_BLOCKS] + \
+        [(ACCESS_VLAN.format(portindex=portindex), 0) for portindex in sorted(access)]
+    chunks = []
+    size = 0
+    for pair in reads:
+        if not chunks or size + _pair_size(pair) > budget:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(pair[0])
+        size += _pair_size(pair)
+    return chunks
+
+
+def _port_vlan_changes(trunks, access, binds):
+    """
+    :param binds: Varbinds of the _port_vlan_reads, in order
+    :return: The serial as read, and (portindex, pairs to SET, guarded by the serial) per port that changes
+    :rtype: (int, list[tuple])
+    :raises ValueError: If one of the access ports is not an access port
+    """
+    serial, binds = binds[0][1], binds[1:]
+    changes = []
+    blocks = len(TRUNK_VLAN_BLOCKS)
+    for i, portindex in enumerate(sorted(trunks)):
+        current = VlanSet.from_blocks([val.asOctets() if isinstance(val, OctetString) else b''
+                                       for name, val in binds[i * blocks:(i + 1) * blocks]])
+        wanted = trunks[portindex]
+        pairs = [(TRUNK_VLAN_BLOCKS[block].format(portindex=portindex), OctetString(wanted.block(block)))
+                 for block in wanted.dirty_blocks(current)]
+        if pairs:
+            changes.append((portindex, pairs, True))
+    for portindex, (name, val) in zip(sorted(access), binds[len(trunks) * blocks:]):
+        if type(val) == NoSuchInstance:
+            raise ValueError("Port {0} does not exist or is not set to mode access".format(portindex))
+        if int(val) != access[portindex]:
+            changes.append((portindex, [(ACCESS_VLAN.format(portindex=portindex), access[portindex])], False))
+    return serial, changes
+
+
+def _pair_size(pair):
+    """
+    :return: Expected size of a varbind to SET, in bytes
+    :rtype: int
+    """
+    item, value = pair
+    return oid_size(item) + VARBIND_OVERHEAD + (len(value) + 3 if isinstance(value, (OctetString, str)) else 6)
 
+
+def _set_chunks(changes, budget):
+    """
+    Packs the changes of many ports (or vlans) in order into as few SETs as fit in budget bytes each
+    (the serial left out); a SET is started when the pairs of the next port do not fit in the one before.
+    The pairs of a port are never split over SETs.
+
+    :param changes: (portindex, pairs, guarded), as from _port_vlan_changes
+    :return: (portindexes, pairs, guarded) per SET; guarded if any of the ports in it are
+    :rtype: list[tuple]
+    """
+    chunks = []
+    size = 0
+    for portindex, pairs, guarded in changes:
+        pairs_size = sum(_pair_size(pair) for pair in pairs)
+        if not chunks or size + pairs_size > budget:
+            chunks.append(([], [], False))
+            size = 0
+        portindexes, chunk, chunk_guarded = chunks[-1]
+        portindexes.append(portindex)
+        chunk.extend(pairs)
+        chunks[-1] = (portindexes, chunk, chunk_guarded or guarded)
+        size += pairs_size
+    return chunks
+
+
+def _check_serial(error, serial, binds):
+    """
+    Raises error, what a SET guarded by serial raised, unless vlanTrunkPortSetSerialNo has moved since;
+    then the SET failed for some other reason than a port being changed in between.
+
+    :param error: What the SET raised, None if no SET has failed
+    :param serial: vlanTrunkPortSetSerialNo the SET was guarded by
+    :param binds: Varbinds read since, vlanTrunkPortSetSerialNo first
+    """
+    if error is not None and binds[0][1] == serial:
+        raise error
+
+
+def _port_vlan_wanted(switch, trunks, access):
+    """
+    :param switch: Switch to look the ports up on
+    :return: The trunks and access of set_port_vlans per portindex, the vlans of the trunks as VlanSets
+    :rtype: (dict[int, VlanSet], dict[int, int])
+    """
+    trunks = {port if isinstance(port, int) else switch._get_port(port): VlanSet(vlans)
+              for port, vlans in (trunks or {}).items()}
+    access = {port if isinstance(port, int) else switch._get_port(port): vlanid
+              for port, vlanid in (access or {}).items()}
+    return trunks, access
+
+
+def _port_vlan_sets(serial, changes, budget):
+    """
+    The SETs making the changes of many ports. Those with trunk vlans in them are guarded by the serial,
+    which moves one step with each; TestAndIncr, it wraps to 0.
+
+    :param serial: vlanTrunkPortSetSerialNo as read
+    :param changes: (portindex, pairs, guarded), as from _port_vlan_changes
+    :param budget: Bytes of varbinds a SET is to fit
+    :return: (portindexes, pairs, serial) per SET; the serial guarding it first in its pairs, None if not guarded
+    :rtype: list[tuple]
+    """
+    sets = []
+    for portindexes, pairs, guarded in _set_chunks(changes, budget - _pair_size((TRUNK_SET_SERIAL, 0))):
+        if guarded:
+            sets.append((portindexes, [(TRUNK_SET_SERIAL, serial)] + pairs, serial))
+            serial = (int(serial) + 1) % 2 ** 31
+        else:
+            sets.append((portindexes, pairs, None))
+    return sets
+
+
+def _take_binds(vlandomain):
+    """
+    Varbinds taking the vlan edit buffer; the vlans are copied into it, under an owner name of its own.
+    """
+    name = "{0} {1:08x}".format(EDIT_OWNER, random.getrandbits(32))
+    return [(VLAN_EDIT_OPERATION.format(vlandomain=vlandomain), 2),
+            (VLAN_EDIT_OWNER.format(vlandomain=vlandomain), name)]
+
+
+def _taken(pairs, binds):
+    """
+    :param pairs: The _take_binds of a SET that failed
+    :param binds: Varbinds of a GET of the owner, after it failed
+    :return: True if the SET took the edit buffer after all; a resent SET finds it taken by the first one
+    :rtype: bool
+    """
+    return str(binds[0][1]) == pairs[1][1]
+
+
+def _apply_done(binds):
+    """
+    :param binds: Varbinds of a GET of vtpVlanApplyStatus
+    :return: True if the apply succeeded, False if it is in progress
+    :rtype: bool
+    :raises IOError: If it failed
+    see: http://tools.cisco.com/Support/SNMP/do/BrowseOID.do?objectInput=vtpVlanApplyStatus&translate=Translate
+    """
+    stat = int(binds[0][1])
+    if stat > 2:
+        raise IOError("Something went wrong during apply, vtpVlanApplyStatus = {0}".format(stat))
+    return stat == 2
+
+
+def _copy_binds(*columns):
+    """
+    Varbinds creating a ccCopyEntry under a random key.
+
+    :param columns: (column, value) pairs of the entry
+    :return: list of (oid, value)
+    """
+    key = random.randint(1, 255)
+    return [(COPY_ENTRY.format(column=column, key=key), value) for column, value in columns]
+
+
+def _wr_mem_binds():
+    """
+    Varbinds copying running-config to startup-config.
+    """
+    return _copy_binds((3, 4), (4, 3), (14, 4))
+
+
+def _tftp_binds(tftpserver, filename, source, destination):
+    """
+    Varbinds copying a config between a tftp server and the switch.
+
+    :param source: ccCopySourceFileType, 1 = network file, 4 = running-config
+    :param destination: ccCopyDestFileType, same values as source
+    """
+    return _copy_binds((2, 1), (3, source), (4, destination), (5, IpAddress(tftpserver)), (6, filename), (14, 4))
+
+
+class VlanTransaction(object):
+    """
+    Vlan creates, renames and deletes, queued up and made in one vlan edit transaction.
+
+    Use through CiscoWOSwitch.vlan_transaction().
+    """
+    def __init__(self, switch, vlandomain=1, max_size=MAX_SIZE):
+        """
+        :param switch: Switch to edit the vlans of
+        :type switch: CiscoWOSwitch
+        :param vlandomain: vlan domain, usually 1
+        :type vlandomain: int
+        :param max_size: Largest SET to send, in bytes
+        :type max_size: int
+        """
+        self.switch = switch
+        self.vlandomain = vlandomain
+        self.max_size = max_size
+        # (row status, name) per vlanid, None for what is left as it is
+        self.edits = {}
+
+    def _queue(self, vlanid, row_status, name):
+        if vlanid in self.edits:
+            raise ValueError("Vlan {0} is edited in this transaction already".format(vlanid))
+        self.edits[vlanid] = (row_status, name)
+
+    def create_vlan(self, vlanid, name):
+        """
+        Queues creating a vlan.
+
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :type vlanid: int
+        :param name: Name of vlan
+        :type name: basestring
+        """
+        self._queue(vlanid, ROW_CREATE_AND_GO, name)
+
+    def rename_vlan(self, vlanid=0, name=None, *, vlan=None):
+        """
+        Queues renaming a vlan.
+
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :type vlanid: int
+        :param name: New name of vlan
+        :type name: basestring
+        """
+        if vlanid == 0 and vlan is not None:
+            vlanid = self.switch._get_vlan(vlan)
+        self._queue(vlanid, None, name)
+
+    def delete_vlan(self, vlanid=0, *, vlan=None):
+        """
+        Queues deleting a vlan.
+
+        :param vlanid: VlanID, usually the 802.1q tag number.
+        :type vlanid: int
+        """
+        if vlanid == 0 and vlan is not None:
+            vlanid = self.switch._get_vlan(vlan)
+        self._queue(vlanid, ROW_DESTROY, None)
+
+    def _items(self):
+        """
+        :return: vtpVlanEditRowStatus of the queued vlans, to GET from the edit buffer
+        :rtype: list
+        """
+        return [VLAN_EDIT_ROW_STATUS.format(vlandomain=self.vlandomain, vlanid=vlanid) for vlanid in self.edits]
+
+    def _sets(self, binds):
+        """
+        :param binds: Varbinds of the _items
+        :return: Pairs per SET, each vlan's in one of them
+        :rtype: list[list[tuple]]
+        :raises ValueError: If a vlan to create does already exist
+        :raises KeyError: If a vlan to rename or delete does not exist
+        """
+        changes = []
+        for (vlanid, (row_status, name)), (item, val) in zip(self.edits.items(), binds):
+            exists = type(val) != NoSuchInstance
+            if row_status == ROW_CREATE_AND_GO and exists:
+                raise ValueError("Vlan {0} does already exist".format(vlanid))
+            if row_status != ROW_CREATE_AND_GO and not exists:
+                raise KeyError("Vlan {0} does not exist".format(vlanid))
+            pairs = []
+            if row_status is not None:
+                pairs.append((VLAN_EDIT_ROW_STATUS.format(vlandomain=self.vlandomain, vlanid=vlanid), row_status))
+            if name is not None:
+                pairs.append((VLAN_EDIT_NAME.format(vlandomain=self.vlandomain, vlanid=vlanid), name))
+            changes.append((vlanid, pairs, False))
+        budget = self.max_size - MESSAGE_OVERHEAD - len(self.switch.community)
+        return [pairs for vlanids, pairs, guarded in _set_chunks(changes, budget)]
+
+    @staticmethod
+    def _applied(pairs, binds):
+        """
+        :param pairs: Pairs of a SET that failed
+        :param binds: Varbinds of their items, read after it failed
+        :return: True if the SET was applied after all; a resent SET fails where the first one went through
+        :rtype: bool
+        """
+        for (item, value), (name, val) in zip(pairs, binds):
+            if isinstance(value, str):
+                applied = type(val) != NoSuchInstance and str(val) == value
+            else:
+                applied = (type(val) != NoSuchInstance) == (value == ROW_CREATE_AND_GO)
+            if not applied:
+                return False
+        return True
+
+    def send(self):
+        """
+        Makes the queued edits; the edit buffer is taken, the queued vlans are looked up and edited in it,
+        and it is applied once. If anything fails the edit buffer is released with nothing applied.
+
+        raises BlockingIOError if a vlan transaction is in progress.
+        raises ValueError if a vlan to create does already exist
+        raises KeyError if a vlan to rename or delete does not exist
+        raises IOError if the apply failed
+        """
+        if not self.edits:
+            return
+        switch = self.switch
+        switch._start_vlan_transaction(self.vlandomain)
+        try:
+            for pairs in self._sets(switch.session.get(*self._items(), fresh=True)):
+                try:
+                    switch.session.set(*pairs)
+                except IOError:
+                    if not self._applied(pairs, switch.session.get(*[item for item, value in pairs], fresh=True)):
+                        raise
+            switch._commit_vlan_transaction(self.vlandomain)
+        except Exception:
+            self._abort()
+            raise
+        finally:
+            self.edits = {}
+
+    def _abort(self):
+        """
+        Releases the edit buffer after send failed; also past the session deadline, or it stays taken.
+        What the release raises is logged, send raises what failed in the first place.
+        """
+        session = self.switch.session
+        deadline, session.deadline = session.deadline, None
+        try:
+            self.switch._abort_vlan_transaction(self.vlandomain)
+        except Exception:
+            logging.getLogger(__name__).exception("Could not release the vlan edit buffer of {0}"
+                                                  .format(self.switch.server))
+        finally:
+            session.deadline = deadline
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.send()
+
+
+@instrumented
 class CiscoWOSwitch(SwitchBase):
     """
     Cisco write/create-only switch class.
 
     Only has methods that require both read/write or read/create
     """
-    def __init__(self, community, server):
+    def __init__(self, community, server, max_repetitions=25, port=161, cache=None):
         """
         :param community: SNMP Community
         :type community: basestring
         :param server: Host (switch) FQDN or IP
         :type server: basestring
+        :param max_repetitions: Rows per GETBULK when walking tables, 0 walks with GETNEXT
+        :type max_repetitions: int
+        :param port: SNMP port on the switch
+        :type port: int
+        :param cache: Cache to answer reads from, shared between switches if need be; None to always ask
+        :type cache: cisco_switch.cache.ResponseCache
         """
         self.community = community
         self.server = server
+        self.max_repetitions = max_repetitions
+        self.session = SnmpSession(community, server, port=port, cache=cache)
+
+    def close(self):
+        """
+        Closes the SNMP session with the switch.
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def _meta_vlan(self, portindex, status, vlanid=0, vlan_list=()):
         """
         Meta function for updating vlan on a port
+        The serial and the 1k blocks with vlans in them are read in one GET, and the blocks that change are set
+        in one SET guarded by the serial (TestAndIncr). If the SET fails and the serial moved, the port was changed
+        in between (or a resent SET was applied already), it is read and set again; up to TRUNK_SET_ATTEMPTS times.
+        raises ValueError if a vlan is outside 0-4095
 
         :param portindex: Index of the interface/port
         :param vlanid: VlanID, usually the 802.1q tag number.
         :param status: New vlan status as a 0/1 string.
         :param vlan_list: if vlanid is 0, you can bulk set using this.
         """
-        multi = False
-        if vlanid == 0:
-            vlanid = min(vlan_list) if len(vlan_list) > 0 else 0
-            multi = True
-            if len(vlan_list) == 0:
+        vlans = VlanSet((vlanid,) if vlanid else vlan_list)
+        if not vlans:
+            return
+        items = _vlan_items(portindex, vlans)
+        error = serial = None
+        for attempt in range(TRUNK_SET_ATTEMPTS):
+            binds = self.session.get(*items, fresh=True)
+            _check_serial(error, serial, binds)
+            pairs = _vlan_update(portindex, vlans, status, binds)
+            if not pairs:
                 return
-        if vlanid < 0 or vlanid >= 4096:
-            raise ValueError("Invalid VLAN")
-        elif vlanid <= 1023:
-            oid = "1.3.6.1.4.1.9.9.46.1.6.1.1.4.%i" % portindex
-            diff = 0
-        elif vlanid <= 2047:
-            oid = "1.3.6.1.4.1.9.9.46.1.6.1.1.17.%i" % portindex
-            diff = -1024
-        elif vlanid <= 3071:
-            oid = "1.3.6.1.4.1.9.9.46.1.6.1.1.18.%i" % portindex
-            diff = -2048
-        else:
-            oid = "1.3.6.1.4.1.9.9.46.1.6.1.1.19.%i" % portindex
-            diff = -3072
-
-        ((a, serial), (b, vlans)) = snmp_get(self.community, self.server, "1.3.6.1.4.1.9.9.46.1.6.2.0", oid)
-        val_str = vlans.prettyPrint()
-        if val_str == "b''":
-            val_str = "0000"
-        l = val_str[2:].ljust(256, '0')
-        b = list(bin(int(l, 16))[2:].zfill(len(l)*4))
-        if not multi:
-            b[vlanid+diff] = status
-        else:
-            for v in vlan_list:
-                if 0 <= v+diff <= 1023:
-                    b[v+diff] = status
-        b = "".join(b)
-        os = OctetString(binValue=b)
-
-        snmp_set(self.community, self.server, ("1.3.6.1.4.1.9.9.46.1.6.2.0", serial), (oid, os))
+            try:
+                self.session.set(*pairs)
+                return
+            except IOError as e:
+                error, serial = e, pairs[0][1]
+        raise error
+
+    def set_port_vlans(self, trunks=None, access=None, max_size=MAX_SIZE):
+        """
+        Sets the vlans of many ports at once; the trunk vlans of some and the access vlan of others.
+        Everything is read, the serial first, then the ports that change are set in SETs of at most max_size bytes,
+        each trunk port in one of them.
+        The SETs with trunk vlans in them are guarded by the serial, which moves one step with each.
+        If one fails and the serial moved, some port was changed in between (or a resent SET was applied already),
+        it is all read and set again; up to TRUNK_SET_ATTEMPTS times.
+
+            >>> switch.set_port_vlans(trunks={port: switch.vlan_set_on_port(port=port) | [20] for port in uplinks},
+            ...                       access={10105: 20, 10106: 20})
+
+        :param trunks: Vlans each trunk port is to carry, others are removed; per portindex or port
+        :type trunks: dict[int | CiscoPort, collections.Iterable[int]]
+        :param access: Access vlan per portindex or port
+        :type access: dict[int | CiscoPort, int]
+        :param max_size: Largest SET to send, in bytes
+        :type max_size: int
+        :return: The portindexes that were changed
+        :rtype: list[int]
+        :raises ValueError: If a vlan is outside 0-4095, or one of the access ports is not an access port
+        """
+        trunks, access = _port_vlan_wanted(self, trunks, access)
+        if not trunks and not access:
+            return []
+        budget = max_size - MESSAGE_OVERHEAD - len(self.community)
+        reads = _port_vlan_reads(trunks, access, budget)
+        changed = set()
+        error = serial = None
+        for attempt in range(TRUNK_SET_ATTEMPTS):
+            binds = [bind for items in reads for bind in self.session.get(*items, fresh=True)]
+            _check_serial(error, serial, binds)
+            for portindexes, pairs, guard in _port_vlan_sets(*_port_vlan_changes(trunks, access, binds), budget):
+                try:
+                    self.session.set(*pairs)
+                except IOError as e:
+                    if guard is None:
+                        raise
+                    error, serial = e, guard
+                    break
+                changed.update(portindexes)
+            else:
+                return sorted(changed)
+        raise error
 
     def activate_vlan_on_port(self, portindex=0, vlanid=0, vlan=None, port=None):
         """
@@ -93,7 +573,7 @@ class CiscoWOSwitch(SwitchBase):
         if portindex == 0 and port is not None:
             portindex = self._get_port(port)
         if vlanid == 0 and vlan is not None:
-            vlanid, vlanname = self._get_vlan(vlan)
+            vlanid = self._get_vlan(vlan)
 
         self._meta_vlan(portindex=portindex, vlanid=vlanid, status="1")
 
@@ -126,10 +606,7 @@ class CiscoWOSwitch(SwitchBase):
             portindex = self._get_port(port)
         vlans = self._extract_vlan_ids(vlans)
 
-        self._meta_vlan(portindex, "1", vlan_list=[v for v in vlans if 0 < v <= 1023])
-        self._meta_vlan(portindex, "1", vlan_list=[v for v in vlans if 1023 < v <= 2047])
-        self._meta_vlan(portindex, "1", vlan_list=[v for v in vlans if 2047 < v <= 3071])
-        self._meta_vlan(portindex, "1", vlan_list=[v for v in vlans if 3071 < v <= 4095])
+        self._meta_vlan(portindex, "1", vlan_list=[v for v in vlans if 0 < v <= 4095])
 
     def deactivate_vlans_on_port(self, portindex=0, vlans=(), port=None):
         """
@@ -144,50 +621,29 @@ class CiscoWOSwitch(SwitchBase):
             portindex = self._get_port(port)
         vlans = self._extract_vlan_ids(vlans)
 
-        self._meta_vlan(portindex, "0", vlan_list=[v for v in vlans if 0 < v <= 1023])
-        self._meta_vlan(portindex, "0", vlan_list=[v for v in vlans if 1023 < v <= 2047])
-        self._meta_vlan(portindex, "0", vlan_list=[v for v in vlans if 2047 < v <= 3071])
-        self._meta_vlan(portindex, "0", vlan_list=[v for v in vlans if 3071 < v <= 4095])
+        self._meta_vlan(portindex, "0", vlan_list=[v for v in vlans if 0 < v <= 4095])
 
     def wr_mem(self):
         """
         Saves the configuration to flash/disk.
         """
-        key = random.randint(1, 255)
-        snmp_set(self.community, self.server,
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.3.%i' % key, 4),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.4.%i' % key, 3),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.14.%i' % key, 4))
+        self.session.set(*_wr_mem_binds())
 
     def tftp_export(self, tftpserver, filename):
         """
         Copies running config to a tftp server.
         """
-        key = random.randint(1, 255)
-        snmp_set(self.community, self.server,
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.2.%i' % key, 1),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.3.%i' % key, 4),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.4.%i' % key, 1),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.5.%i' % key, tftpserver),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.6.%i' % key, filename),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.14.%i' % key, 4))
+        self.session.set(*_tftp_binds(tftpserver, filename, 4, 1))
 
     def tftp_import(self, tftpserver, filename):
         """
         Copies running config to a tftp server.
         """
-        key = random.randint(1, 255)
-        snmp_set(self.community, self.server,
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.2.%i' % key, 1),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.3.%i' % key, 1),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.4.%i' % key, 4),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.5.%i' % key, tftpserver),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.6.%i' % key, filename),
-                 ('1.3.6.1.4.1.9.9.96.1.1.1.1.14.%i' % key, 4))
+        self.session.set(*_tftp_binds(tftpserver, filename, 1, 4))
 
     @get_port
     @set_vals('1.3.6.1.2.1.31.1.1.1.18.{portindex}')
-    def set_port_alias(self, portindex, value, port):
+    def set_port_alias(self, items, portindex, value, port):
         """
         Sets the alias of a port
 
@@ -260,6 +716,7 @@ class CiscoWOSwitch(SwitchBase):
             portindex = self._get_port(port)
 
         self._set_port_trunk(portindex=portindex, value=1)
+        self.session.invalidate(ACCESS_VLANS)
 
     def make_port_access(self, portindex=0, port=None):
         """
@@ -273,6 +730,26 @@ class CiscoWOSwitch(SwitchBase):
             portindex = self._get_port(port)
 
         self._set_port_trunk(portindex=portindex, value=2)
+        self.session.invalidate(ACCESS_VLANS)
+
+    def vlan_transaction(self, vlandomain=1, max_size=MAX_SIZE):
+        """
+        Queues up vlan creates, renames and deletes, and makes them in one vlan edit transaction
+        when the with-block ends; the edit buffer is taken and applied once, instead of once per vlan.
+        Nothing is sent if the block raises.
+
+            >>> with switch.vlan_transaction() as t:
+            ...     for vlanid in range(100, 300):
+            ...         t.create_vlan(vlanid, "VLAN{0:04d}".format(vlanid))
+            ...     t.delete_vlan(10)
+
+        :param vlandomain: vlan domain, usually 1
+        :type vlandomain: int
+        :param max_size: Largest SET to send, in bytes
+        :type max_size: int
+        :rtype: VlanTransaction
+        """
+        return VlanTransaction(self, vlandomain, max_size)
 
     def _start_vlan_transaction(self, vlandomain):
         """
@@ -282,16 +759,20 @@ class CiscoWOSwitch(SwitchBase):
 
         :param vlandomain: vlan domain, usually 1
         """
-        names = "1.3.6.1.4.1.9.9.46.1.4.2.1.4.{vlandomain}".format(vlandomain=vlandomain)
-        edits = "1.3.6.1.4.1.9.9.46.1.4.1.1.1.{vlandomain}".format(vlandomain=vlandomain)
-        owner = "1.3.6.1.4.1.9.9.46.1.4.1.1.3.{vlandomain}".format(vlandomain=vlandomain)
-        if next(snmp_next(self.community, self.server, names, max_rows=1), False):
-            data = snmp_get(self.community, self.server, owner)
+        names = VLAN_EDIT_NAMES.format(vlandomain=vlandomain)
+        owner = VLAN_EDIT_OWNER.format(vlandomain=vlandomain)
+        if next(self.session.next(names, max_rows=1), False):
+            data = self.session.get(owner)
             raise BlockingIOError("The vlan is being editd by {0}".format(str(data[0][1])))
 
-        snmp_set(self.community, self.server, (edits, 2), (owner, "cisco_swith.py"))
+        pairs = _take_binds(vlandomain)
+        try:
+            self.session.set(*pairs)
+        except IOError:
+            if not _taken(pairs, self.session.get(owner, fresh=True)):
+                raise
 
-        if next(snmp_next(self.community, self.server, "1.3.6.1.4.1.9.9.46.1.4.2", max_rows=1), False):
+        if next(self.session.next(VLAN_EDIT_TABLE, max_rows=1), False):
             return
         else:
             raise IOError("Vlan Edit table did not prepare properly")
@@ -300,26 +781,20 @@ class CiscoWOSwitch(SwitchBase):
         """
         Finishes and commits a vlan transaction
         raises IOError if the update status becomes something other than succeeded
-        see: http://tools.cisco.com/Support/SNMP/do/BrowseOID.do?objectInput=vtpVlanApplyStatus&translate=Translate
 
         :param vlandomain: vlan domain, usually 1
         """
-        edits = "1.3.6.1.4.1.9.9.46.1.4.1.1.1.{vlandomain}".format(vlandomain=vlandomain)
-        updat = "1.3.6.1.4.1.9.9.46.1.4.1.1.2.{vlandomain}".format(vlandomain=vlandomain)
-        snmp_set(self.community, self.server, (edits, 3))
-        stat = int(snmp_get(self.community, self.server, updat)[0][1])
-        count = 0
-        while stat != 2:
-            if stat == 1:
-                count += 1
-                if count > 10:
-                    break
+        edits = VLAN_EDIT_OPERATION.format(vlandomain=vlandomain)
+        updat = VLAN_APPLY_STATUS.format(vlandomain=vlandomain)
+        self.session.set((edits, 3))
+        for poll in range(APPLY_POLLS):
+            if poll:
                 # Give the switch some breathing time
-                time.sleep(0.1)
-            elif stat > 2:
-                raise IOError("Something went wrong during apply, vtpVlanApplyStatus = {0}".format(stat))
-            stat = int(snmp_get(self.community, self.server, updat)[0][1])
-        snmp_set(self.community, self.server, (edits, 4))
+                time.sleep(APPLY_INTERVAL)
+            if _apply_done(self.session.get(updat)):
+                break
+        self.session.set((edits, 4))
+        self.session.invalidate(VLAN_TABLE)
 
     def _abort_vlan_transaction(self, vlandomain):
         """
@@ -327,8 +802,8 @@ class CiscoWOSwitch(SwitchBase):
 
         :param vlandomain: vlan domain, usually 1
         """
-        edits = "1.3.6.1.4.1.9.9.46.1.4.1.1.1.{vlandomain}".format(vlandomain=vlandomain)
-        snmp_set(self.community, self.server, (edits, 4))
+        edits = VLAN_EDIT_OPERATION.format(vlandomain=vlandomain)
+        self.session.set((edits, 4))
 
     def create_vlan(self, vlanid, name, vlandomain=1):
         """
@@ -342,17 +817,8 @@ class CiscoWOSwitch(SwitchBase):
         :param vlandomain: vlan domain, usually 1
         :type vlandomain: int
         """
-        self._start_vlan_transaction(vlandomain)
-        vlanedit = "1.3.6.1.4.1.9.9.46.1.4.2.1.11.{vlandomain}.{vlanid}".format(vlandomain=vlandomain, vlanid=vlanid)
-        vlanname = "1.3.6.1.4.1.9.9.46.1.4.2.1.4.{vlandomain}.{vlanid}".format(vlandomain=vlandomain, vlanid=vlanid)
-        try:
-            if type(snmp_get(self.community, self.server, vlanedit)[0][1]) != NoSuchInstance:
-                raise ValueError("Vlan does already exist")
-            snmp_set(self.community, self.server, (vlanedit, 4), (vlanname, name))
-        except ValueError as e:
-            self._abort_vlan_transaction(vlandomain)
-            raise e
-        self._commit_vlan_transaction(vlandomain)
+        with self.vlan_transaction(vlandomain) as transaction:
+            transaction.create_vlan(vlanid, name)
 
     def rename_vlan(self, vlanid=0, name=None, vlandomain=1, vlan=None):
         """
@@ -366,19 +832,8 @@ class CiscoWOSwitch(SwitchBase):
         :param vlandomain: vlan domain, usually 1
         :type vlandomain: int
         """
-        if vlanid == 0 and vlan is not None:
-            vlanid, oldname = self._get_vlan_name(vlan)
-        self._start_vlan_transaction(vlandomain)
-        vlanedit = "1.3.6.1.4.1.9.9.46.1.4.2.1.11.{vlandomain}.{vlanid}".format(vlandomain=vlandomain, vlanid=vlanid)
-        vlanname = "1.3.6.1.4.1.9.9.46.1.4.2.1.4.{vlandomain}.{vlanid}".format(vlandomain=vlandomain, vlanid=vlanid)
-        try:
-            if type(snmp_get(self.community, self.server, vlanedit)[0][1]) == NoSuchInstance:
-                raise KeyError("Vlan does not exist")
-            snmp_set(self.community, self.server, (vlanname, name))
-        except KeyError as e:
-            self._abort_vlan_transaction(vlandomain)
-            raise e
-        self._commit_vlan_transaction(vlandomain)
+        with self.vlan_transaction(vlandomain) as transaction:
+            transaction.rename_vlan(vlanid, name, vlan=vlan)
 
     def set_access_vlan(self, portindex=0, vlanid=0, vlan=None, port=None):
         """
@@ -396,11 +851,11 @@ class CiscoWOSwitch(SwitchBase):
         if vlanid == 0 and vlan is not None:
             vlanid = self._get_vlan(vlan)
 
-        accessvlan = "1.3.6.1.4.1.9.9.68.1.2.2.1.2.{portindex}".format(portindex=portindex)
-        if type(list(snmp_get(self.community, self.server, accessvlan))) == NoSuchInstance:
+        accessvlan = ACCESS_VLAN.format(portindex=portindex)
+        if type(self.session.get(accessvlan, fresh=True)[0][1]) == NoSuchInstance:
             raise ValueError("Port does not exist or is not set to mode access")
-        snmp_set(self.community, self.server, (accessvlan, vlanid))
-        if int(snmp_get(self.community, self.server, accessvlan)[0][1]) == vlanid:
+        self.session.set((accessvlan, vlanid))
+        if int(self.session.get(accessvlan, fresh=True)[0][1]) != vlanid:
             raise IOError("Could not update access vlan")
 
     def delete_vlan(self, vlanid=0, vlandomain=1, vlan=None):
@@ -413,17 +868,5 @@ class CiscoWOSwitch(SwitchBase):
         :param vlandomain: vlan domain, usually 1
         :type vlandomain: int
         """
-        if vlanid == 0 and vlan is not None:
-            vlanid = self._get_vlan(vlan)
-
-        self._start_vlan_transaction(vlandomain)
-        vlanedit = "1.3.6.1.4.1.9.9.46.1.4.2.1.11.{vlandomain}.{vlanid}".format(vlandomain=vlandomain, vlanid=vlanid)
-        try:
-            if type(snmp_get(self.community, self.server, vlanedit)[0][1]) == NoSuchInstance:
-                raise KeyError("Vlan does not exist")
-            snmp_set(self.community, self.server, (vlanedit, 6))
-        except KeyError as e:
-            self._abort_vlan_transaction(vlandomain)
-            raise e
-        self._commit_vlan_transaction(vlandomain)
-
+        with self.vlan_transaction(vlandomain) as transaction:
+            transaction.delete_vlan(vlanid, vlan=vlan)
@@ -0,0 +1,651 @@
+"""
+.. module:: simulator
+   :synopsis: Simulated Cisco switches for tests and benchmarks
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+A small SNMPv2c agent that answers for the tables this library uses:
+IF-MIB ifTable/ifXTable, CISCO-VTP-MIB vlanTrunkPortTable, vtpVlanTable and
+vtpVlanEditTable (with the edit buffer copy/apply/release cycle),
+CISCO-VLAN-MEMBERSHIP-MIB vmMembershipTable and CISCO-CONFIG-COPY-MIB ccCopyTable.
+
+Every switch listens on its own UDP port, a fleet of them shares one event
+loop running in a background thread:
+
+    >>> with SimulatedFleet(100, latency=0.002, loss=0.01) as fleet:
+    ...     for community, host, port in fleet.targets():
+    ...         CiscoSwitch(community, host, port=port).port_names()
+
+It can also be run stand-alone for load testing:
+
+    python -m cisco_switch.simulator --count 1000 --base-port 20000
+"""
+import asyncio
+import bisect
+import copy
+import random
+import threading
+import time
+from pyasn1.codec.ber import encoder, decoder
+from pysnmp.proto import api
+from pysnmp.proto.rfc1902 import Integer32, OctetString, Counter32, Counter64, Gauge32, TimeTicks, IpAddress
+
+__author__ = 'CVi'
+__all__ = ['SimulatedSwitch', 'SimulatedFleet', 'serve']
+
+pMod = api.protoModules[api.protoVersion2c]
+
+# Error statuses (RFC 3416)
+TOO_BIG = 1
+NO_SUCH_NAME = 2
+BAD_VALUE = 3
+GEN_ERR = 5
+NO_ACCESS = 6
+WRONG_TYPE = 7
+WRONG_VALUE = 10
+NO_CREATION = 11
+INCONSISTENT_VALUE = 12
+RESOURCE_UNAVAILABLE = 13
+NOT_WRITABLE = 17
+
+IF_ENTRY = (1, 3, 6, 1, 2, 1, 2, 2, 1)
+IFX_ENTRY = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1)
+IF_TABLE_LAST_CHANGE = (1, 3, 6, 1, 2, 1, 31, 1, 5, 0)
+SYSTEM = (1, 3, 6, 1, 2, 1, 1)
+VTP = (1, 3, 6, 1, 4, 1, 9, 9, 46, 1)
+MANAGEMENT_DOMAIN_ENTRY = VTP + (2, 1, 1)
+VTP_VLAN_ENTRY = VTP + (3, 1, 1)
+VTP_EDIT_CONTROL_ENTRY = VTP + (4, 1, 1)
+VTP_VLAN_EDIT_ENTRY = VTP + (4, 2, 1)
+VLAN_TRUNK_PORT_ENTRY = VTP + (6, 1, 1)
+VLAN_TRUNK_PORT_SET_SERIAL = VTP + (6, 2, 0)
+VM_MEMBERSHIP_ENTRY = (1, 3, 6, 1, 4, 1, 9, 9, 68, 1, 2, 2, 1)
+CC_COPY_ENTRY = (1, 3, 6, 1, 4, 1, 9, 9, 96, 1, 1, 1, 1)
+
+TRUNK_BLOCK_COLUMNS = (4, 17, 18, 19)
+
+
+def _vlan_bitmap(vlans):
+    bitmap = bytearray(512)
+    for v in vlans:
+        bitmap[v // 8] |= 0x80 >> (v % 8)
+    return bitmap
+
+
+# Vlans 1-4094, what a new trunk carries
+ALL_VLANS = bytes(_vlan_bitmap(range(1, 4095)))
+
+
+def _varbind_size(oid, value):
+    """
+    Roughly the bytes a varbind takes in a message, a little over rather than under.
+    """
+    if isinstance(value, OctetString):
+        return len(oid) + len(value) + 10
+    return len(oid) + 14
+
+
+class _SetError(Exception):
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+
+class SimulatedSwitch(object):
+    """
+    State and SNMP behaviour of one simulated switch.
+
+    Ports are numbered like a stack member: ifIndex 10101 is Gi1/0/1.
+    The first `trunks` ports are dot1q trunks carrying every vlan,
+    the rest are access ports in vlan 1.
+    """
+    def __init__(self, ports=48, vlans=(1,), trunks=2, community="public", vlandomain=1,
+                 max_size=1472, latency=0.0, loss=0.0, seed=None):
+        """
+        :param ports: Number of physical ports
+        :type ports: int
+        :param vlans: Vlan ids present in the vlan table
+        :type vlans: collections.Iterable[int]
+        :param trunks: Number of ports (from the first) that are trunks
+        :type trunks: int
+        :param community: Community accepted for both reads and writes
+        :type community: str
+        :param vlandomain: VTP management domain index
+        :type vlandomain: int
+        :param max_size: Largest response message in bytes, above it tooBig is returned
+        :type max_size: int
+        :param latency: Seconds to delay each response
+        :type latency: float
+        :param loss: Probability of silently dropping a request
+        :type loss: float
+        :param seed: Seed for loss and counter rates
+        """
+        self.community = community
+        self.vlandomain = vlandomain
+        self.max_size = max_size
+        self.latency = latency
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.boot = time.time()
+        self.stats = {'requests': 0, 'dropped': 0, 'bytes_in': 0, 'bytes_out': 0, 'get': 0, 'next': 0,
+                      'bulk': 0, 'set': 0, 'tooBig': 0}
+
+        self.interfaces = {}
+        self.trunk_ports = {}
+        self.access_ports = {}
+        for n in range(1, ports + 1):
+            index = 10100 + n
+            self.interfaces[index] = {
+                'name': "Gi1/0/{0}".format(n),
+                'descr': "GigabitEthernet1/0/{0}".format(n),
+                'alias': "",
+                'admin': 1,
+                'oper': 1,
+                'last_change': 0,
+                'base': self.random.randrange(2 ** 40),
+                'rate': self.random.randrange(10 ** 3, 10 ** 8),
+            }
+            if n <= trunks:
+                self.trunk_ports[index] = {'state': 1, 'bitmap': bytearray(ALL_VLANS)}
+            else:
+                self.trunk_ports[index] = {'state': 2, 'bitmap': bytearray(ALL_VLANS)}
+                self.access_ports[index] = 1
+        self.vlans = {vlanid: "VLAN{0:04d}".format(vlanid) for vlanid in vlans}
+        self.vlans.setdefault(1, "default")
+        self.config_rev = 1
+        self.if_table_last_change = 0
+        self.serial = 0
+        self.edit_buffer = None
+        self.edit_owner = ""
+        self.apply_status = 2
+        self.copies = {}
+        self._view = None
+
+    # State helpers
+
+    def uptime(self):
+        return int((time.time() - self.boot) * 100) % 2 ** 32
+
+    def octets(self, index, out=False):
+        """
+        Monotonic 64 bit octet counter of an interface, advancing with the port's rate.
+        """
+        interface = self.interfaces[index]
+        value = interface['base'] + int(interface['rate'] * (time.time() - self.boot))
+        return (value // 3 if out else value) % 2 ** 64
+
+    def _interface_changed(self, index):
+        self.interfaces[index]['last_change'] = self.uptime()
+        self.if_table_last_change = self.uptime()
+
+    def _state(self):
+        return (self.interfaces, self.trunk_ports, self.access_ports, self.vlans, self.config_rev,
+                self.if_table_last_change, self.serial, self.edit_buffer, self.edit_owner, self.apply_status,
+                self.copies)
+
+    def _restore(self, state):
+        (self.interfaces, self.trunk_ports, self.access_ports, self.vlans, self.config_rev,
+         self.if_table_last_change, self.serial, self.edit_buffer, self.edit_owner, self.apply_status,
+         self.copies) = state
+
+    # The MIB view
+
+    def _objects(self):
+        """
+        Yields (oid, value) for every object; values may be callables evaluated at read time.
+        """
+        yield SYSTEM + (1, 0), OctetString("Simulated Cisco IOS Software")
+        yield SYSTEM + (3, 0), lambda: TimeTicks(self.uptime())
+        yield SYSTEM + (5, 0), OctetString("simulated")
+        yield (1, 3, 6, 1, 2, 1, 2, 1, 0), Integer32(len(self.interfaces))
+        for index, interface in self.interfaces.items():
+            yield IF_ENTRY + (1, index), Integer32(index)
+            yield IF_ENTRY + (2, index), OctetString(interface['descr'])
+            yield IF_ENTRY + (3, index), Integer32(6)
+            yield IF_ENTRY + (7, index), Integer32(interface['admin'])
+            yield IF_ENTRY + (8, index), Integer32(interface['oper'])
+            yield IF_ENTRY + (9, index), TimeTicks(interface['last_change'])
+            yield IF_ENTRY + (10, index), lambda i=index: Counter32(self.octets(i) % 2 ** 32)
+            yield IF_ENTRY + (11, index), lambda i=index: Counter32(self.octets(i) // 512 % 2 ** 32)
+            yield IF_ENTRY + (14, index), Counter32(0)
+            yield IF_ENTRY + (16, index), lambda i=index: Counter32(self.octets(i, True) % 2 ** 32)
+            yield IF_ENTRY + (17, index), lambda i=index: Counter32(self.octets(i, True) // 512 % 2 ** 32)
+            yield IF_ENTRY + (20, index), Counter32(0)
+            yield IFX_ENTRY + (1, index), OctetString(interface['name'])
+            yield IFX_ENTRY + (6, index), lambda i=index: Counter64(self.octets(i))
+            yield IFX_ENTRY + (7, index), lambda i=index: Counter64(self.octets(i) // 512)
+            yield IFX_ENTRY + (10, index), lambda i=index: Counter64(self.octets(i, True))
+            yield IFX_ENTRY + (11, index), lambda i=index: Counter64(self.octets(i, True) // 512)
+            yield IFX_ENTRY + (18, index), OctetString(interface['alias'])
+        yield IF_TABLE_LAST_CHANGE, TimeTicks(self.if_table_last_change)
+
+        domain = self.vlandomain
+        yield MANAGEMENT_DOMAIN_ENTRY + (2, domain), OctetString("SIM")
+        yield MANAGEMENT_DOMAIN_ENTRY + (4, domain), Gauge32(self.config_rev)
+        for vlanid, name in self.vlans.items():
+            yield VTP_VLAN_ENTRY + (2, domain, vlanid), Integer32(1)
+            yield VTP_VLAN_ENTRY + (3, domain, vlanid), Integer32(1)
+            yield VTP_VLAN_ENTRY + (4, domain, vlanid), OctetString(name)
+        yield VTP_EDIT_CONTROL_ENTRY + (1, domain), Integer32(1)
+        yield VTP_EDIT_CONTROL_ENTRY + (2, domain), Integer32(self.apply_status)
+        yield VTP_EDIT_CONTROL_ENTRY + (3, domain), OctetString(self.edit_owner)
+        if self.edit_buffer is not None:
+            for vlanid, name in self.edit_buffer.items():
+                yield VTP_VLAN_EDIT_ENTRY + (4, domain, vlanid), OctetString(name)
+                yield VTP_VLAN_EDIT_ENTRY + (11, domain, vlanid), Integer32(1)
+
+        for index, trunk in self.trunk_ports.items():
+            trunking = trunk['state'] == 1
+            yield VLAN_TRUNK_PORT_ENTRY + (3, index), Integer32(4)
+            yield VLAN_TRUNK_PORT_ENTRY + (5, index), Integer32(1)
+            yield VLAN_TRUNK_PORT_ENTRY + (13, index), Integer32(trunk['state'])
+            yield VLAN_TRUNK_PORT_ENTRY + (14, index), Integer32(1 if trunking else 2)
+            yield VLAN_TRUNK_PORT_ENTRY + (16, index), Integer32(4 if trunking else 6)
+            for block, column in enumerate(TRUNK_BLOCK_COLUMNS):
+                yield VLAN_TRUNK_PORT_ENTRY + (column, index), OctetString(
+                    bytes(trunk['bitmap'][block * 128:(block + 1) * 128]))
+        yield VLAN_TRUNK_PORT_SET_SERIAL, Integer32(self.serial)
+
+        for index, vlanid in self.access_ports.items():
+            yield VM_MEMBERSHIP_ENTRY + (1, index), Integer32(1)
+            yield VM_MEMBERSHIP_ENTRY + (2, index), Integer32(vlanid)
+            yield VM_MEMBERSHIP_ENTRY + (3, index), Integer32(2)
+
+        for key, entry in self.copies.items():
+            for column, value in sorted(entry.items()):
+                yield CC_COPY_ENTRY + (column, key), value
+
+    def view(self):
+        """
+        The sorted OID list and value map, rebuilt after every successful SET.
+        """
+        if self._view is None:
+            values = dict(self._objects())
+            self._view = (sorted(values), values)
+        return self._view
+
+    def get(self, oid):
+        oids, values = self.view()
+        if oid in values:
+            value = values[oid]
+            return oid, value() if callable(value) else value
+        return oid, pMod.NoSuchInstance('')
+
+    def get_next(self, oid):
+        oids, values = self.view()
+        i = bisect.bisect_right(oids, oid)
+        if i >= len(oids):
+            return oid, pMod.EndOfMibView('')
+        value = values[oids[i]]
+        return oids[i], value() if callable(value) else value
+
+    # Writes
+
+    def set(self, varbinds):
+        """
+        Applies all varbinds or none of them.
+
+        :return: error status and (1-based) index, (0, 0) on success.
+        """
+        saved = copy.deepcopy(self._state())
+        for i, (oid, value) in enumerate(varbinds):
+            try:
+                self._set(tuple(oid), value)
+            except _SetError as e:
+                self._restore(saved)
+                return e.status, i + 1
+        self._view = None
+        return 0, 0
+
+    def _set(self, oid, value):
+        prefix, column, index = oid[:-2], oid[-2], oid[-1]
+        if prefix == IF_ENTRY and column == 7:
+            self._require(index in self.interfaces, NO_CREATION)
+            self._require(int(value) in (1, 2), WRONG_VALUE)
+            self.interfaces[index]['admin'] = int(value)
+            self.interfaces[index]['oper'] = int(value)
+            self._interface_changed(index)
+        elif prefix == IFX_ENTRY and column == 18:
+            self._require(index in self.interfaces, NO_CREATION)
+            self._require(isinstance(value, OctetString) and len(value) <= 64, WRONG_TYPE)
+            self.interfaces[index]['alias'] = str(value)
+        elif oid == VLAN_TRUNK_PORT_SET_SERIAL:
+            # TestAndIncr
+            self._require(int(value) == self.serial, INCONSISTENT_VALUE)
+            self.serial = (self.serial + 1) % 2 ** 31
+        elif prefix == VLAN_TRUNK_PORT_ENTRY and column in TRUNK_BLOCK_COLUMNS:
+            self._require(index in self.trunk_ports, NO_CREATION)
+            self._require(isinstance(value, OctetString) and len(value) <= 128, WRONG_VALUE)
+            block = TRUNK_BLOCK_COLUMNS.index(column)
+            data = bytes(value.asOctets()).ljust(128, b'\x00')
+            self.trunk_ports[index]['bitmap'][block * 128:(block + 1) * 128] = data
+        elif prefix == VLAN_TRUNK_PORT_ENTRY and column == 13:
+            self._require(index in self.trunk_ports, NO_CREATION)
+            self._require(1 <= int(value) <= 5, WRONG_VALUE)
+            self.trunk_ports[index]['state'] = int(value)
+            if int(value) == 2:
+                self.access_ports.setdefault(index, 1)
+            else:
+                self.access_ports.pop(index, None)
+        elif prefix == VM_MEMBERSHIP_ENTRY and column == 2:
+            self._require(index in self.access_ports, NO_CREATION)
+            self._require(int(value) in self.vlans, INCONSISTENT_VALUE)
+            self.access_ports[index] = int(value)
+        elif prefix == VTP_EDIT_CONTROL_ENTRY and index == self.vlandomain:
+            self._set_edit_control(column, value)
+        elif oid[:-3] == VTP_VLAN_EDIT_ENTRY and oid[-2] == self.vlandomain:
+            self._set_edit_entry(oid[-3], oid[-1], value)
+        elif prefix == CC_COPY_ENTRY and column in (2, 3, 4, 5, 6, 14):
+            self._set_copy_entry(column, index, value)
+        else:
+            raise _SetError(NOT_WRITABLE)
+
+    @staticmethod
+    def _require(condition, status):
+        if not condition:
+            raise _SetError(status)
+
+    def _set_edit_control(self, column, value):
+        if column == 1:
+            operation = int(value)
+            if operation == 2:
+                # copy
+                self._require(self.edit_buffer is None, RESOURCE_UNAVAILABLE)
+                self.edit_buffer = dict(self.vlans)
+            elif operation == 3:
+                # apply
+                self._require(self.edit_buffer is not None, INCONSISTENT_VALUE)
+                self.vlans = dict(self.edit_buffer)
+                self.config_rev += 1
+                self.apply_status = 2
+                for index, vlanid in self.access_ports.items():
+                    if vlanid not in self.vlans:
+                        self.access_ports[index] = 1
+            elif operation == 4:
+                # release
+                self.edit_buffer = None
+                self.edit_owner = ""
+            else:
+                self._require(operation in (1, 5), WRONG_VALUE)
+        elif column == 3:
+            self.edit_owner = str(value)
+        else:
+            raise _SetError(NOT_WRITABLE)
+
+    def _set_edit_entry(self, column, vlanid, value):
+        self._require(self.edit_buffer is not None, INCONSISTENT_VALUE)
+        if column == 11:
+            status = int(value)
+            if status in (4, 5):
+                # createAndGo, createAndWait
+                self._require(vlanid not in self.edit_buffer and 1 <= vlanid <= 4094, INCONSISTENT_VALUE)
+                self.edit_buffer[vlanid] = "VLAN{0:04d}".format(vlanid)
+            elif status == 6:
+                # destroy
+                self._require(vlanid in self.edit_buffer, INCONSISTENT_VALUE)
+                del self.edit_buffer[vlanid]
+            else:
+                self._require(status == 1 and vlanid in self.edit_buffer, INCONSISTENT_VALUE)
+        elif column == 4:
+            self._require(vlanid in self.edit_buffer, INCONSISTENT_VALUE)
+            self._require(len(value) <= 32, WRONG_VALUE)
+            self.edit_buffer[vlanid] = str(value)
+        else:
+            raise _SetError(NOT_WRITABLE)
+
+    def _set_copy_entry(self, column, key, value):
+        entry = self.copies.get(key)
+        if column == 14:
+            status = int(value)
+            if status in (4, 5):
+                self._require(entry is None or 14 not in entry, INCONSISTENT_VALUE)
+                entry = self.copies.setdefault(key, {})
+                entry[14] = Integer32(1)
+                # ccCopyState: successful
+                entry[10] = Integer32(3)
+            elif status == 6:
+                self.copies.pop(key, None)
+            else:
+                raise _SetError(WRONG_VALUE)
+        else:
+            if column == 5:
+                self._require(isinstance(value, IpAddress), WRONG_TYPE)
+            self.copies.setdefault(key, {})[column] = value
+
+    # The protocol
+
+    def handle(self, whole_msg):
+        """
+        Handles one request message.
+
+        :return: Response message, or None if nothing is to be sent back.
+        """
+        self.stats['requests'] += 1
+        self.stats['bytes_in'] += len(whole_msg)
+        if self.loss and self.random.random() < self.loss:
+            self.stats['dropped'] += 1
+            return None
+        try:
+            if int(api.decodeMessageVersion(whole_msg)) != api.protoVersion2c:
+                return None
+            msg, rest = decoder.decode(whole_msg, asn1Spec=pMod.Message())
+        except Exception:
+            return None
+        if str(pMod.apiMessage.getCommunity(msg)) != self.community:
+            return None
+
+        req = pMod.apiMessage.getPDU(msg)
+        rsp = pMod.apiPDU.getResponse(req)
+        varbinds = [(tuple(oid), val) for oid, val in pMod.apiPDU.getVarBinds(req)]
+        bulk = False
+        if req.isSameTypeWith(pMod.GetRequestPDU()):
+            self.stats['get'] += 1
+            pMod.apiPDU.setVarBinds(rsp, [self.get(oid) for oid, val in varbinds])
+        elif req.isSameTypeWith(pMod.GetNextRequestPDU()):
+            self.stats['next'] += 1
+            pMod.apiPDU.setVarBinds(rsp, [self.get_next(oid) for oid, val in varbinds])
+        elif req.isSameTypeWith(pMod.GetBulkRequestPDU()):
+            self.stats['bulk'] += 1
+            bulk = True
+            pMod.apiPDU.setVarBinds(rsp, self._bulk(req, varbinds))
+        elif req.isSameTypeWith(pMod.SetRequestPDU()):
+            self.stats['set'] += 1
+            status, index = self.set(varbinds)
+            pMod.apiPDU.setVarBinds(rsp, varbinds)
+            if status:
+                pMod.apiPDU.setErrorStatus(rsp, status)
+                pMod.apiPDU.setErrorIndex(rsp, index)
+        else:
+            return None
+
+        rsp_msg = pMod.apiMessage.getResponse(msg)
+        pMod.apiMessage.setPDU(rsp_msg, rsp)
+        data = encoder.encode(rsp_msg)
+        if len(data) > self.max_size and bulk:
+            # GETBULK responses are trimmed to fit, not refused
+            rsp_varbinds = pMod.apiPDU.getVarBinds(rsp)
+            while len(data) > self.max_size and rsp_varbinds:
+                # Varbinds of a walk are about the same size, this takes one or two tries
+                keep = len(rsp_varbinds) * (self.max_size - 64) // len(data)
+                rsp_varbinds = rsp_varbinds[:min(keep, len(rsp_varbinds) - 1)]
+                pMod.apiPDU.setVarBinds(rsp, rsp_varbinds)
+                data = encoder.encode(rsp_msg)
+        elif len(data) > self.max_size:
+            self.stats['tooBig'] += 1
+            pMod.apiPDU.setVarBinds(rsp, [])
+            pMod.apiPDU.setErrorStatus(rsp, TOO_BIG)
+            pMod.apiPDU.setErrorIndex(rsp, 0)
+            data = encoder.encode(rsp_msg)
+        self.stats['bytes_out'] += len(data)
+        return data
+
+    def _bulk(self, req, varbinds):
+        non_repeaters = min(int(pMod.apiBulkPDU.getNonRepeaters(req)), len(varbinds))
+        max_repetitions = int(pMod.apiBulkPDU.getMaxRepetitions(req))
+        result = [self.get_next(oid) for oid, val in varbinds[:non_repeaters]]
+        cursor = [oid for oid, val in varbinds[non_repeaters:]]
+        # No more rows than fit in a response, building and encoding the rest only to trim them off is slow
+        size = sum(_varbind_size(oid, val) for oid, val in result)
+        for repetition in range(max_repetitions):
+            if not cursor or len(result) > 2048 or size > self.max_size:
+                break
+            row = [self.get_next(oid) for oid in cursor]
+            result.extend(row)
+            size += sum(_varbind_size(oid, val) for oid, val in row)
+            if all(isinstance(val, pMod.EndOfMibView) for oid, val in row):
+                break
+            cursor = [oid for oid, val in row]
+        return result
+
+
+class _AgentProtocol(asyncio.DatagramProtocol):
+    def __init__(self, switch):
+        self.switch = switch
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        response = self.switch.handle(data)
+        if response is None:
+            return
+        if self.switch.latency:
+            asyncio.get_event_loop().call_later(self.switch.latency, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+
+async def serve(switch, host="127.0.0.1", port=0):
+    """
+    Serves a simulated switch on the running event loop.
+
+    :return: The datagram transport and the port it listens on
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(lambda: _AgentProtocol(switch),
+                                                              local_addr=(host, port))
+    return transport, transport.get_extra_info('sockname')[1]
+
+
+class SimulatedFleet(object):
+    """
+    Many simulated switches served from an event loop in a background thread.
+    """
+    def __init__(self, count, host="127.0.0.1", base_port=0, **kwargs):
+        """
+        :param count: Number of switches
+        :type count: int
+        :param host: Address to listen on
+        :type host: str
+        :param base_port: First UDP port; switch n listens on base_port + n. 0 picks free ports.
+        :type base_port: int
+        :param kwargs: Passed to every SimulatedSwitch
+        """
+        self.host = host
+        self.base_port = base_port
+        self.switches = [SimulatedSwitch(**kwargs) for i in range(count)]
+        self.ports = []
+        self._transports = []
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        ready = threading.Event()
+        failed = []
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._serve())
+            except Exception as e:
+                # Such as a port already in use; the switches served so far are closed again
+                failed.append(e)
+                for transport in self._transports:
+                    transport.close()
+                self._loop.run_until_complete(asyncio.sleep(0))
+                return
+            finally:
+                ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="SimulatedFleet", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if failed:
+            self._thread.join()
+            self._loop.close()
+            self._transports = []
+            self.ports = []
+            raise failed[0]
+        return self
+
+    async def _serve(self):
+        for n, switch in enumerate(self.switches):
+            transport, port = await serve(switch, self.host, self.base_port + n if self.base_port else 0)
+            self._transports.append(transport)
+            self.ports.append(port)
+
+    def stop(self):
+        def close():
+            for transport in self._transports:
+                transport.close()
+            self._loop.stop()
+        self._loop.call_soon_threadsafe(close)
+        self._thread.join()
+        self._loop.close()
+        self._transports = []
+
+    def targets(self):
+        """
+        :return: (community, host, port) for every switch
+        :rtype: list[(str, str, int)]
+        """
+        return [(switch.community, self.host, port) for switch, port in zip(self.switches, self.ports)]
+
+    def stats(self):
+        """
+        Request statistics summed over the fleet.
+        """
+        total = {}
+        for switch in self.switches:
+            for key, value in switch.stats.items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve simulated Cisco switches over SNMPv2c")
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--base-port', type=int, default=16100)
+    parser.add_argument('--ports', type=int, default=48)
+    parser.add_argument('--vlans', type=int, default=10, help="Vlans 1 to N exist")
+    parser.add_argument('--community', default="public")
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--loss', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fleet = SimulatedFleet(args.count, host=args.host, base_port=args.base_port, ports=args.ports,
+                           vlans=range(1, args.vlans + 1), community=args.community,
+                           latency=args.latency, loss=args.loss)
+    with fleet:
+        print("Serving {0} switches on {1} ports {2}-{3}".format(
+            args.count, args.host, fleet.ports[0], fleet.ports[-1]), flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,456 @@
+"""
+.. module:: snmp_async
+   :synopsis: Asyncio SNMP background
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+Coroutine counterparts of snmp_get, snmp_set, snmp_next and snmp_bulk.
+
+pysnmp's own asyncio API is built on generator based coroutines that newer
+Python versions no longer support, so this talks SNMPv2c directly: pysnmp's
+protocol API builds and parses the messages, asyncio moves the datagrams.
+One UDP endpoint per event loop (and address family) is shared by every request
+on that loop, responses are matched back to their requests by request-id.
+"""
+import asyncio
+import random
+import socket
+import time
+import weakref
+from collections import deque
+from functools import wraps
+from pyasn1.codec.ber import encoder, decoder
+from pysnmp.proto import api
+from pysnmp.proto.rfc1902 import ObjectName
+from pysnmp.proto.rfc1905 import EndOfMibView
+from cisco_switch.oids import oid, dotted
+from cisco_switch.snmp_funcs import TooBigError, TOO_BIG, TIMEOUT, RETRIES, PduRecord, hooks, snmp_value, _defaults, \
+    _pdu_limit, _rtt_estimate, _chunked, _report, _walk_page, _OPERATIONS
+
+__author__ = 'CVi'
+__all__ = ['AsyncSnmpSession', 'AsyncWalk', 'snmp_get_async', 'snmp_set_async', 'snmp_next_async', 'snmp_bulk_async',
+           'fetch_binds_async', 'walk_binds_async', 'set_vals_async']
+
+pMod = api.protoModules[api.protoVersion2c]
+
+_endpoints = weakref.WeakKeyDictionary()
+_request_id = random.randrange(1, 2 ** 30)
+
+
+def _next_request_id():
+    global _request_id
+    _request_id = _request_id % (2 ** 31 - 1) + 1
+    return _request_id
+
+
+def _walk_pdu(name, max_repetitions):
+    """
+    :return: A GETBULK request for max_repetitions varbinds after name, or a GETNEXT if max_repetitions is 0
+    """
+    if max_repetitions:
+        pdu = pMod.GetBulkRequestPDU()
+        pMod.apiBulkPDU.setDefaults(pdu)
+        pMod.apiBulkPDU.setNonRepeaters(pdu, 0)
+        pMod.apiBulkPDU.setMaxRepetitions(pdu, max_repetitions)
+    else:
+        pdu = pMod.GetNextRequestPDU()
+        pMod.apiPDU.setDefaults(pdu)
+    pMod.apiPDU.setVarBinds(pdu, [(name, pMod.null)])
+    return pdu
+
+
+class AsyncWalk(object):
+    """
+    Walk for AsyncSnmpSession, iterated over with async for; resumed from cursor the same way.
+    """
+    def __init__(self, session, item, cursor=None, max_repetitions=25):
+        """
+        :type session: AsyncSnmpSession
+        :param item: OID to walk the subtree of
+        :param cursor: OID to go on after, as AsyncWalk.cursor was; None to start at the beginning
+        :param max_repetitions: Varbinds per GETBULK, 0 walks with GETNEXT
+        :type max_repetitions: int
+        """
+        self.session = session
+        self.prefix = oid(item)
+        self.cursor = self.prefix if cursor is None else oid(cursor)
+        self.max_repetitions = max_repetitions
+        self.page = deque()
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.page:
+            if self.done:
+                raise StopAsyncIteration
+            rsp, varbinds = await self.session._request(_walk_pdu(self.cursor, self.max_repetitions))
+            page, self.done = _walk_page(self.prefix, self.cursor, varbinds)
+            self.page.extend(page)
+        name, val = self.page.popleft()
+        self.cursor = name
+        return name, val
+
+    def __repr__(self):
+        return "<AsyncWalk: {0} at {1}>".format(dotted(self.prefix), dotted(self.cursor))
+
+
+class _SnmpClientProtocol(asyncio.DatagramProtocol):
+    """
+    Client side datagram protocol, resolves pending requests by request-id.
+    """
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            msg, rest = decoder.decode(data, asn1Spec=pMod.Message())
+            pdu = pMod.apiMessage.getPDU(msg)
+            request_id = int(pMod.apiPDU.getRequestID(pdu))
+        except Exception:
+            # Not something we can make sense of; the request will time out.
+            return
+        future = self.pending.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_result((pdu, len(data)))
+
+    def error_received(self, exc):
+        # ICMP errors can not be tied to a request; let them time out.
+        pass
+
+    def connection_lost(self, exc):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(IOError(exc or "Transport closed"))
+        self.pending.clear()
+
+
+async def _endpoint(family):
+    """
+    The shared endpoint for the running loop and address family.
+
+    :rtype: _SnmpClientProtocol
+    """
+    loop = asyncio.get_running_loop()
+    endpoints = _endpoints.setdefault(loop, {})
+    if family not in endpoints:
+        endpoints[family] = loop.create_task(
+            loop.create_datagram_endpoint(_SnmpClientProtocol, family=family))
+    transport, protocol = await asyncio.shield(endpoints[family])
+    return protocol
+
+
+def _raise_on_error(pdu, varbinds):
+    error_status = pMod.apiPDU.getErrorStatus(pdu)
+    if error_status:
+        error_index = int(pMod.apiPDU.getErrorIndex(pdu, muteErrors=True))
+        err = '%s at %s' % (error_status.prettyPrint(), error_index and varbinds[error_index-1] or '?')
+        if int(error_status) == TOO_BIG:
+            raise TooBigError(err)
+        raise IOError(err)
+
+
+class AsyncSnmpSession(object):
+    """
+    Asyncio SNMP session with one switch.
+
+    The switch address is resolved on the first request and kept;
+    the UDP endpoint of the event loop is shared with every other session on it.
+    """
+    def __init__(self, community, server, port=161, timeout=TIMEOUT, retries=RETRIES, adaptive=True):
+        """
+        :param community: SNMP Community
+        :type community: basestring
+        :param server: Host (switch) FQDN or IP
+        :type server: basestring
+        :param port: SNMP port on the switch
+        :type port: int
+        :param timeout: Seconds to wait for a response (until the round trip time is known, if adaptive)
+        :type timeout: float
+        :param retries: Resends before giving up (at the most, if adaptive)
+        :type retries: int
+        :param adaptive: Derive timeout and retries from the round trip times of the switch
+        :type adaptive: bool
+        """
+        self.community = community
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.adaptive = adaptive
+        self.address = None
+        self.closed = False
+        self.limit = _pdu_limit(server, port)
+        self.rtt = _rtt_estimate(server, port, timeout, retries)
+
+    async def _resolve(self):
+        if self.address is None:
+            loop = asyncio.get_running_loop()
+            info = await loop.getaddrinfo(self.server, self.port, type=socket.SOCK_DGRAM)
+            if not info:
+                raise IOError("Could not resolve {0}".format(self.server))
+            family, kind, proto, canonname, address = info[0]
+            self.address = family, address
+        return self.address
+
+    async def _request(self, pdu):
+        """
+        Sends a request PDU and waits for the response, retrying on timeout.
+
+        :return: The response PDU and its varbinds
+        """
+        if self.closed:
+            raise IOError("Session with {0} is closed".format(self.server))
+        family, address = await self._resolve()
+        protocol = await _endpoint(family)
+
+        if self.adaptive:
+            attempts = self.rtt.attempts
+        else:
+            attempts = [self.timeout] * (self.retries + 1)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        sent = {}
+        record = None
+        try:
+            for timeout in attempts:
+                # A request-id per attempt, so the response tells which attempt it answers.
+                request_id = _next_request_id()
+                pMod.apiPDU.setRequestID(pdu, request_id)
+                msg = pMod.Message()
+                pMod.apiMessage.setDefaults(msg)
+                pMod.apiMessage.setCommunity(msg, self.community)
+                pMod.apiMessage.setPDU(msg, pdu)
+                protocol.pending[request_id] = future
+                sent[request_id] = loop.time()
+                data = encoder.encode(msg)
+                if hooks and record is None:
+                    record = PduRecord(_OPERATIONS.get(type(pdu).__name__), len(pMod.apiPDU.getVarBindList(pdu)),
+                                       len(data), time.monotonic())
+                elif record is not None:
+                    record.retries += 1
+                protocol.transport.sendto(data, address)
+                try:
+                    rsp, size = await asyncio.wait_for(asyncio.shield(future), timeout)
+                    break
+                except asyncio.TimeoutError:
+                    continue
+            else:
+                self.rtt.timed_out()
+                if record is not None:
+                    record.latency = time.monotonic() - record.sent
+                    _report([record], self.server, self.port)
+                raise TimeoutError("No SNMP response received before timeout")
+        finally:
+            for request_id in sent:
+                protocol.pending.pop(request_id, None)
+
+        self.rtt.sample(loop.time() - sent[int(pMod.apiPDU.getRequestID(rsp))])
+
+        varbinds = pMod.apiPDU.getVarBinds(rsp)
+        if record is not None:
+            record.answered = True
+            record.latency = time.monotonic() - record.sent
+            record.response_bytes = size
+            record.response_varbinds = len(varbinds)
+            record.error_status = int(pMod.apiPDU.getErrorStatus(rsp))
+            _report([record], self.server, self.port)
+        _raise_on_error(rsp, varbinds)
+        return rsp, varbinds
+
+    async def get(self, *items):
+        """
+        GETs items, split over as many requests as it takes for the responses to fit.
+        The number of varbinds the switch manages is remembered and later GETs are sized by it.
+        """
+        binds = []
+        for chunk in _chunked(items, self.limit.max_varbinds):
+            binds.extend(await self._get_split(chunk))
+        return binds
+
+    async def _get_split(self, items):
+        try:
+            binds = await self._get(*items)
+        except TooBigError:
+            if len(items) < 2:
+                raise
+            self.limit.failed(len(items))
+            half = len(items) // 2
+            return await self._get_split(items[:half]) + await self._get_split(items[half:])
+        self.limit.worked(len(items))
+        return binds
+
+    async def _get(self, *items):
+        pdu = pMod.GetRequestPDU()
+        pMod.apiPDU.setDefaults(pdu)
+        pMod.apiPDU.setVarBinds(pdu, [(item, pMod.null) for item in items])
+        rsp, varbinds = await self._request(pdu)
+        return list(varbinds)
+
+    async def set(self, *pairs):
+        """
+        SETs pairs of (item, value) in one request.
+        Never split on tooBig, the varbinds of a SET have to be applied together.
+        """
+        pdu = pMod.SetRequestPDU()
+        pMod.apiPDU.setDefaults(pdu)
+        pMod.apiPDU.setVarBinds(pdu, [(item, snmp_value(value)) for item, value in pairs])
+        rsp, varbinds = await self._request(pdu)
+        return varbinds
+
+    async def _walk(self, item, max_rows, max_repetitions=0):
+        """
+        Walks the subtree under item, with GETBULK if max_repetitions is set, GETNEXT otherwise.
+        """
+        prefix = oid(item)
+        cursor = prefix
+        rows = []
+        while True:
+            rsp, varbinds = await self._request(_walk_pdu(cursor, max_repetitions))
+            page, done = _walk_page(prefix, cursor, varbinds)
+            rows.extend(page)
+            if max_rows and len(rows) >= max_rows:
+                return rows[:max_rows]
+            if done:
+                return rows
+            cursor = page[-1][0]
+
+    async def next(self, item, max_rows=0):
+        return await self._walk(item, max_rows)
+
+    async def bulk(self, item, max_rows=0, max_repetitions=25):
+        """
+        Walks a table like next, but with GETBULK;
+        up to max_repetitions rows come back per round trip instead of one.
+        """
+        return await self._walk(item, max_rows, max_repetitions)
+
+    def stream(self, item, cursor=None, max_repetitions=25):
+        """
+        Walks item a page at a time as the varbinds are iterated over (with async for), like SnmpSession.stream.
+
+        :rtype: AsyncWalk
+        """
+        return AsyncWalk(self, item, cursor, max_repetitions)
+
+    async def table(self, columns, scalars=(), max_repetitions=25):
+        """
+        Walks columns side by side, like SnmpSession.table.
+
+        :return: Varbinds under each column and the first under each scalar
+        :rtype: list[tuple]
+        """
+        prefixes = [ObjectName(column) for column in columns]
+        cursors = list(prefixes)
+        scalars = [ObjectName(scalar) for scalar in scalars]
+        # Columns still being walked
+        walking = list(range(len(prefixes)))
+        rows = []
+        while walking:
+            if max_repetitions:
+                pdu = pMod.GetBulkRequestPDU()
+                pMod.apiBulkPDU.setDefaults(pdu)
+                pMod.apiBulkPDU.setNonRepeaters(pdu, len(scalars))
+                pMod.apiBulkPDU.setMaxRepetitions(pdu, max_repetitions)
+            else:
+                pdu = pMod.GetNextRequestPDU()
+                pMod.apiPDU.setDefaults(pdu)
+            pMod.apiPDU.setVarBinds(pdu, [(oid, pMod.null) for oid in scalars + [cursors[i] for i in walking]])
+            rsp, varbinds = await self._request(pdu)
+            for scalar, (name, val) in zip(scalars, varbinds):
+                if scalar.isPrefixOf(name) and not isinstance(val, EndOfMibView):
+                    rows.append((name, val))
+            varbinds = varbinds[len(scalars):]
+            if not varbinds:
+                return rows
+            # Only asked for the first time
+            scalars = []
+            ended = set()
+            for n, (name, val) in enumerate(varbinds):
+                i = walking[n % len(walking)]
+                if i in ended:
+                    continue
+                if isinstance(val, EndOfMibView) or not prefixes[i].isPrefixOf(name):
+                    ended.add(i)
+                    continue
+                rows.append((name, val))
+                cursors[i] = name
+            walking = [i for i in walking if i not in ended]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+async def snmp_get_async(community, server, *items, port=161):
+    return await AsyncSnmpSession(community, server, port=port).get(*items)
+
+
+async def snmp_set_async(community, server, *pairs, port=161):
+    return await AsyncSnmpSession(community, server, port=port).set(*pairs)
+
+
+async def snmp_next_async(community, server, item, max_rows=0, port=161):
+    return await AsyncSnmpSession(community, server, port=port).next(item, max_rows=max_rows)
+
+
+async def snmp_bulk_async(community, server, item, max_rows=0, max_repetitions=25, port=161):
+    """
+    Walks a table like snmp_next_async, but with GETBULK;
+    up to max_repetitions rows come back per round trip instead of one.
+    """
+    return await AsyncSnmpSession(community, server, port=port).bulk(item, max_rows=max_rows,
+                                                                      max_repetitions=max_repetitions)
+
+
+def fetch_binds_async(*items):
+    def fetch_binds_decorator(func):
+        @wraps(func)
+        async def func_wrapper(self, **kwargs):
+            binds = await self.session.get(*map(lambda item: item.format(**kwargs), items))
+            kwargs['binds'] = binds
+            return func(self, **kwargs)
+
+        return func_wrapper
+    return fetch_binds_decorator
+
+
+def walk_binds_async(item):
+    def walk_binds_decorator(func):
+        defaults = _defaults(func)
+
+        @wraps(func)
+        async def func_wrapper(self, **kwargs):
+            kwargs = dict(defaults, **kwargs)
+            if self.max_repetitions:
+                binds = await self.session.bulk(item.format(**kwargs), max_repetitions=self.max_repetitions)
+            else:
+                binds = await self.session.next(item.format(**kwargs))
+            kwargs['binds'] = binds
+            return func(self, **kwargs)
+
+        return func_wrapper
+    return walk_binds_decorator
+
+
+def set_vals_async(*items):
+    def fetch_binds_decorator(func):
+        @wraps(func)
+        async def func_wrapper(self, **kwargs):
+            values = func(self, items=items, **kwargs)
+            kwargs.update(values)
+            await self.session.set(*[(item.format(**kwargs), kwargs['value']) for item in items])
+
+        return func_wrapper
+    return fetch_binds_decorator
@@ -8,96 +8,1008 @@ This module is seriously messy, anyone is welcome to try to clean it up.
 """
 __author__ = 'CVi'
 
-from pysnmp.entity.rfc3413.oneliner import cmdgen
-from pysnmp.smi import builder, instrum
-from pysnmp.entity import engine
-from pysnmp.proto.rfc3412 import MsgAndPduDispatcher
+from pysnmp.proto import rfc1902
+from pysnmp.proto.rfc1905 import EndOfMibView
+from pysnmp.proto.errind import RequestTimedOut
+from pysnmp.error import PySnmpError
+from pyasn1.type.base import Asn1ItemBase
+from cisco_switch.oids import OidTemplate, oid, dotted
+from collections import deque
 from functools import wraps
+import contextvars
+import itertools
+import threading
+import inspect
+import logging
+import time
+import weakref
 import os
 
 
-__all__ = ['snmp_get', 'snmp_set', 'snmp_next', 'fetch_binds', 'set_vals', 'mibBuilder']
+__all__ = ['SnmpSession', 'Walk', 'TooBigError', 'PduLimit', 'RttEstimate', 'PduRecord', 'snmp_get', 'snmp_set',
+           'snmp_next', 'snmp_bulk', 'fetch_binds', 'set_vals', 'walk_binds', 'add_hook', 'remove_hook', 'instrumented',
+           'tagged', 'mibBuilder', 'LOAD_MIBS', 'pdu_limits', 'rtt_estimates', 'hooks']
 
-# Some background, mibs etc.
-mibBuilder = builder.MibBuilder()
-mibBuilder.setMibPath(os.path.dirname(os.path.realpath(__file__))+'/mibs', *mibBuilder.getMibPath())
-mibBuilder.loadModules('SNMPv2-MIB', 'IF-MIB' 'CISCO-VTP-MIB', 'CISCO-CONFIG-COPY-MIB', 'CISCO-VLAN-MEMBERSHIP-MIB')
+# Every OID in this package is numeric, the MIBs are only needed for turning names into OIDs.
+# Set to False before the first request to skip loading them.
+LOAD_MIBS = True
+MIB_MODULES = ('SNMPv2-MIB', 'IF-MIB', 'CISCO-VTP-MIB', 'CISCO-CONFIG-COPY-MIB', 'CISCO-VLAN-MEMBERSHIP-MIB')
 
-# The engine; I don't know how it works anymore, but it works.
-mibInstrumController = instrum.MibInstrumController(mibBuilder)
-msgAndPduDsp = MsgAndPduDispatcher(mibInstrumController=mibInstrumController)
-eg = engine.SnmpEngine(msgAndPduDsp=msgAndPduDsp)
-cmdGen = cmdgen.CommandGenerator(snmpEngine=eg)
+# The engine and friends are built on the first request rather than on import,
+# pysnmp's command generator and the MIBs take a good while to load.
+# pysnmp engines are not thread safe, every thread gets one of its own.
+_engines = threading.local()
+# Engines of threads that have ended, handed to new threads rather than building more.
+_idle_engines = []
 
 
-def snmp_get(community, server, *items):
-    errorIndication, errorStatus, errorIndex, varBinds = cmdGen.getCmd(
-        cmdgen.CommunityData(community),
-        cmdgen.UdpTransportTarget((server, 161)),
-        *items
-    )
+class _EngineLease(object):
+    """
+    Holds a thread's engine, and puts it back among the idle ones when the thread ends.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        weakref.finalize(self, _idle_engines.append, engine)
 
-    if errorIndication:
-        raise IOError(errorIndication)
-    elif errorStatus:
-        err = '%s at %s' % (errorStatus.prettyPrint(), errorIndex and varBinds[int(errorIndex)-1] or '?')
-        raise IOError(err)
-    else:
-        return varBinds
 
+def _engine():
+    """
+    The engine of this thread, built (with the MIBs) on first use.
 
-def snmp_set(community, server, *pairs):
-    errorIndication, errorStatus, errorIndex, varBinds = cmdGen.setCmd(
-        cmdgen.CommunityData(community),
-        cmdgen.UdpTransportTarget((server, 161)),
-        *pairs
-    )
+    :return: mibBuilder, mibInstrumController, msgAndPduDsp, eg and cmdGen by name
+    :rtype: dict
+    """
+    lease = getattr(_engines, 'lease', None)
+    if lease is None:
+        try:
+            engine = _idle_engines.pop()
+        except IndexError:
+            engine = _build_engine(LOAD_MIBS)
+        lease = _engines.lease = _EngineLease(engine)
+    return lease.engine
+
+
+def _command_generator():
+    """
+    The command generator of this thread.
+
+    :rtype: pysnmp.entity.rfc3413.oneliner.cmdgen.CommandGenerator
+    """
+    return _engine()['cmdGen']
+
+
+class _NoMibCompiler(object):
+    """
+    Stands in for pysmi's MIB compiler; the MIBs this package needs ship with it, precompiled.
+    """
+    def compile(self, *mibs, **options):
+        return {}
+
+
+def _build_engine(load_mibs):
+    from pysnmp.entity.rfc3413.oneliner import cmdgen
+    from pysnmp.smi import builder, instrum
+    from pysnmp.entity import engine
+    from pysnmp.proto.rfc3412 import MsgAndPduDispatcher
+
+    # Some background, mibs etc.
+    mibBuilder = builder.MibBuilder()
+    mibs = os.path.dirname(os.path.realpath(__file__))+'/mibs'
+    # Keeps pysnmp from setting up pysmi (which takes seconds) on the first request of every engine.
+    mibBuilder.setMibCompiler(_NoMibCompiler(), mibs)
+    if load_mibs:
+        mibBuilder.setMibPath(mibs, *mibBuilder.getMibPath())
+        mibBuilder.loadModules(*MIB_MODULES)
+
+    # The engine; I don't know how it works anymore, but it works.
+    mibInstrumController = instrum.MibInstrumController(mibBuilder)
+    msgAndPduDsp = MsgAndPduDispatcher(mibInstrumController=mibInstrumController)
+    eg = engine.SnmpEngine(msgAndPduDsp=msgAndPduDsp)
+    cmdGen = cmdgen.CommandGenerator(snmpEngine=eg)
+
+    # When the last request went out and its response came in, for round trip times without pysnmp's own overhead.
+    timing = {'sent': 0.0, 'received': 0.0, 'sends': 0, 'responses': 0}
+    # PduRecords of requests in flight by request-id, and of the ones done; only kept while there are hooks.
+    pdus = {'pending': {}, 'done': []}
+
+    def sent(snmpEngine, execpoint, variables, cbCtx):
+        timing['sent'] = time.monotonic()
+        timing['sends'] += 1
+        if hooks:
+            _pdu_sent(pdus, variables['pdu'], len(variables['outgoingMessage']), timing['sent'])
+
+    def received(snmpEngine, execpoint, variables, cbCtx):
+        timing['received'] = time.monotonic()
+        timing['responses'] += 1
+        if hooks:
+            _pdu_received(pdus, variables['pdu'], len(variables['wholeMsg']), timing['received'])
+
+    eg.observer.registerObserver(sent, 'rfc3412.sendPdu')
+    eg.observer.registerObserver(received, 'rfc3412.receiveMessage:response')
+    return {'mibBuilder': mibBuilder, 'mibInstrumController': mibInstrumController, 'msgAndPduDsp': msgAndPduDsp,
+            'eg': eg, 'cmdGen': cmdGen, 'timing': timing, 'pdus': pdus}
+
+
+def __getattr__(name):
+    # mibBuilder, cmdGen etc. used to be built on import, build them when someone asks for them.
+    if name in ('mibBuilder', 'mibInstrumController', 'msgAndPduDsp', 'eg', 'cmdGen'):
+        return _engine()[name]
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+class TooBigError(IOError):
+    """
+    The response would not fit in a message, ask for fewer varbinds at a time.
+    """
+    pass
+
+
+# error-status tooBig(1)
+TOO_BIG = 1
+
+
+class PduLimit(object):
+    """
+    What a switch has shown about how many varbinds fit in one GET response.
+    """
+    def __init__(self):
+        # Fewest varbinds that came back tooBig, and the most that were answered short of that.
+        self.too_big = None
+        self.largest = 0
+
+    @property
+    def max_varbinds(self):
+        """
+        :return: Varbinds to send per GET at the most, None while no request has been too big.
+        :rtype: int
+        """
+        if self.too_big is None:
+            return None
+        return max(self.largest, 1)
+
+    def failed(self, count):
+        if self.too_big is None or count < self.too_big:
+            self.too_big = count
+        if self.largest >= self.too_big:
+            # Larger values this time; the halves tried next will tell how many fit.
+            self.largest = 0
+
+    def worked(self, count):
+        if self.too_big is None or count < self.too_big:
+            self.largest = max(self.largest, count)
+
+
+# PduLimit per (server, port), kept for the life of the process.
+pdu_limits = {}
+
+
+def _pdu_limit(server, port):
+    limit = pdu_limits.get((server, port))
+    if limit is None:
+        limit = pdu_limits.setdefault((server, port), PduLimit())
+    return limit
+
+
+def _chunked(items, size):
+    if not size or len(items) <= size:
+        return [items]
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# Same defaults as pysnmp's UdpTransportTarget
+TIMEOUT = 1.0
+RETRIES = 5
+
+# Round trip time estimation, the way TCP does it (RFC 6298)
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+MIN_TIMEOUT = 0.25
+MAX_TIMEOUT = 10.0
+# Seconds of waiting, over all attempts, to spend on a request before giving up on the switch
+RETRY_BUDGET = 6.0
+# pysnmp counts timeouts in ticks of its dispatcher's timer, half a second by default; too coarse for MIN_TIMEOUT.
+TIMER_RESOLUTION = 0.05
 
-    if errorIndication:
+
+class RttEstimate(object):
+    """
+    Smoothed round trip time of a switch, and the timeout and retries that follow from it.
+
+    The timeout is the smoothed RTT plus four times its variance, as for TCP.
+    Every attempt at a request waits twice as long as the one before, for as many attempts as fit in RETRY_BUDGET
+    (no more than retries + 1, and at least two for a switch that answers).
+    The budget is halved for every request in a row the switch has not answered, so a dead switch is given up on
+    quickly, while a switch on a slow link gets answers in on the later attempts and the estimate catches up.
+    """
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES):
+        """
+        :param timeout: Seconds to wait for a response until there are samples to go by
+        :type timeout: float
+        :param retries: Resends before giving up, at the most
+        :type retries: int
+        """
+        self.initial_timeout = timeout
+        self.max_retries = retries
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.failures = 0
+
+    def sample(self, rtt):
+        """
+        Adds the round trip time of an answered request.
+
+        :type rtt: float
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.samples += 1
+        self.failures = 0
+
+    def answered(self):
+        """
+        A request was answered, but the time it took is no sample (it is not known which send was answered).
+        """
+        self.failures = 0
+
+    def timed_out(self):
+        """
+        A request was not answered at all.
+        """
+        self.failures += 1
+
+    @property
+    def timeout(self):
+        """
+        :return: Seconds to wait for a response to the first attempt
+        :rtype: float
+        """
+        if self.srtt is None:
+            return self.initial_timeout
+        return min(max(self.srtt + 4 * self.rttvar, MIN_TIMEOUT), MAX_TIMEOUT)
+
+    @property
+    def attempts(self):
+        """
+        :return: Seconds to wait for a response, per attempt
+        :rtype: list[float]
+        """
+        budget = RETRY_BUDGET / 2 ** self.failures
+        timeout = self.timeout
+        attempts = [timeout]
+        while len(attempts) <= self.max_retries:
+            timeout = min(timeout * 2, MAX_TIMEOUT)
+            if sum(attempts) + timeout > budget and (self.failures or len(attempts) > 1):
+                break
+            attempts.append(timeout)
+        return attempts
+
+    @property
+    def retries(self):
+        """
+        :return: Resends before giving up, when resending with the same timeout
+        :rtype: int
+        """
+        budget = RETRY_BUDGET / 2 ** self.failures
+        return min(max(int(budget / self.timeout), 1), self.max_retries + 1) - 1
+
+    def __repr__(self):
+        attempts = ", ".join("{0:.2f}".format(timeout) for timeout in self.attempts)
+        if self.srtt is None:
+            return "<RttEstimate: no samples, attempts {0}>".format(attempts)
+        return "<RttEstimate: srtt {0:.3f}s rttvar {1:.3f}s, attempts {2}>".format(self.srtt, self.rttvar, attempts)
+
+
+# RttEstimate per (server, port), kept for the life of the process.
+# Sorting it by srtt shows which switches are slow.
+rtt_estimates = {}
+
+
+def _rtt_estimate(server, port, timeout=TIMEOUT, retries=RETRIES):
+    estimate = rtt_estimates.get((server, port))
+    if estimate is None:
+        estimate = rtt_estimates.setdefault((server, port), RttEstimate(timeout, retries))
+    return estimate
+
+
+def _timeout_bucket(timeout):
+    """
+    Rounds an estimated timeout up to MIN_TIMEOUT times a power of two.
+    pysnmp sets up a new target (in its MIB) for every timeout it sees, this keeps them few.
+    """
+    bucket = MIN_TIMEOUT
+    while bucket < timeout:
+        bucket *= 2
+    return min(bucket, MAX_TIMEOUT)
+
+
+def _wind_clock(eg):
+    """
+    Brings the tick count of the engine's dispatcher up to date, before a request is sent.
+    The dispatcher only counts ticks while it runs; on an engine that has been idle a tick is overdue,
+    and counting it right after the request went out would time the request out early.
+    """
+    dispatcher = eg.transportDispatcher
+    if dispatcher is None:
+        # Set up by the first request
+        return
+    if dispatcher.getTimerResolution() != TIMER_RESOLUTION:
+        dispatcher.setTimerResolution(TIMER_RESOLUTION)
+    dispatcher.handleTimerTick(time.time())
+
+
+def _raise_on_error(errorIndication, errorStatus, errorIndex, varBinds):
+    if isinstance(errorIndication, RequestTimedOut):
+        raise TimeoutError(str(errorIndication))
+    elif errorIndication:
         raise IOError(errorIndication)
     elif errorStatus:
         err = '%s at %s' % (errorStatus.prettyPrint(), errorIndex and varBinds[int(errorIndex)-1] or '?')
+        if int(errorStatus) == TOO_BIG:
+            raise TooBigError(err)
         raise IOError(err)
+
+
+# Called with a PduRecord for every request sent, see add_hook.
+hooks = []
+# The call of a switch method requests are made for, a _Call; set by tagged.
+_method = contextvars.ContextVar('cisco_switch_method', default=None)
+_calls = itertools.count(1)
+_OPERATIONS = {'GetRequestPDU': 'get', 'GetNextRequestPDU': 'next', 'GetBulkRequestPDU': 'bulk',
+               'SetRequestPDU': 'set'}
+
+
+class PduRecord(object):
+    """
+    One request to a switch and what came of it, as reported to the hooks.
+    """
+    def __init__(self, operation, varbinds, request_bytes, sent):
+        """
+        :param operation: get, next, bulk or set
+        :type operation: str
+        :param varbinds: Varbinds in the request
+        :type varbinds: int
+        :param request_bytes: Size of the request message
+        :type request_bytes: int
+        :param sent: time.monotonic() when the request was first sent
+        :type sent: float
+        """
+        self.operation = operation
+        self.server = None
+        self.port = None
+        # Switch method the request was made for, and which call of it; None outside of switch methods.
+        self.method = None
+        self.call = None
+        # The first request reported for the call
+        self.first = False
+        self.varbinds = varbinds
+        self.request_bytes = request_bytes
+        self.sent = sent
+        self.answered = False
+        self.response_varbinds = 0
+        self.response_bytes = 0
+        # Seconds from the first send to the response, or to giving up
+        self.latency = 0.0
+        self.retries = 0
+        # error-status of the response, None if there was none
+        self.error_status = None
+
+    def __repr__(self):
+        return "<PduRecord: {0} {1} {2} varbinds, {3:.1f} ms, {4}>".format(
+            self.operation, self.server, self.varbinds, self.latency * 1000,
+            "error-status {0}".format(self.error_status) if self.answered else "timed out")
+
+
+class _Call(object):
+    """
+    A call of a tagged function, what the requests made for it are tagged with.
+    """
+    __slots__ = ('method', 'number', 'reported')
+
+    def __init__(self, method):
+        self.method = method
+        self.number = next(_calls)
+        # A request has been reported for the call
+        self.reported = False
+
+
+def add_hook(hook):
+    """
+    Has hook called with a PduRecord for every request sent from now on, in the thread (or task) that sent it.
+    Exceptions raised by hooks are logged and otherwise ignored.
+
+        >>> add_hook(lambda record: print(record.server, record.method, record.latency))
+
+    :param hook: callable taking a PduRecord
+    """
+    hooks.append(hook)
+
+
+def remove_hook(hook):
+    hooks.remove(hook)
+
+
+def _report(records, server, port):
+    """
+    Tags records with the switch and method, and hands them to the hooks.
+    """
+    call = _method.get()
+    for record in records:
+        record.server = server
+        record.port = port
+        if call is not None:
+            record.method = call.method
+            record.call = call.number
+            record.first = not call.reported
+            call.reported = True
+        for hook in list(hooks):
+            try:
+                hook(record)
+            except Exception:
+                logging.getLogger(__name__).exception("SNMP hook {0!r} failed".format(hook))
+
+
+def _pdu_sent(pdus, pdu, size, now):
+    from pysnmp.proto.api import v2c
+    request_id = int(v2c.apiPDU.getRequestID(pdu))
+    record = pdus['pending'].get(request_id)
+    if record is None:
+        varbinds = len(v2c.apiPDU.getVarBindList(pdu))
+        pdus['pending'][request_id] = PduRecord(_OPERATIONS.get(type(pdu).__name__), varbinds, size, now)
     else:
+        # pysnmp resends the same PDU
+        record.retries += 1
+
+
+def _pdu_received(pdus, pdu, size, now):
+    from pysnmp.proto.api import v2c
+    record = pdus['pending'].pop(int(v2c.apiPDU.getRequestID(pdu)), None)
+    if record is not None:
+        record.answered = True
+        record.latency = now - record.sent
+        record.response_bytes = size
+        record.response_varbinds = len(v2c.apiPDU.getVarBindList(pdu))
+        record.error_status = int(v2c.apiPDU.getErrorStatus(pdu))
+        pdus['done'].append(record)
+
+
+def _collect(pdus, fold):
+    """
+    The records of a command, the unanswered ones as timed out.
+
+    :param fold: The command was one request tried several times, report it as one with retries.
+    :rtype: list[PduRecord]
+    """
+    now = time.monotonic()
+    records = pdus['done']
+    for record in pdus['pending'].values():
+        record.latency = now - record.sent
+        records.append(record)
+    pdus['pending'] = {}
+    pdus['done'] = []
+    records.sort(key=lambda record: record.sent)
+    if fold and len(records) > 1:
+        first, last = records[0], records[-1]
+        last.retries += sum(record.retries + 1 for record in records[:-1])
+        last.latency += last.sent - first.sent
+        last.sent = first.sent
+        records = [last]
+    return records
+
+
+def tagged(name):
+    """
+    Tags the requests made by the decorated function (and whatever it calls) with name,
+    unless they are made for an outer tagged function already.
+    Coroutines returned by the function keep the tag while they run.
+    """
+    def tagged_decorator(func):
+        @wraps(func)
+        def func_wrapper(*args, **kwargs):
+            if _method.get() is not None:
+                return func(*args, **kwargs)
+            tag = _Call(name)
+            token = _method.set(tag)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                _method.reset(token)
+            if inspect.iscoroutine(result):
+                return _tagged_coroutine(tag, result)
+            return result
+        return func_wrapper
+    return tagged_decorator
+
+
+async def _tagged_coroutine(tag, coroutine):
+    token = _method.set(tag)
+    try:
+        return await coroutine
+    finally:
+        _method.reset(token)
+
+
+def instrumented(cls):
+    """
+    Class decorator, tags the requests made by each method of the class with the method name.
+    """
+    for name, value in list(vars(cls).items()):
+        if inspect.isfunction(value) and not name.startswith('__'):
+            setattr(cls, name, tagged(name)(value))
+    return cls
+
+
+def _walk_page(prefix, cursor, binds):
+    """
+    The varbinds of one page of a walk.
+
+    :param prefix: What is walked
+    :type prefix: tuple[int]
+    :param cursor: The OID the page was asked for after
+    :type cursor: tuple[int]
+    :param binds: The varbinds of a GETNEXT or GETBULK response for the one OID
+    :return: The varbinds under prefix, and True if the walk has come to the end
+    :rtype: (list[tuple], bool)
+    :raises IOError: If the switch answers with OIDs that do not increase, the walk would never end
+    """
+    page = []
+    for name, val in binds:
+        name = oid(name)
+        if isinstance(val, EndOfMibView) or name[:len(prefix)] != prefix:
+            return page, True
+        if name <= cursor:
+            raise IOError("OID not increasing at {0}".format(dotted(name)))
+        page.append((name, val))
+        cursor = name
+    return page, not page
+
+
+class Walk(object):
+    """
+    Iterates over the varbinds under an OID, asking for one page (a GETBULK, or GETNEXT) at a time
+    as the varbinds are used; only the page being iterated over is held, not the table.
+
+    cursor is the OID of the last varbind handed out. If a request fails, iterating on asks for the page again;
+    or a new walk can start from the cursor, in another session or process.
+
+        >>> walk = session.stream("1.3.6.1.2.1.31.1.1.1")
+        >>> try:
+        ...     for name, val in walk:
+        ...         store(name, val)
+        ... except TimeoutError:
+        ...     saved = walk.cursor
+        >>> for name, val in session.stream("1.3.6.1.2.1.31.1.1.1", cursor=saved):
+        ...     store(name, val)
+    """
+    def __init__(self, session, item, cursor=None, max_repetitions=25):
+        """
+        :param session: Session with the switch
+        :type session: SnmpSession
+        :param item: OID to walk the subtree of
+        :param cursor: OID to go on after, as Walk.cursor was; None to start at the beginning
+        :param max_repetitions: Varbinds per GETBULK, 0 walks with GETNEXT
+        :type max_repetitions: int
+        """
+        self.session = session
+        self.prefix = oid(item)
+        self.cursor = self.prefix if cursor is None else oid(cursor)
+        self.max_repetitions = max_repetitions
+        self.page = deque()
+        self.done = False
+
+    def _fetch(self):
+        if self.max_repetitions:
+            rows = self.session._command('bulkCmd', 0, self.max_repetitions, self.cursor, maxCalls=1,
+                                         lexicographicMode=True)
+        else:
+            rows = self.session._command('nextCmd', self.cursor, maxCalls=1, lexicographicMode=True)
+        page, self.done = _walk_page(self.prefix, self.cursor, [row[0] for row in rows])
+        self.page.extend(page)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.page:
+            if self.done:
+                raise StopIteration
+            self._fetch()
+        name, val = self.page.popleft()
+        self.cursor = name
+        return name, val
+
+    def __repr__(self):
+        return "<Walk: {0} at {1}>".format(dotted(self.prefix), dotted(self.cursor))
+
+
+class SnmpSession(object):
+    """
+    SNMP session with one switch.
+
+    Keeps the credentials and the transport target (resolved on the first request)
+    for as long as the switch handle lives, instead of building them for every request.
+    Requests go out through the engine's UDP socket, which is opened once and reused.
+
+        >>> with SnmpSession("public", "switch.example.com") as session:
+        ...     session.get("1.3.6.1.2.1.1.5.0")
+    """
+    def __init__(self, community, server, port=161, timeout=TIMEOUT, retries=RETRIES, adaptive=True, cache=None):
+        """
+        :param community: SNMP Community
+        :type community: basestring
+        :param server: Host (switch) FQDN or IP
+        :type server: basestring
+        :param port: SNMP port on the switch
+        :type port: int
+        :param timeout: Seconds to wait for a response (until the round trip time is known, if adaptive)
+        :type timeout: float
+        :param retries: Resends before giving up (at the most, if adaptive)
+        :type retries: int
+        :param adaptive: Derive timeout and retries from the round trip times of the switch
+        :type adaptive: bool
+        :param cache: Cache to answer GETs and walks from, None to always ask the switch
+        :type cache: cisco_switch.cache.ResponseCache
+        """
+        self.community = community
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.adaptive = adaptive
+        self.auth = None
+        self.address = (server, port)
+        self.targets = {}
+        self.engines = []
+        self.closed = False
+        # time.monotonic() after which requests are refused with TimeoutError, None for no deadline.
+        self.deadline = None
+        self.limit = _pdu_limit(server, port)
+        self.rtt = _rtt_estimate(server, port, timeout, retries)
+        self.cache = cache
+
+    def _prepare(self):
+        """
+        Checks that the session is open and sets up the credentials on first use.
+
+        :return: The command generator to send requests with
+        """
+        if self.closed:
+            raise IOError("Session with {0} is closed".format(self.server))
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TimeoutError("Deadline for {0} has passed".format(self.server))
+        cmdGen = _command_generator()
+        if self.auth is None:
+            from pysnmp.entity.rfc3413.oneliner import cmdgen
+            self.auth = cmdgen.CommunityData(self.community)
+        if cmdGen.snmpEngine not in self.engines:
+            self.engines.append(cmdGen.snmpEngine)
+        return cmdGen
+
+    def _target(self, timeout, retries):
+        """
+        The transport target with timeout and retries.
+        The address is resolved for the first one and reused for the rest.
+        """
+        target = self.targets.get((timeout, retries))
+        if target is None:
+            from pysnmp.entity.rfc3413.oneliner import cmdgen
+            target = cmdgen.UdpTransportTarget(self.address, timeout=timeout, retries=retries)
+            self.address = tuple(target.transportAddr)
+            self.targets[(timeout, retries)] = target
+        return target
+
+    def _command(self, command, *args, walk=False, **kwargs):
+        """
+        Runs a command generator command against the switch, keeping the round trip time estimate up to date.
+
+        Adaptive sessions make every attempt at a GET or SET a request of its own,
+        with a longer timeout for each; a response that comes late is not thrown away by the next attempt,
+        and its round trip time is a sample.
+        Walks take several requests, resending them goes by pysnmp's retries.
+
+        :param command: getCmd, setCmd, nextCmd or bulkCmd
+        :param walk: The command is a walk
+        :return: The varbinds
+        """
+        cmdGen = self._prepare()
+        timing = _engine()['timing']
+        pdus = _engine()['pdus']
+        if hooks:
+            pdus['pending'] = {}
+            pdus['done'] = []
+        if not self.adaptive:
+            attempts = [(self.timeout, self.retries)]
+        elif walk:
+            attempts = [(_timeout_bucket(self.rtt.timeout), self.rtt.retries)]
+        else:
+            attempts = [(_timeout_bucket(timeout), 0) for timeout in self.rtt.attempts]
+
+        for timeout, retries in attempts:
+            timing['sends'] = timing['responses'] = 0
+            _wind_clock(_engine()['eg'])
+            errorIndication, errorStatus, errorIndex, varBinds = getattr(cmdGen, command)(
+                self.auth, self._target(timeout, retries), *args, lookupMib=False, **kwargs
+            )
+            if not isinstance(errorIndication, RequestTimedOut) or \
+                    (self.deadline is not None and time.monotonic() > self.deadline):
+                break
+
+        if isinstance(errorIndication, RequestTimedOut):
+            self.rtt.timed_out()
+        elif timing['responses'] and timing['sends'] == timing['responses']:
+            # Nothing was resent, the last round trip is a sample
+            self.rtt.sample(timing['received'] - timing['sent'])
+        else:
+            self.rtt.answered()
+
+        if hooks:
+            _report(_collect(pdus, self.adaptive and not walk), self.server, self.port)
+        _raise_on_error(errorIndication, errorStatus, errorIndex, varBinds)
         return varBinds
 
+    def get(self, *items, fresh=False):
+        """
+        GETs items, split over as many requests as it takes for the responses to fit.
+        The number of varbinds the switch manages is remembered and later GETs are sized by it.
+
+        With a cache only the items not in it are sent for.
+        fresh skips the cache, for reads that a write is based on.
+        """
+        if self.cache is None or fresh:
+            return self._get(items)
+        found, missing = self.cache.lookup(self.server, self.port, items)
+        if missing:
+            binds = self._get(missing)
+            self.cache.store(self.server, self.port, binds)
+            found.update(zip(missing, binds))
+        return [found[item] for item in items]
+
+    def _get(self, items):
+        binds = []
+        for chunk in _chunked(items, self.limit.max_varbinds):
+            binds.extend(self._get_split(chunk))
+        return binds
+
+    def _get_split(self, items):
+        try:
+            binds = self._command('getCmd', *items)
+        except TooBigError:
+            if len(items) < 2:
+                raise
+            self.limit.failed(len(items))
+            half = len(items) // 2
+            return self._get_split(items[:half]) + self._get_split(items[half:])
+        self.limit.worked(len(items))
+        return binds
+
+    def set(self, *pairs):
+        """
+        SETs pairs of (item, value) in one request.
+        Never split on tooBig, the varbinds of a SET have to be applied together.
+        """
+        try:
+            return self._command('setCmd', *[(item, snmp_value(value)) for item, value in pairs])
+        finally:
+            # Even a failed SET may have been applied, a lost response looks the same.
+            if self.cache is not None:
+                self.cache.written(self.server, self.port, [item for item, value in pairs])
+
+    def invalidate(self, prefix=None):
+        """
+        Drops cached responses under prefix, or all of them, for writes with side effects elsewhere.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(self.server, self.port, prefix)
+
+    def _walk(self, item, max_rows, command, *args):
+        """
+        Walks item, from the cache if there and not limited by max_rows.
+        """
+        cached = self.cache is not None and not max_rows
+        if cached:
+            binds = self.cache.lookup_walk(self.server, self.port, item)
+            if binds is not None:
+                return iter(binds)
+        varBinds = self._command(command, *args, item, maxRows=max_rows, walk=True)
+        # pysnmp hands back the endOfMibView (or the first OID past item) the walk ended on as a row as well
+        prefix = oid(item)
+        binds = []
+        for row in varBinds:
+            name, val = row[0]
+            if isinstance(val, EndOfMibView) or oid(name)[:len(prefix)] != prefix:
+                break
+            binds.append(row[0])
+        if cached:
+            self.cache.store_walk(self.server, self.port, item, binds)
+        return iter(binds)
+
+    def next(self, item, max_rows=0):
+        return self._walk(item, max_rows, 'nextCmd')
+
+    def bulk(self, item, max_rows=0, max_repetitions=25):
+        """
+        Walks a table like next, but with GETBULK (SNMPv2c);
+        up to max_repetitions rows come back per round trip instead of one.
+        """
+        return self._walk(item, max_rows, 'bulkCmd', 0, max_repetitions)
+
+    def stream(self, item, cursor=None, max_repetitions=25):
+        """
+        Walks item a page at a time as the varbinds are iterated over, and can be resumed; see Walk.
+        For tables too big to hold, or to walk in one go. The cache is not used.
+
+        :param cursor: OID to go on after, Walk.cursor of an earlier walk; None to start at the beginning
+        :rtype: Walk
+        """
+        return Walk(self, item, cursor, max_repetitions)
+
+    def table(self, columns, scalars=(), max_repetitions=25):
+        """
+        Walks columns side by side, so a table takes as many round trips as its longest column;
+        with GETBULK, or GETNEXT if max_repetitions is 0.
+        Scalars are read on the way, as non-repeaters.
+        The cache is not asked, the responses are stored in it.
+
+        :param columns: Column OIDs
+        :type columns: list
+        :param scalars: Scalar OIDs without the trailing .0, 1.3.6.1.2.1.1.3 for sysUpTime.0
+        :type scalars: list
+        :param max_repetitions: Rows per GETBULK
+        :type max_repetitions: int
+        :return: Varbinds under each column and the first under each scalar
+        :rtype: list[tuple]
+        """
+        prefixes = [oid(item) for item in list(scalars) + list(columns)]
+        if max_repetitions:
+            rows = self._command('bulkCmd', len(scalars), max_repetitions, *prefixes, maxRows=0, walk=True)
+        else:
+            rows = self._command('nextCmd', *prefixes, maxRows=0, walk=True)
+        # Every request asks for the scalars again, and a column that ends early is walked on in the next one
+        binds = {}
+        for row in rows:
+            for prefix, (name, val) in zip(prefixes, row):
+                name = oid(name)
+                if name[:len(prefix)] == prefix and len(name) > len(prefix) and name not in binds:
+                    binds[name] = (name, val)
+        binds = list(binds.values())
+        if self.cache is not None:
+            self.cache.store(self.server, self.port, binds)
+        return binds
+
+    def close(self):
+        """
+        Releases the target and credentials from the engines.
+        """
+        if not self.closed:
+            self.closed = True
+            if self.auth is None:
+                return
+            from pysnmp.hlapi.asyncore.cmdgen import lcd
+            for eg in self.engines:
+                try:
+                    lcd.unconfigure(eg, self.auth)
+                except PySnmpError:
+                    # Never used, nothing configured
+                    pass
+            self.engines = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def snmp_get(community, server, *items):
+    with SnmpSession(community, server) as session:
+        return session.get(*items)
+
+
+def snmp_set(community, server, *pairs):
+    with SnmpSession(community, server) as session:
+        return session.set(*pairs)
+
 
 def snmp_next(community, server, item, max_rows=0):
-    errorIndication, errorStatus, errorIndex, varBinds = cmdGen.nextCmd(
-        cmdgen.CommunityData(community),
-        cmdgen.UdpTransportTarget((server, 161)),
-        item,
-        maxRows=max_rows
-    )
-
-    if errorIndication:
-        raise IOError(errorIndication)
-    elif errorStatus:
-        err = '%s at %s' % (errorStatus.prettyPrint(), errorIndex and varBinds[int(errorIndex)-1] or '?')
-        raise IOError(err)
+    with SnmpSession(community, server) as session:
+        return session.next(item, max_rows=max_rows)
+
+
+def snmp_bulk(community, server, item, max_rows=0, max_repetitions=25):
+    """
+    Walks a table like snmp_next, but with GETBULK (SNMPv2c);
+    up to max_repetitions rows come back per round trip instead of one.
+    """
+    with SnmpSession(community, server) as session:
+        return session.bulk(item, max_rows=max_rows, max_repetitions=max_repetitions)
+
+
+def snmp_value(value):
+    """
+    Wraps plain python values in the SNMP type they are sent as.
+
+    ints become Integer32, bytes and str become OctetString;
+    anything that already is an ASN.1 value is passed through as-is.
+    """
+    if isinstance(value, Asn1ItemBase):
+        return value
+    elif isinstance(value, int):
+        return rfc1902.Integer32(value)
+    elif isinstance(value, bytes):
+        return rfc1902.OctetString(value)
     else:
-        return map(lambda x: x[0], varBinds)
+        return rfc1902.OctetString(str(value))
+
+
+def _defaults(func):
+    """
+    Keyword defaults of func, used to format OID templates for arguments the caller left out.
+    """
+    return {name: param.default for name, param in inspect.signature(func).parameters.items()
+            if param.default is not inspect.Parameter.empty}
+
+
+def _template(item):
+    """
+    Parses an OID template given as a string, once, when the method is decorated.
+    """
+    return item if isinstance(item, OidTemplate) else OidTemplate(item)
 
 
 def fetch_binds(*items):
+    items = tuple(_template(item) for item in items)
+
     def fetch_binds_decorator(func):
         @wraps(func)
         def func_wrapper(self, **kwargs):
-            binds = snmp_get(self.community, self.server, *map(lambda item: item.format(**kwargs), items))
+            if getattr(self, 'batching', None) is not None:
+                # Collected, sent along with the rest of the batch
+                return self.batching.add([item.format(**kwargs) for item in items],
+                                         lambda binds: func(self, binds=binds, **kwargs))
+            binds = self.session.get(*[item.format(**kwargs) for item in items])
             kwargs['binds'] = binds
             return func(self, **kwargs)
 
+        func_wrapper.snmp_items = items
         return func_wrapper
     return fetch_binds_decorator
 
 
+def walk_binds(item):
+    item = _template(item)
+
+    def walk_binds_decorator(func):
+        defaults = _defaults(func)
+
+        @wraps(func)
+        def func_wrapper(self, **kwargs):
+            kwargs = dict(defaults, **kwargs)
+            if self.max_repetitions:
+                binds = self.session.bulk(item.format(**kwargs), max_repetitions=self.max_repetitions)
+            else:
+                binds = self.session.next(item.format(**kwargs))
+            kwargs['binds'] = binds
+            return func(self, **kwargs)
+
+        func_wrapper.snmp_walk = item
+        return func_wrapper
+    return walk_binds_decorator
+
+
 def set_vals(*items):
+    items = tuple(_template(item) for item in items)
+
     def fetch_binds_decorator(func):
         @wraps(func)
         def func_wrapper(self, **kwargs):
             values = func(self, items=items, **kwargs)
             kwargs.update(values)
-            snmp_set(self.community, self.server, *map(lambda item, value: (item.format(**kwargs), value), items, values))
+            self.session.set(*[(item.format(**kwargs), kwargs['value']) for item in items])
 
+        func_wrapper.snmp_set_items = items
         return func_wrapper
     return fetch_binds_decorator
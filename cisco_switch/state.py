@@ -0,0 +1,289 @@
+"""
+.. module:: state
+   :synopsis: Snapshot of the state of a switch, for working on offline
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+What CiscoROSwitch.snapshot returns; every port with its name, alias, status, access vlan and trunk state
+and vlans, and the vlan table, as they were at one moment. Snapshots are immutable, and saved to and loaded from
+files, as JSON or zlib compressed JSON, so audits, diffs and reports can be run on them without asking the switch.
+
+    >>> switch.snapshot().save("sw1.state")
+    >>> before, after = SwitchState.load("sw1.state"), switch.snapshot()
+    >>> for ifindex in after.changed_ports(before):
+    ...     print(after.port(ifindex))
+"""
+import json
+import time
+import zlib
+from cisco_switch.portindex import normalize_name
+from cisco_switch.trunks import VlanSet, TRUNKING, NOT_APPLICABLE
+
+__author__ = 'CVi'
+__all__ = ['PortState', 'SwitchState']
+
+# Start of a snapshot saved as compressed JSON, and the version of the layout
+MAGIC = b'CSST'
+VERSION = 1
+
+
+def _ranges(vlans):
+    """
+    :type vlans: VlanSet
+    :return: The vlans as ranges, "1-9,20"
+    :rtype: str
+    """
+    ranges = []
+    for vlan in vlans:
+        if ranges and ranges[-1][1] == vlan - 1:
+            ranges[-1][1] = vlan
+        else:
+            ranges.append([vlan, vlan])
+    return ','.join(str(first) if first == last else '{0}-{1}'.format(first, last) for first, last in ranges)
+
+
+def _from_ranges(text):
+    """
+    :param text: What _ranges returned
+    :rtype: VlanSet
+    :raises ValueError: If text is not ranges of vlans
+    """
+    vlans = []
+    for item in filter(None, text.split(',')):
+        first, _, last = item.partition('-')
+        vlans.extend(range(int(first), int(last or first) + 1))
+    return VlanSet(vlans)
+
+
+class _Immutable(object):
+    __slots__ = ()
+
+    def __setattr__(self, key, value):
+        raise AttributeError("{0} is immutable".format(type(self).__name__))
+
+    __delattr__ = __setattr__
+
+
+class PortState(_Immutable):
+    """
+    A port as it was when the snapshot was taken; None for what the switch does not have for the port.
+    """
+    __slots__ = ('ifindex', 'name', 'alias', 'admin_status', 'oper_status', 'access_vlan',
+                 'dynamic_state', 'dynamic_status', 'encapsulation', 'vlans')
+
+    def __init__(self, ifindex, name=None, alias=None, admin_status=None, oper_status=None, access_vlan=None,
+                 dynamic_state=None, dynamic_status=None, encapsulation=None, vlans=None):
+        """
+        :param ifindex: ifIndex of the port
+        :type ifindex: int
+        :param name: ifName
+        :type name: str
+        :param alias: ifAlias, the description configured on the port
+        :type alias: str
+        :param admin_status: ifAdminStatus; up(1), down(2), testing(3)
+        :type admin_status: int
+        :param oper_status: ifOperStatus; up(1), down(2) and more
+        :type oper_status: int
+        :param access_vlan: vmVlan, the vlan of an access port
+        :type access_vlan: int
+        :param dynamic_state: vlanTrunkPortDynamicState, as in TrunkState
+        :type dynamic_state: int
+        :param dynamic_status: vlanTrunkPortDynamicStatus, as in TrunkState
+        :type dynamic_status: int
+        :param encapsulation: vlanTrunkPortEncapsulationOperType, as in TrunkState
+        :type encapsulation: int
+        :param vlans: The vlans enabled on the port; read for the ports that are trunking only
+        :type vlans: VlanSet
+        """
+        for key, value in zip(self.__slots__, (ifindex, name, alias, admin_status, oper_status, access_vlan,
+                                               dynamic_state, dynamic_status, encapsulation, vlans)):
+            object.__setattr__(self, key, value)
+
+    @property
+    def trunking(self):
+        """
+        :return: True if the port is trunking
+        :rtype: bool
+        """
+        return self.dynamic_status == TRUNKING and self.encapsulation != NOT_APPLICABLE
+
+    def _values(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, PortState):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return "<PortState: {0} {1}>".format(self.ifindex, self.name)
+
+
+class SwitchState(_Immutable):
+    """
+    The ports and vlans of a switch, as they were at one moment.
+    """
+    __slots__ = ('server', 'snmp_port', 'taken', 'uptime', 'vlandomain', 'ports', 'vlans', '_names')
+
+    def __init__(self, server, snmp_port, ports, vlans, uptime=None, vlandomain=1, taken=None):
+        """
+        :param server: Host (switch) FQDN or IP
+        :type server: str
+        :param snmp_port: SNMP port on the switch
+        :type snmp_port: int
+        :param ports: The ports
+        :type ports: collections.Iterable[PortState]
+        :param vlans: Name per vlanid, from the vlan table
+        :type vlans: dict[int, str]
+        :param uptime: sysUpTime in hundredths of a second, None if the switch did not have it
+        :type uptime: int
+        :param vlandomain: vlan domain the vlans are from
+        :type vlandomain: int
+        :param taken: time.time() when the snapshot was taken, now by default
+        :type taken: float
+        """
+        ports = tuple(sorted(ports, key=lambda state: state.ifindex))
+        values = {'server': server, 'snmp_port': snmp_port, 'taken': time.time() if taken is None else taken,
+                  'uptime': uptime, 'vlandomain': vlandomain, 'ports': ports, 'vlans': tuple(sorted(vlans.items())),
+                  '_names': {normalize_name(state.name): state for state in ports if state.name}}
+        for key, value in values.items():
+            object.__setattr__(self, key, value)
+
+    def port(self, port):
+        """
+        :param port: ifIndex of the port, or its name as in PortIndex.ifindex
+        :type port: int | str
+        :rtype: PortState
+        :raises KeyError: If there is no such port
+        """
+        if isinstance(port, str):
+            return self._names[normalize_name(port)]
+        for state in self.ports:
+            if state.ifindex == port:
+                return state
+        raise KeyError(port)
+
+    def vlan_names(self):
+        """
+        :return: Name per vlanid, as CiscoROSwitch.get_vlan_names
+        :rtype: dict[int, str]
+        """
+        return dict(self.vlans)
+
+    def changed_ports(self, other):
+        """
+        :param other: An earlier snapshot of the switch
+        :type other: SwitchState
+        :return: ifIndexes of the ports that differ between the snapshots, or are in only one of them, ascending
+        :rtype: list[int]
+        """
+        mine = {state.ifindex: state for state in self.ports}
+        theirs = {state.ifindex: state for state in other.ports}
+        return sorted(ifindex for ifindex in set(mine) | set(theirs) if mine.get(ifindex) != theirs.get(ifindex))
+
+    def __iter__(self):
+        return iter(self.ports)
+
+    def __len__(self):
+        return len(self.ports)
+
+    def __eq__(self, other):
+        if not isinstance(other, SwitchState):
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    __hash__ = None
+
+    def as_dict(self):
+        """
+        :return: The snapshot as JSON serializable values; a list per port, trunk vlans as ranges
+        :rtype: dict
+        """
+        ports = [[_ranges(value) if key == 'vlans' and value is not None else value
+                  for key, value in zip(PortState.__slots__, state._values())] for state in self.ports]
+        return {'version': VERSION, 'server': self.server, 'snmp_port': self.snmp_port, 'taken': self.taken,
+                'uptime': self.uptime, 'vlandomain': self.vlandomain, 'ports': ports, 'vlans': self.vlans}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: What as_dict returned
+        :type data: dict
+        :rtype: SwitchState
+        :raises ValueError: If data is not a snapshot this version can read
+        """
+        if not isinstance(data, dict) or data.get('version') != VERSION:
+            raise ValueError("Not a switch state")
+        try:
+            ports = [PortState(*values[:-1], vlans=None if values[-1] is None else _from_ranges(values[-1]))
+                     for values in data['ports']]
+            return cls(data['server'], data['snmp_port'], ports, {int(vlanid): name for vlanid, name in data['vlans']},
+                       data['uptime'], data['vlandomain'], data['taken'])
+        except (KeyError, TypeError, IndexError):
+            raise ValueError("Not a switch state")
+
+    def to_json(self):
+        """
+        :rtype: str
+        """
+        return json.dumps(self.as_dict(), separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        """
+        :param text: What to_json returned
+        :rtype: SwitchState
+        :raises ValueError: If text is not a snapshot
+        """
+        return cls.from_dict(json.loads(text))
+
+    def to_bytes(self):
+        """
+        :return: MAGIC and the JSON compressed
+        :rtype: bytes
+        """
+        return MAGIC + zlib.compress(self.to_json().encode(), 9)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        :param data: What to_bytes or to_json returned
+        :type data: bytes
+        :rtype: SwitchState
+        :raises ValueError: If data is not a snapshot
+        """
+        if not data.startswith(MAGIC):
+            return cls.from_json(data.decode())
+        try:
+            return cls.from_json(zlib.decompress(data[len(MAGIC):]).decode())
+        except zlib.error:
+            raise ValueError("Not a switch state")
+
+    def save(self, path):
+        """
+        Writes the snapshot to a file, compressed unless the name ends with .json.
+
+        :type path: str
+        """
+        data = self.to_json().encode() if path.endswith('.json') else self.to_bytes()
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a snapshot written by save, either format.
+
+        :type path: str
+        :rtype: SwitchState
+        :raises ValueError: If the file is not a snapshot
+        """
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def __repr__(self):
+        return "<SwitchState: {0}:{1}, {2} ports, {3} vlans>".format(self.server, self.snmp_port, len(self.ports),
+                                                                    len(self.vlans))
@@ -1,5 +1,7 @@
 import logging
 from cisco_switch import CiscoSwitch, CiscoPort, CiscoVlan
+from cisco_switch.fleet import Fleet
+from cisco_switch.trunks import VlanSet
 
 __author__ = 'CVi'
 __all__ = ['TrunkManager', 'Host', 'Vlan', 'Port']
@@ -75,7 +77,7 @@ class TrunkManager(object):
     It requires that the programmer provides the topology and minimised graphs.
     The cisco_switch.minifier module can generate minimised graphs.
     """
-    def __init__(self, vlans, vlan_map, simulate=True):
+    def __init__(self, vlans, vlan_map, simulate=True, workers=1, host_deadline=None, index_store=None):
         """
         :param vlans: Dictionary of vlans, keyed on ID
         :type vlans: dict[int,Vlan]
@@ -83,10 +85,20 @@ class TrunkManager(object):
         :type vlan_map: dict[int, list[int]]
         :param simulate: Does not apply if set to true.
         :type simulate: bool
+        :param workers: Switches to work on at the same time.
+        :type workers: int
+        :param host_deadline: Seconds to spend on one switch at the most, None for no limit.
+        :type host_deadline: float
+        :param index_store: Keeps the port names of the switches from one apply to the next,
+            so they are only walked again when they change.
+        :type index_store: cisco_switch.portindex.PortIndexStore
         """
         self.vlans = vlans
         self.vlan_map = vlan_map
         self.simulate = simulate
+        self.workers = workers
+        self.host_deadline = host_deadline
+        self.index_store = index_store
 
     def get_host(self, host_id):
         """
@@ -241,7 +253,19 @@ class TrunkManager(object):
         """
         return "public"
 
-    def _handle_snmp_vlan(self, host, snmp_switch, snmp_vlan, present_vlans):
+    def get_snmp_port(self, host):
+        """
+        Get the SNMP port of that host.
+        Can be overridden to change behaviour.
+
+        :param host: Host object (assumed to be a switch)
+        :type host: Host
+        :return: UDP port the host answers SNMP on
+        :rtype: int
+        """
+        return 161
+
+    def _handle_snmp_vlan(self, host, snmp_switch, snmp_vlan, present_vlans, vlan_transaction=None):
         """
         Handle a vlan present on the switch
 
@@ -253,7 +277,10 @@ class TrunkManager(object):
         :type snmp_vlan: CiscoVlan
         :param present_vlans: List of vlans that are present on the switch; bookkeeping for adding missing vlans.
         :type present_vlans: list[int]
+        :param vlan_transaction: Transaction the vlan edits are queued in, None to make them on snmp_switch
+        :type vlan_transaction: cisco_switch.rw.VlanTransaction
         """
+        edits = snmp_switch if vlan_transaction is None else vlan_transaction
         vlan = self.vlans[snmp_vlan.id] if snmp_vlan.id in self.vlans else None
         present_vlans.append(snmp_vlan.id)
         if host.id in self.vlan_map and snmp_vlan.id in self.vlan_map[host.id]:
@@ -262,13 +289,13 @@ class TrunkManager(object):
                 logging.info("Renaming Vlan {id} from {oname} to {nname} on {swname}"
                              .format(id=snmp_vlan.id, oname=oldname, nname=vlan.name, swname=host.name))
                 if not self.simulate:
-                    snmp_vlan.rename(vlan.name)
+                    edits.rename_vlan(snmp_vlan.id, vlan.name)
                     return True
         elif self.test_remove_vlan_switch(host, vlan, snmp_vlan):
             logging.info("Deleting Vlan {id} from {swname}"
                          .format(id=snmp_vlan.id, swname=host.name))
             if not self.simulate:
-                snmp_switch.delete_vlan(snmp_vlan.id)
+                edits.delete_vlan(snmp_vlan.id)
                 return True
 
     def _handle_port_vlans(self, host, snmp_switch, snmp_port, port):
@@ -284,9 +311,9 @@ class TrunkManager(object):
         :param port: Port object
         :type port: Port
         """
-        vlans_local = set(self.vlan_map[host.id])
-        vlans_remote = set(self.vlan_map[port.remote_id])
-        vlans_current = set(snmp_port.vlans())
+        vlans_local = VlanSet(self.vlan_map[host.id])
+        vlans_remote = VlanSet(self.vlan_map[port.remote_id])
+        vlans_current = snmp_port.vlan_set()
 
         vlans_link = vlans_local & vlans_remote
 
@@ -315,27 +342,30 @@ class TrunkManager(object):
             ud = True
         return ud
 
-    def _handle_host(self, host):
+    def _handle_host(self, host, snmp_switch):
         """
         Handle a host, most likely a switch. Add/prune Vlans from switch and trunks.
 
         :param host: Host object (assumed to be a switch)
         :type host: Host
+        :param snmp_switch: Snmp proxy for switch
+        :type snmp_switch: CiscoSwitch
         """
-        snmp_switch = CiscoSwitch(self.get_community(host), host.fqdn)
         snmp_vlans = snmp_switch.get_vlans()
         present_vlans = []
         ud = False
-        for snmp_vlan in snmp_vlans:
-            ud = self._handle_snmp_vlan(host, snmp_switch, snmp_vlan, present_vlans) or ud
-        for vlan_id in self.vlan_map[host.id]:
-            if vlan_id not in present_vlans:
-                vlan = self.vlans[vlan_id]
-                logging.info("Creating vlan {id} ({vlname}) on switch {swname}"
-                             .format(id=vlan_id, vlname=vlan.name, swname=host.name))
-                if not self.simulate:
-                    snmp_switch.create_vlan(vlan.id, vlan.name)
-                    ud = True
+        # Every vlan edit on the switch is made in one vlan edit transaction
+        with snmp_switch.vlan_transaction() as vlan_transaction:
+            for snmp_vlan in snmp_vlans:
+                ud = self._handle_snmp_vlan(host, snmp_switch, snmp_vlan, present_vlans, vlan_transaction) or ud
+            for vlan_id in self.vlan_map[host.id]:
+                if vlan_id not in present_vlans:
+                    vlan = self.vlans[vlan_id]
+                    logging.info("Creating vlan {id} ({vlname}) on switch {swname}"
+                                 .format(id=vlan_id, vlname=vlan.name, swname=host.name))
+                    if not self.simulate:
+                        vlan_transaction.create_vlan(vlan.id, vlan.name)
+                        ud = True
 
         ports = {self.remap_port_name(p.name): p for p in host.get_outgoing_links()}
         for snmp_port in snmp_switch.get_ports():
@@ -361,11 +391,25 @@ class TrunkManager(object):
         """
         Applies the topology to the network
         """
+        hosts = {}
         for host_id in self.vlan_map:
             host = self.get_host(host_id)
-            if not self.test_deploy_to_switch(host):
-                continue
-            try:
-                self._handle_host(host)
-            except IOError:
-                logging.warning("Could not connect to {hname}".format(hname=host.name))
+            if self.test_deploy_to_switch(host):
+                hosts[(host.fqdn, self.get_snmp_port(host))] = host
+
+        fleet = Fleet([(self.get_community(host), fqdn, port) for (fqdn, port), host in hosts.items()],
+                      workers=self.workers, host_deadline=self.host_deadline, index_store=self.index_store)
+        errors = []
+        for result in fleet.run(lambda snmp_switch: self._handle_host(
+                hosts[(snmp_switch.server, snmp_switch.session.port)], snmp_switch)):
+            hname = hosts[(result.host, result.port)].name
+            if isinstance(result.exception, TimeoutError):
+                logging.warning("Deadline passed before {hname} was done".format(hname=hname))
+            elif isinstance(result.exception, IOError):
+                logging.warning("Could not connect to {hname}".format(hname=hname))
+            elif result.exception is not None:
+                logging.error("Could not apply to {hname}".format(hname=hname), exc_info=result.exception)
+                errors.append(result.exception)
+        # Raised once the run is over; leaving it early would leave the other switches being written to
+        if errors:
+            raise errors[0]
@@ -0,0 +1,308 @@
+"""
+.. module:: trunks
+   :synopsis: Trunk state of the ports of a switch
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+
+What CiscoROSwitch.trunk_table returns, a TrunkState per port in vlanTrunkPortTable,
+and decoding of the vlan bitmaps in it; byte by byte through a lookup table,
+or for a whole table at once with NumPy if it is installed.
+
+VlanSet is the set of vlans carried by a trunk, in the same layout as the bitmaps on the switch.
+
+    >>> table = switch.trunk_table()
+    >>> table_vlans(table)
+    >>> wanted = switch.vlan_set_on_port(portindex=10101) | [20, 30]
+"""
+from itertools import compress
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'CVi'
+__all__ = ['TrunkState', 'VlanSet', 'bitmap_vlans', 'set_bits', 'table_vlans']
+
+# vlanTrunkPortDynamicStatus trunking(1), vlanTrunkPortEncapsulationOperType notApplicable(6)
+TRUNKING = 1
+NOT_APPLICABLE = 6
+# Bytes in each of the four vlanTrunkPortVlansEnabled columns, 1024 vlans
+BLOCK_SIZE = 128
+# Vlans in a block, and in all four
+BLOCK_VLANS = BLOCK_SIZE * 8
+VLANS = BLOCK_VLANS * 4
+_BLOCK_MASK = (1 << BLOCK_VLANS) - 1
+
+
+# Offsets of the bits set in each byte value, the most significant bit is 0
+_BYTE_BITS = tuple(tuple(bit for bit in range(8) if value & (0x80 >> bit)) for value in range(256))
+# Each byte value as eight bytes of 0 or 1, the most significant bit first
+_BYTE_FLAGS = tuple(bytes((value >> (7 - bit)) & 1 for bit in range(8)) for value in range(256))
+
+
+def bitmap_vlans(bitmap, first=0):
+    """
+    :param bitmap: Vlan bitmap, the most significant bit of the first byte is vlan first
+    :type bitmap: bytes
+    :param first: Vlan of the first bit
+    :type first: int
+    :return: The vlans with their bit set, ascending
+    :rtype: list[int]
+    """
+    if bitmap.count(0) * 4 >= len(bitmap) * 3:
+        # Mostly empty, only the bytes with bits set are looked at
+        vlans = []
+        for i, value in enumerate(bitmap):
+            if value:
+                base = first + i * 8
+                vlans.extend([base + bit for bit in _BYTE_BITS[value]])
+        return vlans
+    # A flag per vlan to pick the vlans with, all of it done in C
+    return list(compress(range(first, first + len(bitmap) * 8), b''.join(map(_BYTE_FLAGS.__getitem__, bitmap))))
+
+
+def set_bits(bitmap, offsets, status, size=BLOCK_SIZE):
+    """
+    Sets or clears bits of a bitmap.
+
+    :param bitmap: Current value, padded with zeroes to size bytes
+    :type bitmap: bytes
+    :param offsets: Bits to change, the most significant bit of the first byte is 0
+    :type offsets: collections.Iterable[int]
+    :param status: True to set the bits, False to clear them
+    :type status: bool
+    :return: The new value
+    :rtype: bytes
+    """
+    data = bytearray(bitmap[:size].ljust(size, b'\x00'))
+    for offset in offsets:
+        if status:
+            data[offset >> 3] |= 0x80 >> (offset & 7)
+        else:
+            data[offset >> 3] &= ~(0x80 >> (offset & 7)) & 0xff
+    return bytes(data)
+
+
+def table_vlans(table):
+    """
+    The vlans of every port in a trunk table that has a bitmap, decoded together.
+
+    :param table: TrunkState per ifIndex, as from CiscoROSwitch.trunk_table
+    :type table: dict[int, TrunkState]
+    :return: Vlans per ifIndex
+    :rtype: dict[int, list[int]]
+    """
+    ports = [(ifindex, port.bitmap) for ifindex, port in sorted(table.items()) if port.bitmap is not None]
+    if numpy is None or not ports:
+        return {ifindex: bitmap_vlans(bitmap) for ifindex, bitmap in ports}
+    size = max(len(bitmap) for ifindex, bitmap in ports)
+    bits = numpy.unpackbits(numpy.frombuffer(b''.join(bitmap.ljust(size, b'\x00') for ifindex, bitmap in ports),
+                                             dtype=numpy.uint8).reshape(len(ports), size), axis=1)
+    rows, vlans = numpy.nonzero(bits)
+    # nonzero goes row by row, so each port's vlans are a slice
+    ends = numpy.searchsorted(rows, numpy.arange(1, len(ports) + 1))
+    vlans = vlans.tolist()
+    starts = [0] + ends[:-1].tolist()
+    return {ifindex: vlans[start:end] for (ifindex, bitmap), start, end in zip(ports, starts, ends.tolist())}
+
+
+class TrunkState(object):
+    """
+    A port's row of vlanTrunkPortTable.
+    """
+    __slots__ = ('dynamic_state', 'dynamic_status', 'encapsulation', 'bitmap')
+
+    def __init__(self, dynamic_state=None, dynamic_status=None, encapsulation=None, bitmap=None):
+        """
+        :param dynamic_state: vlanTrunkPortDynamicState; on(1), off(2), desirable(3), auto(4), onNoNegotiate(5)
+        :type dynamic_state: int
+        :param dynamic_status: vlanTrunkPortDynamicStatus; trunking(1), notTrunking(2)
+        :type dynamic_status: int
+        :param encapsulation: vlanTrunkPortEncapsulationOperType; isl(1), dot1Q(4), notApplicable(6) and more
+        :type encapsulation: int
+        :param bitmap: The enabled vlans, 512 bytes for vlan 0-4095; None if not read
+        :type bitmap: bytes
+        """
+        self.dynamic_state = dynamic_state
+        self.dynamic_status = dynamic_status
+        self.encapsulation = encapsulation
+        self.bitmap = bitmap
+
+    @property
+    def trunking(self):
+        """
+        :return: True if the port is trunking
+        :rtype: bool
+        """
+        return self.dynamic_status == TRUNKING and self.encapsulation != NOT_APPLICABLE
+
+    def vlans(self):
+        """
+        :return: The vlans enabled on the port, ascending; None if the bitmap was not read
+        :rtype: list[int]
+        """
+        return None if self.bitmap is None else bitmap_vlans(self.bitmap)
+
+    def vlan_set(self):
+        """
+        :return: The vlans enabled on the port, None if the bitmap was not read
+        :rtype: VlanSet
+        """
+        return None if self.bitmap is None else VlanSet.from_bitmap(self.bitmap)
+
+    def __repr__(self):
+        return "<TrunkState: state {0}, status {1}, encapsulation {2}>".format(
+            self.dynamic_state, self.dynamic_status, self.encapsulation)
+
+
+class VlanSet(object):
+    """
+    An immutable set of vlans 0-4095, kept as one 4096 bit integer.
+    Vlan 0 is the most significant bit, as in the vlanTrunkPortVlansEnabled bitmaps,
+    so a block is a slice of the integer and set algebra is a single operation on it.
+
+    The operators take any iterable of vlans as the other operand, the result is a VlanSet.
+
+        >>> current = VlanSet.from_blocks({0: block})
+        >>> wanted = (current | [20, 30]) - [1]
+        >>> for block in wanted.dirty_blocks(current):
+        ...     value = wanted.block(block)
+    """
+    __slots__ = ('bits',)
+
+    def __init__(self, vlans=()):
+        """
+        :param vlans: The vlans in the set
+        :type vlans: collections.Iterable[int]
+        :raises ValueError: If a vlan is outside 0-4095
+        """
+        if isinstance(vlans, VlanSet):
+            self.bits = vlans.bits
+            return
+        data = bytearray(VLANS // 8)
+        for vlan in vlans:
+            if vlan < 0 or vlan >= VLANS:
+                raise ValueError("Invalid VLAN {0}".format(vlan))
+            data[vlan >> 3] |= 0x80 >> (vlan & 7)
+        self.bits = int.from_bytes(data, 'big')
+
+    @classmethod
+    def _from_bits(cls, bits):
+        vlans = cls.__new__(cls)
+        vlans.bits = bits
+        return vlans
+
+    @classmethod
+    def from_bitmap(cls, bitmap):
+        """
+        :param bitmap: Vlan bitmap, vlan 0 is the most significant bit of the first byte; padded with zeroes
+        :type bitmap: bytes
+        :rtype: VlanSet
+        """
+        return cls._from_bits(int.from_bytes(bytes(bitmap[:VLANS // 8]).ljust(VLANS // 8, b'\x00'), 'big'))
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        """
+        :param blocks: Value of each block, the blocks left out are empty
+        :type blocks: dict[int, bytes] | list[bytes]
+        :rtype: VlanSet
+        :raises ValueError: If there is no such block
+        """
+        bits = 0
+        for block, value in (blocks.items() if isinstance(blocks, dict) else enumerate(blocks)):
+            if block < 0 or block >= VLANS // BLOCK_VLANS:
+                raise ValueError("Invalid VLAN block {0}".format(block))
+            value = int.from_bytes(bytes(value[:BLOCK_SIZE]).ljust(BLOCK_SIZE, b'\x00'), 'big')
+            bits |= value << ((VLANS // BLOCK_VLANS - 1 - block) * BLOCK_VLANS)
+        return cls._from_bits(bits)
+
+    def bitmap(self):
+        """
+        :return: All four blocks, 512 bytes
+        :rtype: bytes
+        """
+        return self.bits.to_bytes(VLANS // 8, 'big')
+
+    def block(self, block):
+        """
+        :param block: Block number, vlan 1024 * block is its first
+        :type block: int
+        :return: The value of the block, 128 bytes
+        :rtype: bytes
+        """
+        return self._block_bits(block).to_bytes(BLOCK_SIZE, 'big')
+
+    def _block_bits(self, block):
+        return (self.bits >> ((VLANS // BLOCK_VLANS - 1 - block) * BLOCK_VLANS)) & _BLOCK_MASK
+
+    def dirty_blocks(self, other=()):
+        """
+        :param other: The vlans to compare with, by default none
+        :type other: collections.Iterable[int]
+        :return: The blocks that differ from those of other, ascending
+        :rtype: list[int]
+        """
+        diff = VlanSet._from_bits(self.bits ^ _bits(other))
+        return [block for block in range(VLANS // BLOCK_VLANS) if diff._block_bits(block)]
+
+    def isdisjoint(self, other):
+        return not self.bits & _bits(other)
+
+    def __contains__(self, vlan):
+        return 0 <= vlan < VLANS and bool((self.bits >> (VLANS - 1 - vlan)) & 1)
+
+    def __iter__(self):
+        return iter(bitmap_vlans(self.bitmap()) if self.bits else ())
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __bool__(self):
+        return bool(self.bits)
+
+    def __eq__(self, other):
+        if not isinstance(other, VlanSet):
+            return NotImplemented
+        return self.bits == other.bits
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __le__(self, other):
+        return self.bits & ~_bits(other) == 0
+
+    def __ge__(self, other):
+        return _bits(other) & ~self.bits == 0
+
+    def __and__(self, other):
+        return VlanSet._from_bits(self.bits & _bits(other))
+
+    def __or__(self, other):
+        return VlanSet._from_bits(self.bits | _bits(other))
+
+    def __xor__(self, other):
+        return VlanSet._from_bits(self.bits ^ _bits(other))
+
+    def __sub__(self, other):
+        return VlanSet._from_bits(self.bits & ~_bits(other))
+
+    def __rsub__(self, other):
+        return VlanSet._from_bits(_bits(other) & ~self.bits)
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    def __repr__(self):
+        return "VlanSet({0})".format(list(self))
+
+
+def _bits(vlans):
+    """
+    :param vlans: A VlanSet or any iterable of vlans
+    :return: The bits of the vlans as in VlanSet
+    :rtype: int
+    """
+    return vlans.bits if isinstance(vlans, VlanSet) else VlanSet(vlans).bits
@@ -0,0 +1,117 @@
+"""
+.. module:: test_counters
+   :synopsis: Tests for the counter rates
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+"""
+import math
+import unittest
+from array import array
+from unittest import mock
+from cisco_switch import counters
+from cisco_switch.counters import InterfaceCounters, rates
+
+__author__ = 'CVi'
+
+
+def reading(rows, narrow=(), uptime=None, timestamp=0.0):
+    """
+    :param rows: in_octets per ifIndex, or every counter as a dict
+    :rtype: InterfaceCounters
+    """
+    rows = {index: row if isinstance(row, dict) else {'in_octets': row} for index, row in rows.items()}
+    return InterfaceCounters.from_rows(rows, narrow, uptime, timestamp)
+
+
+class RatesTest(object):
+    """
+    rates() on hand built readings; run with NumPy and in plain Python by the subclasses.
+    """
+    def test_rate(self):
+        result = rates(reading({1: 1000}, timestamp=0.0), reading({1: 3000}, timestamp=10.0))
+        self.assertEqual(result.seconds, 10.0)
+        self.assertEqual(result[1]['in_octets'], 200.0)
+        self.assertEqual(result[1]['out_octets'], 0.0)
+
+    def test_seconds_by_uptime(self):
+        result = rates(reading({1: 0}, uptime=100000, timestamp=0.0),
+                       reading({1: 500}, uptime=100500, timestamp=6.0))
+        self.assertEqual(result.seconds, 5.0)
+        self.assertEqual(result[1]['in_octets'], 100.0)
+
+    def test_32_bit_wrap(self):
+        old = reading({1: 2 ** 32 - 100}, narrow=[1], timestamp=0.0)
+        new = reading({1: 50}, narrow=[1], timestamp=10.0)
+        self.assertEqual(rates(old, new)[1]['in_octets'], 15.0)
+
+    def test_error_counters_wrap_at_32_bit(self):
+        old = reading({1: {'in_octets': 0, 'in_errors': 2 ** 32 - 10}}, timestamp=0.0)
+        new = reading({1: {'in_octets': 0, 'in_errors': 10}}, timestamp=10.0)
+        self.assertEqual(rates(old, new)[1]['in_errors'], 2.0)
+
+    def test_64_bit_no_wrap(self):
+        old = reading({1: 2 ** 32 - 100}, timestamp=0.0)
+        new = reading({1: 2 ** 33}, timestamp=1.0)
+        self.assertEqual(rates(old, new)[1]['in_octets'], 2 ** 33 - 2 ** 32 + 100)
+
+    def test_64_bit_reset(self):
+        old = reading({1: 2 ** 40, 2: 100}, timestamp=0.0)
+        new = reading({1: 5, 2: 200}, timestamp=10.0)
+        result = rates(old, new)
+        self.assertTrue(math.isnan(result[1]['in_octets']))
+        self.assertEqual(result[2]['in_octets'], 10.0)
+
+    def test_uptime_back(self):
+        old = reading({1: 0}, uptime=100000, timestamp=0.0)
+        new = reading({1: 100}, uptime=500, timestamp=10.0)
+        self.assertRaises(ValueError, rates, old, new)
+
+    def test_uptime_behind_elapsed(self):
+        # Restarted and up for less time than passed since the first reading
+        old = reading({1: 0}, uptime=100, timestamp=0.0)
+        new = reading({1: 100}, uptime=200, timestamp=60.0)
+        self.assertRaises(ValueError, rates, old, new)
+
+    def test_not_apart(self):
+        self.assertRaises(ValueError, rates, reading({1: 0}, timestamp=5.0), reading({1: 0}, timestamp=5.0))
+
+    def test_interfaces_added_and_removed(self):
+        old = reading({1: 100, 2: 100, 3: 100}, timestamp=0.0)
+        new = reading({2: 200, 3: 300, 4: 400}, timestamp=10.0)
+        result = rates(old, new)
+        self.assertEqual(list(result), [2, 3])
+        self.assertEqual(result[2]['in_octets'], 10.0)
+        self.assertEqual(result[3]['in_octets'], 20.0)
+        self.assertNotIn(1, result)
+        self.assertNotIn(4, result)
+
+    def test_width_changed(self):
+        # 32 bit in one reading, as an interface that lost its HC counters; wraps at 32 bit
+        old = reading({1: 2 ** 32 - 10}, timestamp=0.0)
+        new = reading({1: 10}, narrow=[1], timestamp=10.0)
+        self.assertEqual(rates(old, new)[1]['in_octets'], 2.0)
+
+    def test_no_interfaces(self):
+        self.assertEqual(len(rates(reading({}, timestamp=0.0), reading({1: 0}, timestamp=1.0))), 0)
+
+
+@unittest.skipIf(counters.numpy is None, "NumPy is not installed")
+class NumpyRatesTest(RatesTest, unittest.TestCase):
+    def test_columns(self):
+        result = rates(reading({1: 0}, timestamp=0.0), reading({1: 0}, timestamp=1.0))
+        self.assertIsInstance(result.column('in_octets'), counters.numpy.ndarray)
+
+
+class PythonRatesTest(RatesTest, unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(counters, 'numpy', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_columns(self):
+        result = rates(reading({1: 0}, timestamp=0.0), reading({1: 0}, timestamp=1.0))
+        self.assertIsInstance(result.column('in_octets'), array)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+.. module:: test_trunks
+   :synopsis: Tests for VlanSet and the trunk vlans of a switch
+
+.. moduleauthor:: Christoffer Viken <christoffer@viken.me>
+"""
+import unittest
+from cisco_switch import CiscoSwitch
+from cisco_switch.simulator import SimulatedFleet
+from cisco_switch.trunks import VlanSet, BLOCK_SIZE
+
+__author__ = 'CVi'
+
+# Vlans at the edges of the blocks
+EDGES = [0, 1, 1023, 1024, 2047, 2048, 3071, 3072, 4095]
+
+
+class VlanSetTest(unittest.TestCase):
+    def test_vlan_0_is_most_significant(self):
+        bitmap = VlanSet([0]).bitmap()
+        self.assertEqual(len(bitmap), 4 * BLOCK_SIZE)
+        self.assertEqual(bitmap[0], 0x80)
+        self.assertEqual(VlanSet([7]).bitmap()[0], 0x01)
+        self.assertEqual(VlanSet([8]).bitmap()[1], 0x80)
+        self.assertEqual(VlanSet([4095]).bitmap()[-1], 0x01)
+
+    def test_order(self):
+        self.assertEqual(list(VlanSet([4095, 20, 0, 1024, 1023])), [0, 20, 1023, 1024, 4095])
+
+    def test_from_bitmap(self):
+        self.assertEqual(VlanSet.from_bitmap(b'\x80\x01'), VlanSet([0, 15]))
+        self.assertEqual(VlanSet.from_bitmap(VlanSet(EDGES).bitmap()), VlanSet(EDGES))
+
+    def test_blocks(self):
+        vlans = VlanSet(EDGES)
+        self.assertEqual(VlanSet.from_blocks([vlans.block(block) for block in range(4)]), vlans)
+        self.assertEqual(VlanSet.from_blocks({1: VlanSet([1024]).block(1)}), VlanSet([1024]))
+        self.assertEqual(VlanSet([1023]).block(0)[-1], 0x01)
+        self.assertEqual(VlanSet([1024]).block(1)[0], 0x80)
+        self.assertEqual(VlanSet([4095]).block(3)[-1], 0x01)
+        self.assertEqual(VlanSet([1023]).block(1), bytes(BLOCK_SIZE))
+
+    def test_short_block(self):
+        self.assertEqual(VlanSet.from_blocks({3: b'\x80'}), VlanSet([3072]))
+
+    def test_invalid_block(self):
+        self.assertRaises(ValueError, VlanSet.from_blocks, {4: b'\x80'})
+        self.assertRaises(ValueError, VlanSet.from_blocks, {-1: b'\x80'})
+
+    def test_dirty_blocks(self):
+        current = VlanSet([1, 1023, 4095])
+        self.assertEqual(current.dirty_blocks(current), [])
+        self.assertEqual((current | [1024]).dirty_blocks(current), [1])
+        self.assertEqual((current - [1023]).dirty_blocks(current), [0])
+        self.assertEqual((current ^ [1023, 1024, 4095]).dirty_blocks(current), [0, 1, 3])
+        self.assertEqual(current.dirty_blocks(), [0, 3])
+
+    def test_operators(self):
+        vlans = VlanSet([1, 2, 3])
+        self.assertEqual(vlans | [4], VlanSet([1, 2, 3, 4]))
+        self.assertEqual(vlans & [2, 4], VlanSet([2]))
+        self.assertEqual(vlans - [1], VlanSet([2, 3]))
+        self.assertEqual(vlans ^ [3, 4], VlanSet([1, 2, 4]))
+
+    def test_reflected_operators(self):
+        vlans = VlanSet([2, 3])
+        self.assertEqual([1, 2] - vlans, VlanSet([1]))
+        self.assertEqual([1, 2] | vlans, VlanSet([1, 2, 3]))
+        self.assertEqual([1, 2] & vlans, VlanSet([2]))
+        self.assertEqual([1, 2] ^ vlans, VlanSet([1, 3]))
+        self.assertIsInstance({1, 2} - vlans, VlanSet)
+
+    def test_comparisons(self):
+        vlans = VlanSet([1, 2])
+        self.assertTrue(vlans <= [1, 2, 3])
+        self.assertTrue(vlans >= [1])
+        self.assertFalse(vlans <= [1])
+        self.assertTrue(vlans.isdisjoint([3, 4095]))
+        self.assertNotEqual(vlans, [1, 2])
+        self.assertEqual(VlanSet(vlans), vlans)
+
+    def test_contains(self):
+        vlans = VlanSet(EDGES)
+        for vlan in EDGES:
+            self.assertIn(vlan, vlans)
+        self.assertNotIn(2, vlans)
+        self.assertNotIn(-1, vlans)
+        self.assertNotIn(4096, vlans)
+        self.assertEqual(len(vlans), len(EDGES))
+        self.assertFalse(VlanSet())
+
+    def test_invalid_vlan(self):
+        self.assertRaises(ValueError, VlanSet, [4096])
+        self.assertRaises(ValueError, VlanSet, [-1])
+        self.assertRaises(ValueError, VlanSet([1]).__or__, [4096])
+        self.assertRaises(ValueError, lambda: [-1] - VlanSet([1]))
+
+
+class TrunkVlansTest(unittest.TestCase):
+    """
+    _meta_vlan against a simulated switch.
+    """
+    def setUp(self):
+        self.fleet = SimulatedFleet(1, vlans=range(1, 11)).start()
+        self.addCleanup(self.fleet.stop)
+        community, host, port = self.fleet.targets()[0]
+        self.switch = CiscoSwitch(community, host, port=port)
+        self.addCleanup(self.switch.close)
+        self.portindex = 10101
+
+    def test_activate_and_deactivate(self):
+        self.switch.deactivate_vlans_on_port(portindex=self.portindex, vlans=range(1, 4096))
+        self.assertEqual(self.switch.vlan_set_on_port(portindex=self.portindex), VlanSet())
+        self.switch.activate_vlans_on_port(portindex=self.portindex, vlans=[1, 1023, 1024, 4095])
+        self.assertEqual(self.switch.vlan_set_on_port(portindex=self.portindex), VlanSet([1, 1023, 1024, 4095]))
+        self.switch.deactivate_vlans_on_port(portindex=self.portindex, vlans=[1, 1024])
+        self.assertEqual(self.switch.vlan_set_on_port(portindex=self.portindex), VlanSet([1023, 4095]))
+        self.assertEqual(self.switch.vlans_on_port(portindex=self.portindex), [1023, 4095])
+
+    def test_single_vlan(self):
+        self.switch.deactivate_vlan_on_port(portindex=self.portindex, vlanid=2)
+        self.assertNotIn(2, self.switch.vlan_set_on_port(portindex=self.portindex))
+        self.switch.activate_vlan_on_port(portindex=self.portindex, vlanid=2)
+        self.assertIn(2, self.switch.vlan_set_on_port(portindex=self.portindex))
+
+
+if __name__ == '__main__':
+    unittest.main()